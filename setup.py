@@ -20,5 +20,5 @@ setup(
     zip_safe=False,
     entry_points={
         'console_scripts': ['rore= rore.shell:cmd', ]},
-    install_requires=['python-redmine>=0.7.2', ],
+    install_requires=['python-redmine>=0.7.2,<2', ],
 )
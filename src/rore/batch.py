@@ -0,0 +1,307 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Run issue operations read from a JSONL or CSV file.
+
+Each operation is a record with an "op" of create, update, close, relate
+or delete_relation, and the fields the matching issues option takes:
+
+    {"op": "create", "project": "deploy", "subject": "Disk full"}
+    {"op": "update", "id": 1234, "status": "In Progress", "notes": "..."}
+    {"op": "close", "id": 1234, "notes": "Fixed"}
+    {"op": "relate", "id": 1234, "relate_to": 1235, "relation_type": "blocks"}
+    {"op": "delete_relation", "relation": 99}
+
+Operations are known by their "key", or else their position in the file,
+so a result log can tell a later run which ones already succeeded.
+"""
+
+import csv
+import json
+import threading
+
+from . import shell
+
+
+# Fields naming something that has to be looked up, what they become, and
+# how to look them up
+LOOKUPS = {
+    'type': ('tracker_id', shell.get_tracker),
+    'status': ('status_id', shell.get_status),
+    'priority': ('priority_id', shell.get_priority),
+    # Every operation changes issues, so only exact names will do
+    'assigned_to': ('assigned_to_id',
+                    lambda rmine, name: shell.get_user(rmine, name, True)),
+    'project': ('project_id',
+                lambda rmine, name: shell.get_project(rmine, name, True)),
+}
+
+# What relation_type may be
+RELATION_TYPES = ('relates', 'duplicates', 'blocks', 'blocked', 'precedes',
+                  'follows')
+
+# Fields passed on as they are
+FIELDS = {
+    'subject': 'subject',
+    'description': 'description',
+    'notes': 'notes',
+}
+
+
+def read_operations(stream, fmt='jsonl'):
+    """Get the (key, operation) pairs in a JSONL or CSV stream."""
+
+    if fmt == 'csv':
+        rows = (dict((k, v.decode('utf-8')) for k, v in row.items() if v)
+                for row in csv.DictReader(stream))
+    else:
+        rows = (line for line in stream if line.strip())
+    operations = []
+    for number, row in enumerate(rows, 1):
+        if fmt != 'csv':
+            try:
+                row = json.loads(row)
+            except ValueError as e:
+                raise RuntimeError('Operation %s is not JSON: %s' %
+                                   (number, e))
+        operations.append((unicode(row.pop('key', number)), row))
+    return operations
+
+
+def completed(path):
+    """Get the keys of the operations a result log says succeeded."""
+
+    done = set()
+    try:
+        with open(path) as fh:
+            for line in fh:
+                result = json.loads(line)
+                if result['ok']:
+                    done.add(result['key'])
+    except IOError:
+        pass
+    return done
+
+
+class ResultLog(object):
+    """Append one JSON line per finished operation to a file, if any."""
+
+    def __init__(self, path=None):
+        self.fh = open(path, 'a') if path else None
+        self.lock = threading.Lock()
+
+    def write(self, result):
+        if self.fh is None:
+            return
+        with self.lock:
+            self.fh.write(json.dumps(result) + '\n')
+            self.fh.flush()
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+
+
+class Resolver(object):
+    """Look up each name once, before any operation runs.
+
+    Lookups that fail are remembered too, and fail every operation
+    using them.
+    """
+
+    def __init__(self, rmine):
+        self.rmine = rmine
+        self.ids = {}
+
+    def prefetch(self, operations, defaults):
+        for key, op in operations:
+            for field in LOOKUPS:
+                if op.get(field):
+                    self.lookup(field, op[field])
+            if op.get('op') == 'create' and not op.get('type'):
+                self.lookup('type', defaults['type'])
+            if op.get('op') == 'create' and not op.get('project'):
+                if defaults.get('project'):
+                    self.lookup('project', defaults['project'])
+            if op.get('op') == 'close':
+                self.lookup('status', 'Closed')
+
+    def lookup(self, field, name):
+        key = (field, unicode(name).lower())
+        if key not in self.ids:
+            try:
+                self.ids[key] = LOOKUPS[field][1](self.rmine, name)
+            except Exception as e:
+                self.ids[key] = e
+        return self.ids[key]
+
+    def __call__(self, field, name):
+        found = self.lookup(field, name)
+        if isinstance(found, Exception):
+            raise found
+        return found
+
+
+def issue_fields(resolve, op):
+    """Turn an operation's fields into those of a Redmine issue."""
+
+    fields = dict((FIELDS[f], op[f]) for f in FIELDS if op.get(f))
+    for field, (name, lookup) in LOOKUPS.items():
+        if op.get(field):
+            fields[name] = resolve(field, op[field])
+    return fields
+
+
+def apply_operation(rmine, resolve, op, defaults):
+    """Run one operation, returning the ID of the issue or relation."""
+
+    kind = op.get('op')
+    if kind == 'create':
+        fields = issue_fields(resolve, op)
+        if defaults.get('project') and 'project_id' not in fields:
+            fields['project_id'] = resolve('project', defaults['project'])
+        if not fields.get('project_id') or not fields.get('subject'):
+            raise RuntimeError('project and subject must be defined')
+        if 'tracker_id' not in fields:
+            fields['tracker_id'] = resolve('type', defaults['type'])
+        issue = rmine.issue.create(**fields)
+        if op.get('relate_to'):
+            shell.create_relation(rmine, issue.id, int(op['relate_to']),
+                                  op.get('relation_type', 'relates'))
+        return issue.id
+    if kind == 'delete_relation':
+        rmine.issue_relation.delete(int(op['relation']))
+        return int(op['relation'])
+    if kind not in ('update', 'close', 'relate'):
+        raise RuntimeError('Unknown operation %s' % kind)
+    ID = int(op['id'])
+    rmine.issue_cache.pop(ID, None)
+    if kind == 'update':
+        fields = issue_fields(resolve, op)
+        if fields:
+            rmine.issue.update(ID, **fields)
+        if op.get('relate_to'):
+            shell.create_relation(rmine, ID, int(op['relate_to']),
+                                  op.get('relation_type', 'relates'))
+        return ID
+    if kind == 'close':
+        rmine.issue.update(ID, status_id=resolve('status', 'Closed'),
+                           notes=op.get('notes'))
+        return ID
+    relation = shell.create_relation(rmine, ID, int(op['relate_to']),
+                                     op.get('relation_type', 'relates'))
+    return relation.id
+
+
+def run_batch(rmine, operations, defaults, jobs=1, log=None):
+    """Run operations, jobs at a time, logging each result to log.
+
+    Returns the number of operations that failed.
+    """
+
+    resolve = Resolver(rmine)
+    resolve.prefetch(operations, defaults)
+    log = log or ResultLog()
+
+    def run(index):
+        key, op = operations[index]
+        try:
+            ID = apply_operation(rmine, resolve, op, defaults)
+        except Exception as e:
+            log.write({'key': key, 'op': op.get('op'), 'ok': False,
+                       'error': str(e)})
+            shell.LOG.error('%s %s failed: %s' % (op.get('op'), key, e))
+            raise
+        log.write({'key': key, 'op': op.get('op'), 'ok': True, 'id': ID})
+        shell.LOG.info('%s %s: %s' % (op.get('op'), key, ID))
+
+    results = shell.bulk_apply(run, range(len(operations)), jobs)
+    return len([error for index, error in results if error is not None])
+
+
+def check_create(resolve, op, defaults, keys):
+    """Raise an error if a create operation can't be run."""
+
+    fields = issue_fields(resolve, op)
+    if not (fields.get('project_id') or defaults.get('project')):
+        raise RuntimeError('project must be defined')
+    if not fields.get('subject'):
+        raise RuntimeError('subject must be defined')
+    target = unicode(op.get('relate_to') or '')
+    if target.startswith('@'):
+        if target[1:] not in keys:
+            raise RuntimeError('relate_to %s is not a row' % target)
+    elif target and not target.isdigit():
+        raise RuntimeError('relate_to %s is not an issue ID or @row' %
+                           target)
+    if op.get('relation_type', 'relates') not in RELATION_TYPES:
+        raise RuntimeError('Unknown relation_type %s' % op['relation_type'])
+
+
+def create_issues(rmine, rows, defaults, jobs=1):
+    """Create an issue per (key, row), jobs at a time, then relate them.
+
+    A relate_to of @KEY means the issue created for row KEY, so relations
+    are only made once every issue exists.  Every row is checked and
+    every name looked up first, and if any row is wrong nothing is
+    created.  Returns (key, issue ID, error) for each row, the ID being
+    None if the row failed and the error None if it didn't.
+    """
+
+    operations = [(key, dict(row, op='create')) for key, row in rows]
+    resolve = Resolver(rmine)
+    resolve.prefetch(operations, defaults)
+    keys = set(key for key, op in operations)
+    invalid = 0
+    for key, op in operations:
+        try:
+            check_create(resolve, op, defaults, keys)
+        except Exception as e:
+            shell.LOG.error('Row %s: %s' % (key, e))
+            invalid += 1
+    if invalid:
+        raise RuntimeError('%s of %s rows are wrong, nothing was created' %
+                           (invalid, len(operations)))
+
+    created = {}
+    errors = {}
+
+    def create(index):
+        key, op = operations[index]
+        created[key] = apply_operation(rmine, resolve,
+                                       dict(op, relate_to=None), defaults)
+
+    def relate(index):
+        key, op = operations[index]
+        target = unicode(op['relate_to'])
+        if target.startswith('@'):
+            if target[1:] not in created:
+                raise RuntimeError('row %s was not created' % target[1:])
+            target = created[target[1:]]
+        shell.create_relation(rmine, created[key], int(target),
+                              op.get('relation_type', 'relates'))
+
+    for index, error in shell.bulk_apply(create, range(len(operations)),
+                                         jobs):
+        if error is not None:
+            errors[operations[index][0]] = str(error)
+    related = [index for index, (key, op) in enumerate(operations)
+               if op.get('relate_to') and key in created]
+    for index, error in shell.bulk_apply(relate, related, jobs):
+        if error is not None:
+            errors[operations[index][0]] = ('created, but not related: %s' %
+                                            error)
+    return [(key, created.get(key), errors.get(key))
+            for key, op in operations]
@@ -0,0 +1,116 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import json
+import logging
+import os
+import threading
+import time
+
+
+LOG = logging.getLogger('rore')
+
+# Defaults for the cache options in ~/.rore
+DEFAULT_CACHE_DIR = '~/.cache/rore'
+DEFAULT_CACHE_TTL = 3600
+
+
+class MetadataCache(object):
+    """Cache of Redmine lookup tables (trackers, statuses, users...).
+
+    Tables are stored in a JSON file, one file per site, and each table
+    expires ttl seconds after it was fetched.  A path of None keeps the
+    cache in memory only.
+    """
+
+    def __init__(self, path=None, url=None, ttl=DEFAULT_CACHE_TTL,
+                 refresh=False):
+        self.path = path
+        self.url = url
+        self.ttl = ttl
+        self.tables = {}
+        self.lock = threading.RLock()
+        # For --trace
+        self.hits = self.misses = 0
+        if path and not refresh:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as fh:
+                data = json.load(fh)
+        except (IOError, ValueError):
+            return
+        # A site section may be repointed at another server
+        if data.get('url') != self.url:
+            LOG.debug('Ignoring stale cache %s' % self.path)
+            return
+        self.tables = data.get('tables', {})
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        cachedir = os.path.dirname(self.path)
+        try:
+            os.makedirs(cachedir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                LOG.debug("Couldn't create cache dir %s: %s" % (cachedir, e))
+                return
+        # Write to a temp file first so readers never see half a cache
+        import tempfile
+        try:
+            fd, tmpname = tempfile.mkstemp(dir=cachedir, suffix='.tmp')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump({'url': self.url, 'tables': self.tables}, fh)
+            os.rename(tmpname, self.path)
+        except (IOError, OSError) as e:
+            LOG.debug("Couldn't write cache %s: %s" % (self.path, e))
+
+    def get(self, table):
+        """Return the cached table, or None if missing or expired."""
+
+        entry = self.tables.get(table)
+        if entry is None or time.time() - entry['stamp'] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['value']
+
+    def set(self, table, value):
+        with self.lock:
+            self.tables[table] = {'stamp': time.time(), 'value': value}
+            self.save()
+
+    def invalidate(self, table):
+        with self.lock:
+            if self.tables.pop(table, None) is not None:
+                self.save()
+
+    def clear(self):
+        with self.lock:
+            self.tables = {}
+            self.save()
+
+
+def cache_path(cachedir, site):
+    """Get the cache file for a --site section."""
+
+    return os.path.join(os.path.expanduser(cachedir), '%s.json' % site)
@@ -0,0 +1,327 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+# datetime.strptime imports _strptime the first time it's called, and
+# threads calling it together can find it half imported.  python-redmine
+# calls it for every attribute it reads, so import it before any --jobs.
+import _strptime  # noqa
+import copy
+import json
+import threading
+import time
+
+import redmine
+from redmine import exceptions as rm_exc
+from redmine.packages import requests
+
+from .cache import MetadataCache
+from .httpcache import request_key
+
+# How many issues to ask for in one list call.  Redmine caps a page at
+# 100 unless the server's limit has been raised.
+DEFAULT_BATCH_SIZE = 100
+
+# Defaults for the HTTP options in ~/.rore
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 120
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+
+# Responses worth trying again after a pause
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Responses saying the server has more than it can take, which the
+# threads engine answers by slowing down, see Engine
+OVERLOAD_STATUSES = (429, 503)
+
+# Requests the threads engine makes at once unless ~/.rore says otherwise
+DEFAULT_CONCURRENCY = 8
+
+# Errors for the statuses redmine.Redmine.request knows about
+STATUS_ERRORS = {
+    401: rm_exc.AuthError,
+    403: rm_exc.ForbiddenError,
+    404: rm_exc.ResourceNotFoundError,
+    409: rm_exc.ConflictError,
+    413: rm_exc.RequestEntityTooLargeError,
+    500: rm_exc.ServerError,
+}
+
+
+def make_session(pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, gzip=True, statuses=RETRY_STATUSES):
+    """Build a keep-alive HTTP session with retries for one site.
+
+    Responses with the given statuses are retried after a pause.
+    """
+
+    session = requests.Session()
+    # Only reads are sent again: an update Redmine applied before failing
+    # would add its notes twice.  Once out of retries, the last response
+    # goes to process_response like any other.  Heeding Retry-After would
+    # retry 429 and 503 whatever statuses says.
+    retry = requests.adapters.Retry(
+        total=retries, backoff_factor=backoff, status_forcelist=statuses,
+        method_whitelist=frozenset(['GET', 'HEAD']), raise_on_status=False,
+        respect_retry_after_header=429 in statuses)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size,
+                                            max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if not gzip:
+        session.headers['Accept-Encoding'] = 'identity'
+    return session
+
+
+class RateLimiter(object):
+    """Space calls out to at most rate a second, across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def retry_after(response):
+    """Get the seconds a response's Retry-After asks us to wait, or None.
+    """
+
+    try:
+        return max(0.0, float(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        # Missing, or given as a date
+        return None
+
+
+class Engine(object):
+    """Let up to limit requests run at once across threads, fewer while
+    the server is overloaded.
+
+    A 429 or 503 halves how many may run and holds every request back
+    for the response's Retry-After, or an exponential backoff.  After
+    each run of as many successes as are allowed, one more may run
+    again, up to limit.
+    """
+
+    def __init__(self, limit=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF):
+        self.limit = limit
+        self.retries = retries
+        self.backoff = backoff
+        self.allowed = limit
+        self.running = 0
+        self.successes = 0
+        # Overloaded responses in a row, for the backoff
+        self.strikes = 0
+        # No request starts before this time
+        self.resume = 0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        """Wait for a turn to make a request."""
+
+        with self.cond:
+            while True:
+                pause = self.resume - time.time()
+                if pause > 0:
+                    self.cond.wait(pause)
+                elif self.running >= self.allowed:
+                    self.cond.wait()
+                else:
+                    break
+            self.running += 1
+
+    def release(self, response=None):
+        """End a turn, slowing down if response says the server is
+        overloaded.  Returns whether it did.
+        """
+
+        with self.cond:
+            self.running -= 1
+            overloaded = (response is not None and
+                          response.status_code in OVERLOAD_STATUSES)
+            if overloaded:
+                pause = retry_after(response)
+                if pause is None:
+                    pause = self.backoff * 2 ** self.strikes
+                self.strikes += 1
+                self.allowed = max(1, self.allowed // 2)
+                self.successes = 0
+                self.resume = max(self.resume, time.time() + pause)
+            elif response is not None:
+                self.strikes = 0
+                self.successes += 1
+                if self.successes >= self.allowed:
+                    self.successes = 0
+                    self.allowed = min(self.limit, self.allowed + 1)
+            self.cond.notify_all()
+        return overloaded
+
+
+class Redmine(redmine.Redmine):
+    """A Redmine client that carries rore's per-site state."""
+
+    def __init__(self, url, cache=None, batch_size=DEFAULT_BATCH_SIZE,
+                 session=None, mirror=None, response_cache=None, **kwargs):
+        super(Redmine, self).__init__(url, **kwargs)
+        if cache is None:
+            cache = MetadataCache(url=self.url)
+        self.cache = cache
+        self.batch_size = batch_size
+        if session is None:
+            session = make_session()
+        self.session = session
+        # Local copy of the site's issues, see Mirror
+        self.mirror = mirror
+        # GET responses to revalidate rather than download again, see
+        # ResponseCache
+        self.response_cache = response_cache
+        # Issues fetched so far, by ID, for the life of this client
+        self.issue_cache = {}
+        # A RateLimiter every request waits on, if set
+        self.throttle = None
+        # The Engine every request takes a turn from, with engine=threads
+        self.engine = None
+        # How many requests commands that fan out make at once, unless
+        # given --jobs
+        self.jobs = 1
+        # The site's default tracker and project for new issues
+        self.defaults = {}
+        # A trace.Tracer timing every request, with --trace
+        self.tracer = None
+
+    def copy(self):
+        """Get a client sharing our session and caches, but no issues."""
+
+        client = copy.copy(self)
+        client.issue_cache = {}
+        return client
+
+    def request(self, method, url, headers=None, params=None, data=None,
+                raw_response=False):
+        """Make a request to Redmine and return the decoded JSON.
+
+        This is redmine.Redmine.request sent through our session.  The
+        library's version uses a new connection for every request.
+        """
+
+        kwargs = dict(self.requests, headers=headers or {},
+                      params=params or {}, data=data or {})
+
+        if ('Content-Type' not in kwargs['headers'] and
+                method in ('post', 'put')):
+            kwargs['data'] = json.dumps(data)
+            kwargs['headers']['Content-Type'] = 'application/json'
+
+        if self.impersonate is not None:
+            kwargs['headers']['X-Redmine-Switch-User'] = self.impersonate
+
+        # We would like to be authenticated by API key by default
+        if 'key' not in kwargs['params'] and self.key is not None:
+            kwargs['params']['key'] = self.key
+        else:
+            kwargs['auth'] = (self.username, self.password)
+
+        cache_key = None
+        if (method == 'get' and not raw_response and
+                self.response_cache is not None):
+            cache_key = request_key(url, kwargs['params'])
+            kwargs['headers'].update(
+                self.response_cache.validators(cache_key))
+
+        attempt = 0
+        while True:
+            if self.throttle is not None:
+                self.throttle.wait()
+            response = self.send(method, url, kwargs)
+            if self.engine is None:
+                break
+            overloaded = self.engine.release(response)
+            # A 429 means nothing was done, so any request can go again,
+            # but a 503 may come from a proxy after Redmine made a change
+            if (not overloaded or attempt >= self.engine.retries or
+                    (method not in ('get', 'head') and
+                     response.status_code != 429)):
+                break
+            attempt += 1
+            if self.tracer is not None:
+                self.tracer.count('overloaded retries')
+
+        if cache_key is not None and response.status_code == 304:
+            body = self.response_cache.get(cache_key)
+            if body is None:
+                # Evicted since we asked, so ask for all of it
+                return self.request(method, url, params=params)
+            if self.tracer is not None:
+                self.tracer.count('http cache hits')
+            return json.loads(body)
+        if cache_key is not None and response.status_code == 200:
+            self.response_cache.store(cache_key, response)
+        return self.process_response(response, raw_response)
+
+    def send(self, method, url, kwargs):
+        """Send a request through the session, timing it with --trace.
+
+        With an engine, this first waits for a turn, which the caller
+        hands back with the response.
+        """
+
+        if self.engine is not None:
+            self.engine.acquire()
+        start = time.time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except Exception:
+            if self.engine is not None:
+                self.engine.release()
+            raise
+        if self.tracer is not None:
+            self.tracer.record(method, url, start, time.time(),
+                               len(response.content))
+        return response
+
+    def process_response(self, response, raw_response=False):
+        """Turn a response into JSON, or the matching Redmine error."""
+
+        status = response.status_code
+        if status in (200, 201):
+            if raw_response:
+                return response
+            if not response.content.strip():
+                return True
+            try:
+                return response.json()
+            except (ValueError, TypeError):
+                raise rm_exc.JSONDecodeError(response)
+        if status == 412 and self.impersonate is not None:
+            raise rm_exc.ImpersonateError
+        if status == 422:
+            errors = response.json()['errors']
+            raise rm_exc.ValidationError(', '.join(
+                e if isinstance(e, basestring) else ': '.join(e)
+                for e in errors))
+        if status in STATUS_ERRORS:
+            raise STATUS_ERRORS[status]
+        raise rm_exc.UnknownError(status)
@@ -0,0 +1,300 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Serve rore commands from a long running process.
+
+rore daemon listens on a Unix socket and keeps a warm client (HTTP
+session, metadata cache and mirror) per config file and site.  rore sends
+its arguments there when the socket exists and gets back the output and
+exit status, so short commands skip the imports, the config parsing and
+the connection setup.
+
+The protocol is one JSON object per line.  The client sends
+{"argv": [...], "config": path} and the daemon answers with any number
+of {"out": text} and {"err": text} lines followed by {"exit": status}.
+"""
+
+import errno
+import json
+import logging
+import os
+import socket
+import SocketServer
+import sys
+import threading
+
+from .cache import DEFAULT_CACHE_DIR
+
+
+LOG = logging.getLogger('rore')
+
+DEFAULT_SOCKET = os.path.join(DEFAULT_CACHE_DIR, 'daemon.sock')
+
+# Output is sent to the client in chunks of about this size, and whenever
+# a command flushes stdout
+CHUNK_SIZE = 8192
+
+
+def socket_path():
+    """Where the daemon listens, $RORE_SOCKET overriding the default."""
+
+    return os.path.expanduser(os.environ.get('RORE_SOCKET', DEFAULT_SOCKET))
+
+
+def forward(argv, config, path=None):
+    """Run a command in the daemon and copy its output to ours.
+
+    Returns the command's exit status, or None when no daemon is
+    listening and the command should run here instead.
+    """
+
+    path = path or socket_path()
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error as e:
+        LOG.debug('No daemon on %s: %s' % (path, e))
+        sock.close()
+        return None
+    try:
+        sock.sendall(json.dumps({'argv': argv, 'config': config}) + '\n')
+        streams = {'out': sys.stdout, 'err': sys.stderr}
+        for line in sock.makefile('rb'):
+            message = json.loads(line)
+            if 'exit' in message:
+                return message['exit']
+            for name, text in message.items():
+                streams[name].write(text.encode('utf-8'))
+                streams[name].flush()
+    except IOError as e:
+        # Whatever read our output stopped, e.g. head.  Hanging up stops
+        # the command in the daemon too.
+        if e.errno != errno.EPIPE:
+            raise
+        return 1
+    finally:
+        sock.close()
+    LOG.error('The daemon went away before %s finished' % argv[0])
+    return 1
+
+
+class Channel(object):
+    """File-like object sending one of a command's streams to its client."""
+
+    def __init__(self, conn, name, buffered=True, before=None):
+        self.conn = conn
+        self.name = name
+        self.buffered = buffered
+        # Another Channel flushed before each write, to keep stdout and
+        # stderr in order
+        self.before = before
+        self.chunks = []
+        self.size = 0
+
+    def write(self, text):
+        if isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+        if self.before is not None:
+            self.before.flush()
+        self.chunks.append(text)
+        self.size += len(text)
+        if not self.buffered or self.size >= CHUNK_SIZE:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self.chunks:
+            text = u''.join(self.chunks)
+            self.chunks = []
+            self.size = 0
+            self.conn.sendall(json.dumps({self.name: text}) + '\n')
+
+    def isatty(self):
+        return False
+
+
+class ThreadStream(object):
+    """Stand-in for sys.stdout or sys.stderr, writing to whichever Channel
+    the current thread's command uses, or the real stream outside commands.
+    """
+
+    def __init__(self, default, local, name):
+        self.default = default
+        self.local = local
+        self.name = name
+
+    @property
+    def target(self):
+        return getattr(self.local, self.name, None) or self.default
+
+    def write(self, text):
+        self.target.write(text)
+
+    def writelines(self, lines):
+        self.target.writelines(lines)
+
+    def flush(self):
+        self.target.flush()
+
+    def isatty(self):
+        return self.target.isatty()
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+class LevelFilter(logging.Filter):
+    """Apply each command's -v or -q to the log records it makes."""
+
+    def __init__(self, local, default):
+        logging.Filter.__init__(self)
+        self.local = local
+        # The daemon's own level, for records made outside commands
+        self.default = default
+
+    def filter(self, record):
+        level = getattr(self.local, 'level', None) or self.default
+        return record.levelno >= level
+
+
+class Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        out = Channel(self.connection, 'out')
+        err = Channel(self.connection, 'err', buffered=False, before=out)
+        local = self.server.local
+        local.out, local.err = out, err
+        try:
+            status = self.server.run(request['argv'], request['config'])
+            out.flush()
+            self.connection.sendall(json.dumps({'exit': status or 0}) +
+                                    '\n')
+        except socket.error as e:
+            # The client went away, e.g. piped into head
+            if e.errno not in (errno.EPIPE, errno.ECONNRESET):
+                raise
+        finally:
+            local.out = local.err = local.level = None
+
+
+class Daemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Run forwarded commands, each on its own thread.
+
+    Clients are kept per (config file, site) and rebuilt when the
+    site's configuration changes.  Every command gets its own copy of the
+    client, so issues are always fetched fresh while the HTTP session and
+    the lookup tables are shared.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, clients=None):
+        self.path = path
+        self.local = threading.local()
+        self.clients = clients or {}
+        self.lock = threading.Lock()
+        # Anyone who can connect can use our API keys
+        umask = os.umask(0o077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, Handler)
+        finally:
+            os.umask(umask)
+
+    def client(self, config):
+        from .shell import connect_to_redmine
+
+        key = (config['configfile'], config['site'])
+        settings = dict(config, refresh_cache=False)
+        with self.lock:
+            known = self.clients.get(key)
+            if known is None or known[0] != settings:
+                LOG.debug('Connecting to %s' % config['url'])
+                known = self.clients[key] = (settings,
+                                             connect_to_redmine(settings))
+        rmine = known[1].copy()
+        if config['refresh_cache']:
+            rmine.cache.clear()
+        return rmine
+
+    def run(self, argv, configfile):
+        """Run one command, returning its exit status."""
+
+        from . import shell
+
+        try:
+            args = shell.create_parser().parse_args(argv)
+            args.config = configfile
+            self.local.level = shell.log_level(args)
+            rmine = self.client(shell.load_config(args))
+            return shell.run_command(args, rmine)
+        except SystemExit as e:
+            # argparse errors, --help and missing config files
+            if e.code is None:
+                return 0
+            return e.code if isinstance(e.code, int) else 1
+        except socket.error:
+            raise
+        except Exception:
+            LOG.exception('%s failed' % ' '.join(argv))
+            return 1
+
+
+def listen(path):
+    """Bind a Daemon to path, replacing a stale socket left behind."""
+
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            os.unlink(path)
+        else:
+            raise RuntimeError('A daemon is already listening on %s' % path)
+        finally:
+            probe.close()
+    return Daemon(path)
+
+
+def redirect_output(server):
+    """Send sys.stdout, sys.stderr and our log output to each thread's
+    client while commands run.
+    """
+
+    sys.stdout = ThreadStream(sys.stdout, server.local, 'out')
+    sys.stderr = ThreadStream(sys.stderr, server.local, 'err')
+    level_filter = LevelFilter(server.local, LOG.level)
+    for handler in LOG.handlers:
+        if isinstance(handler, logging.StreamHandler):
+            if handler.stream is sys.stdout.default:
+                handler.stream = sys.stdout
+            elif handler.stream is sys.stderr.default:
+                handler.stream = sys.stderr
+        handler.addFilter(level_filter)
+    # Each command's filter decides what is shown
+    LOG.setLevel(logging.DEBUG)
@@ -0,0 +1,198 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Dump a project's issues to a directory of gzipped JSONL shards.
+
+Each page of issues becomes one shard, issues-NNNNN.jsonl.gz, with one
+issue per line carrying its relations and journals.  Pages are fetched
+several at a time.  manifest.json says what is being exported and which
+pages are done, so running the same export again picks up where it
+stopped.  Pages are found by offset, which issues deleted meanwhile would
+shift, so a resumed export asks only for issues after the last one of the
+pages done in order, and fetches any pages done after a gap again.
+"""
+
+import contextlib
+import errno
+import gzip
+import json
+import os
+import threading
+
+from . import shell
+
+
+MANIFEST = 'manifest.json'
+
+
+def shard_name(page):
+    return 'issues-%05d.jsonl.gz' % page
+
+
+def write_atomically(path, write, opener=open):
+    """Write a file under a temporary name, then move it into place, so
+    an interrupted export never leaves half a file behind.
+    """
+
+    tmp = path + '.tmp'
+    # GzipFile is only a context manager from Python 2.7
+    with contextlib.closing(opener(tmp, 'wb')) as fh:
+        write(fh)
+    os.rename(tmp, path)
+
+
+class Manifest(object):
+    """What an export is of and how far it got, kept in manifest.json."""
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as fh:
+                self.data = json.load(fh)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.data = {'settings': settings, 'pages': {}}
+        if self.data['settings'] != settings:
+            raise RuntimeError('%s is for an export of %s, not this one' %
+                               (os.path.dirname(path) or '.',
+                                self.data['settings']))
+
+    def get(self, name, default=None):
+        return self.data.get(name, default)
+
+    def set(self, name, value):
+        with self.lock:
+            self.data[name] = value
+            self.save()
+
+    def done(self, page):
+        return str(page) in self.data['pages']
+
+    def finish_page(self, page, count, newest, last):
+        with self.lock:
+            self.data['pages'][str(page)] = {'issues': count,
+                                             'newest': newest,
+                                             'last': last}
+            self.save()
+
+    def forget_page(self, page):
+        with self.lock:
+            del self.data['pages'][str(page)]
+            self.save()
+
+    def save(self):
+        write_atomically(self.path, lambda fh: json.dump(
+            self.data, fh, indent=2, sort_keys=True))
+
+
+class Exporter(object):
+    """Fetch pages of a project's issues and write each as a shard."""
+
+    def __init__(self, rmine, directory, qdict, page_size, journals=True,
+                 first_page=0):
+        self.rmine = rmine
+        self.directory = directory
+        self.qdict = qdict
+        self.page_size = page_size
+        self.journals = journals
+        # The page the first issue matching qdict goes on
+        self.first_page = first_page
+
+    def fetch_page(self, page):
+        """Get the issues on a page, with their relations and journals."""
+
+        found = self.rmine.issue.filter(
+            offset=(page - self.first_page) * self.page_size,
+            limit=self.page_size, **self.qdict)
+        issues = [shell.issue_data(issue) for issue in found]
+        if self.journals:
+            for data in issues:
+                issue = self.rmine.issue.get(data['id'], include='journals')
+                data['journals'] = shell.issue_data(issue)['journals']
+        return issues, found.total_count
+
+    def write_shard(self, page, issues):
+        def write(fh):
+            for data in issues:
+                fh.write(json.dumps(data) + '\n')
+
+        write_atomically(os.path.join(self.directory, shard_name(page)),
+                         write, gzip.open)
+
+
+def export(args, rmine):
+    """Export --project to --dir, resuming an earlier export there."""
+
+    project = shell.find_entry(rmine, 'projects', args.project)
+    qdict = {'project_id': project['identifier'], 'status_id': '*',
+             'sort': 'id', 'include': 'relations'}
+    if args.since:
+        qdict['updated_on'] = '>=%s' % args.since
+    page_size = args.page_size or rmine.batch_size
+    directory = args.dir or '%s-export' % project['identifier']
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    manifest = Manifest(os.path.join(directory, MANIFEST),
+                        {'url': rmine.url, 'project': project['identifier'],
+                         'since': args.since, 'page_size': page_size,
+                         'journals': args.journals})
+    start = 0
+    while manifest.done(start):
+        start += 1
+    if not manifest.get('complete') and manifest.get('pages'):
+        shell.LOG.info('Resuming the export in %s' % directory)
+        for page in [int(p) for p in manifest.get('pages')]:
+            if page > start:
+                os.remove(os.path.join(directory, shard_name(page)))
+                manifest.forget_page(page)
+        last = [p['last'] for p in manifest.get('pages').values()
+                if p['last'] is not None]
+        if last:
+            qdict['issue_id'] = '>=%s' % (max(last) + 1)
+    exporter = Exporter(rmine, directory, qdict, page_size, args.journals,
+                        start)
+
+    def run(page):
+        issues, total = exporter.fetch_page(page)
+        exporter.write_shard(page, issues)
+        manifest.finish_page(page, len(issues),
+                             max([d['updated_on'] for d in issues] or
+                                 [None]),
+                             issues[-1]['id'] if issues else None)
+        return total
+
+    pages = start
+    if not manifest.get('complete'):
+        # The first page says how many more there are to fetch
+        pages = start + max(1, -(-run(start) // page_size))
+    results = shell.bulk_apply(run, range(start + 1, pages), args.jobs)
+    failed = [(page, error) for page, error in results if error is not None]
+    for page, error in failed:
+        shell.LOG.error('Unable to export page %s: %s' % (page, error))
+    if failed:
+        shell.LOG.error('%s of %s pages failed, run the export again to '
+                        'retry them' % (len(failed), pages))
+        return 1
+    done = manifest.get('pages').values()
+    manifest.set('newest', max([p['newest'] for p in done] or [None]))
+    manifest.set('complete', True)
+    shell.LOG.info('Exported %s issues of %s to %s' % (
+        sum(p['issues'] for p in done), project['identifier'], directory))
+    return 0
@@ -0,0 +1,199 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Map the issues related to an issue, for issues --graph.
+
+The graph is walked breadth first.  Each level's issues are fetched
+together, a batch per list request with their relations included, along
+with their subtasks, and every issue is fetched once however many others
+lead to it.
+"""
+
+import sys
+
+from . import shell
+
+
+def fetch_issues(rmine, ids):
+    """Get the issues with ids that we can see, with relations."""
+
+    return list(rmine.issue.filter(issue_id=','.join(map(str, ids)),
+                                   status_id='*', limit=len(ids),
+                                   include='relations'))
+
+
+def fetch_children(rmine, ids):
+    """Get the subtasks of the issues with ids that we can see, with
+    relations.
+
+    Issue lists leave out children even when asked to include them, so
+    they are found by their parents instead.
+    """
+
+    return list(shell.iter_issues(
+        rmine, {'parent_id': ','.join(map(str, ids)), 'status_id': '*',
+                'include': 'relations'}, rmine.batch_size))
+
+
+def issue_edges(issue):
+    """Get the (from ID, to ID, type) edges of an issue.
+
+    Relations go the way Redmine has them, and subtasks point to their
+    parent with a type of parent.
+    """
+
+    data = dict(issue)
+    edges = set()
+    for rel in data.get('relations') or []:
+        edges.add((rel['issue_id'], rel['issue_to_id'],
+                   rel['relation_type']))
+    if data.get('parent'):
+        edges.add((issue.id, data['parent']['id'], 'parent'))
+    for child in data.get('children') or []:
+        edges.add((child['id'], issue.id, 'parent'))
+    return edges
+
+
+class Graph(object):
+    """The issues within some number of edges of a root issue."""
+
+    def __init__(self, root):
+        self.root = root
+        # ID: edges from the root
+        self.depth = {root: 0}
+        # ID: issue, for the issues we could see
+        self.issues = {}
+        self.edges = set()
+
+    def ids(self):
+        """Get the IDs in the order they were reached."""
+
+        return sorted(self.depth, key=lambda ID: (self.depth[ID], ID))
+
+
+def walk(rmine, root, depth=None, jobs=1):
+    """Get the Graph of issues up to depth edges from root.
+
+    Each level and its subtasks are fetched in batches, jobs batches at
+    a time.  With no depth, everything connected to root is.
+    """
+
+    def batches(ids):
+        size = rmine.batch_size
+        return [ids[start:start + size] for start in range(0, len(ids), size)]
+
+    graph = Graph(root)
+    level = [root]
+    distance = 0
+    while level:
+        # Subtasks fetched with the level before are already here
+        tasks = [(fetch_issues, batch) for batch in
+                 batches([ID for ID in level if ID not in graph.issues])]
+        if depth is None or distance < depth:
+            tasks += [(fetch_children, batch) for batch in batches(level)]
+        subtasks = []
+
+        def fetch(index):
+            get, batch = tasks[index]
+            for issue in get(rmine, batch):
+                graph.issues[issue.id] = issue
+                if get is fetch_children:
+                    subtasks.append(issue)
+
+        for index, error in shell.bulk_apply(fetch, range(len(tasks)), jobs):
+            if error is not None:
+                raise error
+        distance += 1
+        edges = set()
+        for ID in level:
+            if ID in graph.issues:
+                edges.update(issue_edges(graph.issues[ID]))
+        # Only the way up for now, the rest of a subtask's edges are a
+        # level further on
+        edges.update((issue.id, dict(issue)['parent']['id'], 'parent')
+                     for issue in subtasks)
+        found = set()
+        for edge in edges:
+            graph.edges.add(edge)
+            if depth is not None and distance > depth:
+                continue
+            found.update(other for other in edge[:2]
+                         if other not in graph.depth)
+        for ID in found:
+            graph.depth[ID] = distance
+        level = sorted(found)
+    # Leave out edges to the issues past depth
+    graph.edges = set(edge for edge in graph.edges
+                      if edge[0] in graph.depth and edge[1] in graph.depth)
+    return graph
+
+
+def dot_quote(text):
+    return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def node_label(ID, issue):
+    if issue is None:
+        return '#%s\\n(not visible)' % ID
+    return '#%s %s\\n%s\\n%s' % (ID, issue.tracker.name, issue.subject,
+                                 issue.status.name)
+
+
+def write_dot(graph, stream):
+    """Write a Graph as Graphviz DOT."""
+
+    stream.write('digraph issues {\n')
+    stream.write('  node [shape=box];\n')
+    for ID in graph.ids():
+        label = node_label(ID, graph.issues.get(ID))
+        if isinstance(label, unicode):
+            label = label.encode('utf-8')
+        style = ', style=bold' if ID == graph.root else ''
+        stream.write('  %s [label=%s%s];\n' % (ID, dot_quote(label), style))
+    for source, target, kind in sorted(graph.edges):
+        style = ', style=dashed' if kind == 'parent' else ''
+        stream.write('  %s -> %s [label=%s%s];\n' % (source, target,
+                                                     dot_quote(kind), style))
+    stream.write('}\n')
+
+
+def graph_records(graph):
+    """Get a record per issue of a Graph, with its depth and edges."""
+
+    for ID in graph.ids():
+        issue = graph.issues.get(ID)
+        record = {'id': ID}
+        if issue is not None:
+            record = shell.issue_record(issue)
+            record.pop('children', None)
+        record['depth'] = graph.depth[ID]
+        record['edges'] = [{'type': kind, 'issue_to_id': target}
+                           for source, target, kind in sorted(graph.edges)
+                           if source == ID]
+        yield record
+
+
+def show_graph(rmine, args):
+    """Print the graph around --graph ID as DOT, or --format records."""
+
+    graph = walk(rmine, args.graph, args.depth, args.jobs)
+    if len(graph.issues) < len(graph.depth):
+        shell.LOG.warning('%s issues are not visible' %
+                          (len(graph.depth) - len(graph.issues)))
+    if args.output is None:
+        write_dot(graph, sys.stdout)
+        return
+    for record in graph_records(graph):
+        args.output.write('node', record)
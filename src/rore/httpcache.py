@@ -0,0 +1,142 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import logging
+import os
+import sqlite3
+import threading
+import time
+import urllib
+
+
+LOG = logging.getLogger('rore')
+
+# Default for "http cache size" in ~/.rore, in megabytes
+DEFAULT_HTTP_CACHE_SIZE = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    body BLOB,
+    size INTEGER,
+    used REAL
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+"""
+
+
+def request_key(url, params):
+    """The URL a GET is cached under, minus the API key."""
+
+    params = sorted((k, v) for k, v in params.items() if k != 'key')
+    return '%s?%s' % (url, urllib.urlencode(params))
+
+
+class ResponseCache(object):
+    """Bodies of GET responses with their validators, in SQLite.
+
+    Each cached response is sent back to the server as If-None-Match and
+    If-Modified-Since, so it is only used when the server says it is
+    still current.  When the bodies add up to more than max_size bytes
+    the least recently used go.  Each thread gets its own connection.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_HTTP_CACHE_SIZE * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self._local = threading.local()
+        # Threads creating the tables while others query them get "database
+        # schema has changed", so connections are opened one at a time
+        self._connecting = threading.Lock()
+
+    @property
+    def db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            with self._connecting:
+                try:
+                    os.makedirs(os.path.dirname(self.path))
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                db = self._local.db = sqlite3.connect(self.path)
+                db.executescript(SCHEMA)
+        return db
+
+    def validators(self, key):
+        """Get the headers to revalidate a cached response with."""
+
+        row = self.db.execute('SELECT etag, last_modified FROM responses '
+                              'WHERE url = ?', (key,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def get(self, key):
+        """Get a cached body the server said is current, marking it used."""
+
+        with self.db as db:
+            row = db.execute('SELECT body FROM responses WHERE url = ?',
+                             (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute('UPDATE responses SET used = ? WHERE url = ?',
+                       (time.time(), key))
+        return str(row[0])
+
+    def store(self, key, response):
+        """Keep a response if it came with something to revalidate it by."""
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not (etag or last_modified):
+            return
+        body = response.content
+        if len(body) > self.max_size:
+            return
+        with self.db as db:
+            db.execute('INSERT OR REPLACE INTO responses VALUES '
+                       '(?, ?, ?, ?, ?, ?)',
+                       (key, etag, last_modified, sqlite3.Binary(body),
+                        len(body), time.time()))
+            self.evict(db)
+
+    def evict(self, db):
+        total = db.execute('SELECT sum(size) FROM responses').fetchone()[0]
+        if total <= self.max_size:
+            return
+        # Make some room, so we don't evict on every store
+        target = self.max_size * 0.9
+        doomed = []
+        for url, size in db.execute('SELECT url, size FROM responses '
+                                    'ORDER BY used'):
+            if total <= target:
+                break
+            doomed.append((url,))
+            total -= size
+        LOG.debug('Dropping %s cached responses' % len(doomed))
+        db.executemany('DELETE FROM responses WHERE url = ?', doomed)
+
+
+def response_cache_path(cachedir, site):
+    """Get the response cache database for a --site section."""
+
+    return os.path.join(os.path.expanduser(cachedir), '%s.http.db' % site)
@@ -0,0 +1,113 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import logging
+
+
+LOG = logging.getLogger('rore')
+
+# How alike a name and a key must be for a fuzzy match, see difflib
+FUZZY_CUTOFF = 0.8
+
+
+def user_names(entry):
+    full = u'%s %s' % (entry.get('firstname') or '',
+                       entry.get('lastname') or '')
+    return [entry.get('login'), entry.get('mail'), full.strip()]
+
+
+def project_names(entry):
+    return [entry.get('identifier'), entry.get('name')]
+
+
+# What each lookup table's entries can be called, besides their ID
+NAMES = {
+    'users': user_names,
+    'projects': project_names,
+}
+
+
+def check_loose_match(name, what, meant, exact=False):
+    """Warn that name was taken to mean something else, or refuse to
+    with exact.
+    """
+
+    if exact:
+        raise RuntimeError('No %s is called exactly %s, did you mean %s?' %
+                           (what, name, meant))
+    LOG.warning('Taking %s to mean %s %s' % (name, what, meant))
+
+
+class NameIndex(object):
+    """Find lookup table entries by ID or name, ignoring case.
+
+    A name matches exactly, or failing that is the start of exactly one
+    entry's name, or failing that is close to exactly one entry's name.
+    Anything but an exact match is warned about.
+    """
+
+    def __init__(self, table, entries):
+        self.what = table.rstrip('s')
+        self.exact = {}
+        for entry in entries:
+            for key in [unicode(entry['id'])] + NAMES[table](entry):
+                if key:
+                    self.exact.setdefault(key.lower(), []).append(entry)
+        self.keys = sorted(self.exact)
+
+    def lookup(self, name):
+        """Get the entries called exactly name."""
+
+        found = []
+        for entry in self.exact.get(unicode(name).strip().lower(), []):
+            if entry not in found:
+                found.append(entry)
+        return found
+
+    def find(self, name, exact=False):
+        """Get the one entry name means, or raise RuntimeError.
+
+        With exact, only an exact match will do.
+        """
+
+        key = unicode(name).strip().lower()
+        found = self.lookup(key)
+        loose = not found
+        if loose:
+            start = bisect.bisect_left(self.keys, key)
+            for other in self.keys[start:]:
+                if not other.startswith(key):
+                    break
+                found.extend(e for e in self.exact[other] if e not in found)
+        if not found:
+            import difflib
+            for other in difflib.get_close_matches(key, self.keys, 5,
+                                                   FUZZY_CUTOFF):
+                found.extend(e for e in self.exact[other] if e not in found)
+        if not found:
+            raise RuntimeError('Unknown %s %s' % (self.what, name))
+        if len(found) > 1:
+            raise RuntimeError('%s could be any %s of %s' % (
+                name, self.what, ', '.join(self.describe(e)
+                                           for e in found[:5])))
+        if loose:
+            check_loose_match(name, self.what, self.describe(found[0]),
+                              exact)
+        return found[0]
+
+    def describe(self, entry):
+        names = [n for n in NAMES[self.what + 's'](entry) if n]
+        return names[0] if names else unicode(entry['id'])
@@ -0,0 +1,267 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+
+LOG = logging.getLogger('rore')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS issues (
+    id INTEGER PRIMARY KEY,
+    project_id INTEGER,
+    tracker TEXT,
+    status_id INTEGER,
+    status TEXT,
+    priority TEXT,
+    assigned_to_id INTEGER,
+    assigned_to TEXT,
+    updated_on TEXT,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS issues_project ON issues (project_id);
+CREATE INDEX IF NOT EXISTS issues_updated ON issues (updated_on);
+CREATE TABLE IF NOT EXISTS projects (
+    id INTEGER PRIMARY KEY,
+    identifier TEXT,
+    name TEXT,
+    parent_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS statuses (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    is_closed INTEGER
+);
+CREATE TABLE IF NOT EXISTS synced (
+    project TEXT PRIMARY KEY,
+    updated_on TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS issues_fts
+USING fts4(subject, description, notes)
+"""
+
+
+class Mirror(object):
+    """Local SQLite copy of a site's issues, journals and relations.
+
+    Issues are kept as the JSON Redmine sent, plus a few columns to query
+    on.  The database isn't opened until it is first used, and each
+    thread gets its own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.fts = False
+
+    @property
+    def db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            dbdir = os.path.dirname(self.path)
+            try:
+                os.makedirs(dbdir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            db = self._local.db = sqlite3.connect(self.path)
+            db.executescript(SCHEMA)
+            # Not every sqlite is built with full text search
+            try:
+                db.execute(FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                LOG.debug('No FTS4 in sqlite, searching with LIKE')
+        return db
+
+    def commit(self):
+        self.db.commit()
+
+    # Syncing
+
+    def store(self, data):
+        """Add or replace an issue from its Redmine JSON."""
+
+        def name(field):
+            return data.get(field, {}).get('name')
+
+        notes = '\n'.join(j.get('notes') or ''
+                          for j in data.get('journals', []))
+        self.db.execute('INSERT OR REPLACE INTO issues VALUES '
+                        '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (data['id'], data['project']['id'], name('tracker'),
+                         data['status']['id'], name('status'),
+                         name('priority'),
+                         data.get('assigned_to', {}).get('id'),
+                         name('assigned_to'), data['updated_on'],
+                         json.dumps(data)))
+        if self.fts:
+            self.db.execute('DELETE FROM issues_fts WHERE docid = ?',
+                            (data['id'],))
+            self.db.execute('INSERT INTO issues_fts (docid, subject, '
+                            'description, notes) VALUES (?, ?, ?, ?)',
+                            (data['id'], data.get('subject'),
+                             data.get('description'), notes))
+
+    def prune(self, project_ids, keep):
+        """Drop issues in project_ids that aren't in keep."""
+
+        db = self.db
+        db.execute('CREATE TEMP TABLE IF NOT EXISTS keep '
+                   '(id INTEGER PRIMARY KEY)')
+        db.execute('DELETE FROM keep')
+        db.executemany('INSERT INTO keep VALUES (?)', ((i,) for i in keep))
+        where = ('project_id IN (%s) AND id NOT IN (SELECT id FROM keep)' %
+                 ','.join('?' * len(project_ids)))
+        if self.fts:
+            db.execute('DELETE FROM issues_fts WHERE docid IN '
+                       '(SELECT id FROM issues WHERE %s)' % where,
+                       project_ids)
+        db.execute('DELETE FROM issues WHERE %s' % where, project_ids)
+
+    def set_projects(self, projects):
+        self.db.execute('DELETE FROM projects')
+        self.db.executemany('INSERT INTO projects VALUES (?, ?, ?, ?)',
+                            projects)
+
+    def set_statuses(self, statuses):
+        self.db.execute('DELETE FROM statuses')
+        self.db.executemany('INSERT INTO statuses VALUES (?, ?, ?)',
+                            statuses)
+
+    def synced(self, project):
+        """When issues of project were last updated, as far as we know."""
+
+        row = self.db.execute('SELECT updated_on FROM synced '
+                              'WHERE project = ?', (project,)).fetchone()
+        return row and row[0]
+
+    def set_synced(self, project, updated_on):
+        self.db.execute('INSERT OR REPLACE INTO synced VALUES (?, ?)',
+                        (project, updated_on))
+
+    def synced_projects(self):
+        return [row[0] for row in
+                self.db.execute('SELECT project FROM synced ORDER BY 1')]
+
+    def get_meta(self, name):
+        row = self.db.execute('SELECT value FROM meta WHERE name = ?',
+                              (name,)).fetchone()
+        return row and row[0]
+
+    def set_meta(self, name, value):
+        self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                        (name, value))
+
+    # Querying
+
+    def project_ids(self, project, subprojects=True):
+        """Get the IDs of a project, by ID or identifier, and its children."""
+
+        rows = self.db.execute('SELECT id FROM projects WHERE id = ? OR '
+                               'identifier = ?', (project, project))
+        ids = [row[0] for row in rows]
+        if not ids:
+            raise RuntimeError('Unknown project %s, is it synced?' % project)
+        if subprojects:
+            parents = ids
+            while parents:
+                parents = [row[0] for row in self.db.execute(
+                    'SELECT id FROM projects WHERE parent_id IN (%s)' %
+                    ','.join('?' * len(parents)), parents)]
+                ids.extend(parents)
+        return ids
+
+    def get(self, ids):
+        """Get the JSON for the issues we have out of ids, by ID."""
+
+        found = {}
+        ids = list(ids)
+        # Stay under sqlite's limit on query parameters
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            for row in self.db.execute('SELECT id, data FROM issues WHERE '
+                                       'id IN (%s)' %
+                                       ','.join('?' * len(batch)), batch):
+                found[row[0]] = json.loads(row[1])
+        return found
+
+    def query(self, project=None, subprojects=True, status=None,
+              trackers=None, priorities=None, assigned_to=None, search=None):
+        """Yield the JSON of matching issues, newest first.
+
+        With no status only open issues match, like Redmine.  Otherwise
+        status is 'open', 'closed', '*' or a status name or ID.  trackers
+        and priorities are lists of names.  assigned_to is a user ID or
+        name, and search is a full text query over subjects, descriptions
+        and notes.
+        """
+
+        # Opening the database is what tells us whether we have FTS
+        db = self.db
+        where = []
+        params = []
+        if project:
+            ids = self.project_ids(project, subprojects)
+            where.append('i.project_id IN (%s)' % ','.join('?' * len(ids)))
+            params.extend(ids)
+        status = (status or 'open').lower()
+        if status in ('open', 'closed'):
+            where.append('i.status_id IN (SELECT id FROM statuses WHERE '
+                         'is_closed = ?)')
+            params.append(status == 'closed')
+        elif status != '*':
+            where.append('(i.status_id = ? OR lower(i.status) = ?)')
+            params.extend([status, status])
+        for column, names in (('tracker', trackers),
+                              ('priority', priorities)):
+            if names:
+                where.append('lower(i.%s) IN (%s)' %
+                             (column, ','.join('?' * len(names))))
+                params.extend(name.lower() for name in names)
+        if assigned_to is not None:
+            where.append('(i.assigned_to_id = ? OR lower(i.assigned_to) = ?)')
+            params.extend([assigned_to, str(assigned_to).lower()])
+        if search and self.fts:
+            where.append('i.id IN (SELECT docid FROM issues_fts WHERE '
+                         'issues_fts MATCH ?)')
+            params.append(search)
+        elif search:
+            where.append("i.data LIKE ?")
+            params.append('%%%s%%' % search)
+        sql = 'SELECT i.data FROM issues i'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY i.id DESC'
+        for row in db.execute(sql, params):
+            yield json.loads(row[0])
+
+
+def mirror_path(cachedir, site):
+    """Get the mirror database for a --site section."""
+
+    return os.path.join(os.path.expanduser(cachedir), '%s.db' % site)
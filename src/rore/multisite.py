@@ -0,0 +1,161 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Run a command on several sites at once, for --site a,b or --site all.
+
+Each site gets its own client and thread.  Text output is written a line
+at a time with the site's name in front, and records get a "site" field,
+so the sites' output can be told apart however it interleaves.
+"""
+
+import copy
+import sys
+import threading
+
+from . import shell
+from .daemon import ThreadStream
+
+
+class LabelStream(object):
+    """Stand-in for sys.stdout writing whole lines, each with a label."""
+
+    def __init__(self, stream, label, lock):
+        self.stream = stream
+        self.label = label
+        self.lock = lock
+        self.partial = ''
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        if lines:
+            with self.lock:
+                self.stream.write(''.join('%s%s\n' % (self.label, line)
+                                          for line in lines))
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+    def close(self):
+        if self.partial:
+            self.write('\n')
+
+    def isatty(self):
+        return False
+
+
+class SiteWriter(object):
+    """Hand one site's records to a shared --format writer."""
+
+    def __init__(self, writer, site, lock):
+        self.writer = writer
+        self.site = site
+        self.lock = lock
+
+    def write(self, kind, record):
+        record = dict(record, site=self.site)
+        with self.lock:
+            self.writer.write(kind, record)
+
+    def close(self):
+        pass
+
+
+def site_names(args):
+    """Get the sites --site names, all meaning every one in the config."""
+
+    if args.site == 'all':
+        return shell.read_config(args)[1].sections()
+    return [site for site in shell.split_names(args.site) if site]
+
+
+def run_sites(args):
+    """Run the command args picked on every --site at once.
+
+    A site that fails is reported and the rest carry on.  Returns 1 if
+    any site failed, otherwise 0.
+    """
+
+    sites = site_names(args)
+    # Fail here rather than on every site if the config is missing
+    shell.read_config(args)
+    shell.setup_output(args)
+    lock = threading.Lock()
+    local = threading.local()
+    stdout = sys.stdout
+    sys.stdout = ThreadStream(stdout, local, 'out')
+    clients = [None] * len(sites)
+    statuses = [0] * len(sites)
+
+    def run(index):
+        site_args = copy.copy(args)
+        site_args.site = sites[index]
+        if args.output is not None:
+            site_args.output = SiteWriter(args.output, sites[index], lock)
+        local.out = LabelStream(stdout, '[%s] ' % sites[index], lock)
+        try:
+            rmine = shell.connect_to_redmine(shell.load_config(site_args))
+            if args.trace or args.trace_json:
+                from .trace import Tracer
+                rmine.tracer = Tracer(rmine.cache)
+            clients[index] = rmine
+            shell.apply_defaults(site_args, rmine)
+            shell.default_jobs(site_args, rmine)
+            statuses[index] = site_args.command(site_args, rmine) or 0
+        finally:
+            local.out.close()
+            local.out = None
+
+    try:
+        results = shell.bulk_apply(run, range(len(sites)), len(sites))
+    finally:
+        sys.stdout = stdout
+        if args.output is not None:
+            args.output.close()
+    for index, error in results:
+        if error is not None:
+            shell.LOG.error('%s failed: %s' % (sites[index], error))
+            statuses[index] = 1
+    if args.trace or args.trace_json:
+        report_traces(args, sites, clients)
+    return max([0] + statuses)
+
+
+def report_traces(args, sites, clients):
+    """Print each site's --trace summary, and save them with --trace-json.
+    """
+
+    from .trace import format_report
+
+    reports = dict((site, rmine.tracer.report(rmine.cache))
+                   for site, rmine in zip(sites, clients)
+                   if rmine is not None)
+    if args.trace:
+        sys.stdout.flush()
+        for site in sites:
+            if site in reports:
+                sys.stderr.write('[%s]\n' % site)
+                sys.stderr.write(format_report(reports[site]))
+    if args.trace_json:
+        import json
+        with open(args.trace_json, 'w') as fh:
+            json.dump(reports, fh, indent=2, sort_keys=True)
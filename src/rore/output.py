@@ -0,0 +1,128 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import csv
+import json
+
+
+# Columns for CSV output when --fields isn't given
+DEFAULT_FIELDS = {
+    'issue': ['id', 'project', 'tracker', 'priority', 'status',
+              'assigned_to', 'subject', 'updated_on'],
+    'project': ['id', 'identifier', 'name', 'parent'],
+    'user': ['id', 'login', 'firstname', 'lastname', 'mail'],
+    'group': ['group_by', 'id', 'name', 'count'],
+    'node': ['id', 'depth', 'tracker', 'status', 'subject', 'edges'],
+    'row': ['key', 'id', 'error'],
+    'change': ['id', 'action', 'error'],
+}
+
+
+class RecordWriter(object):
+    """Write records (dicts of Redmine JSON) to a stream as they come.
+
+    fields limits which keys of each record are written.
+    """
+
+    def __init__(self, stream, fields=None):
+        self.stream = stream
+        self.fields = fields
+
+    def select(self, record):
+        if not self.fields:
+            return record
+        return dict((f, record.get(f)) for f in self.fields)
+
+    def write(self, kind, record):
+        raise NotImplementedError
+
+    def close(self):
+        self.stream.flush()
+
+
+class JsonLinesWriter(RecordWriter):
+    """One JSON object per line."""
+
+    def write(self, kind, record):
+        self.stream.write(json.dumps(self.select(record)) + '\n')
+
+
+class JsonWriter(RecordWriter):
+    """A JSON array, written an element at a time."""
+
+    def __init__(self, stream, fields=None):
+        super(JsonWriter, self).__init__(stream, fields)
+        self.started = False
+
+    def write(self, kind, record):
+        self.stream.write(',\n' if self.started else '[\n')
+        self.started = True
+        self.stream.write(json.dumps(self.select(record)))
+
+    def close(self):
+        self.stream.write('\n]\n' if self.started else '[]\n')
+        super(JsonWriter, self).close()
+
+
+class CsvWriter(RecordWriter):
+    """CSV with a header row.  Nested resources are written by name."""
+
+    def __init__(self, stream, fields=None):
+        super(CsvWriter, self).__init__(stream, fields)
+        self.writer = csv.writer(stream)
+        self.started = False
+
+    @staticmethod
+    def flatten(value):
+        if value is None:
+            return ''
+        if isinstance(value, dict):
+            value = value.get('name', value.get('id'))
+        elif isinstance(value, list):
+            value = json.dumps(value)
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+    def write(self, kind, record):
+        if not self.started:
+            # Records from several sites say which
+            site = ['site'] if 'site' in record else []
+            self.fields = self.fields or site + DEFAULT_FIELDS[kind]
+            self.writer.writerow(self.fields)
+            self.started = True
+        self.writer.writerow([self.flatten(record.get(f))
+                              for f in self.fields])
+
+
+WRITERS = {
+    'json': JsonWriter,
+    'jsonl': JsonLinesWriter,
+    'csv': CsvWriter,
+}
+
+
+def get_writer(fmt, stream, fields=None):
+    """Get a writer for --format fmt, or None for the text formats."""
+
+    if fmt not in WRITERS:
+        return None
+    return WRITERS[fmt](stream, fields)
+
+
+def resource_record(resource):
+    """Get the JSON Redmine sent for a resource, minus unfetched parts."""
+
+    return dict((k, v) for k, v in resource if v is not None)
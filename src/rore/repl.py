@@ -0,0 +1,170 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import argparse
+import cmd
+import logging
+import os
+import shlex
+
+from . import shell
+
+
+LOG = logging.getLogger('rore')
+
+HISTORY = '~/.rore_history'
+
+
+def _names(table, *fields):
+    """Completer for options taking names from a lookup table."""
+
+    def names(rmine):
+        entries = shell.get_table(rmine, table)
+        return [entry[f] for entry in entries for f in fields if entry[f]]
+    return names
+
+
+def _users(rmine):
+    try:
+        return _names('users', 'login')(rmine)
+    except Exception:
+        # Not an administrator, offer the names we have looked up before
+        return [table.split(':', 1)[1] for table in rmine.cache.tables
+                if table.startswith('user:')]
+
+
+# Options whose values we can complete, and where the values come from
+COMPLETERS = {
+    '--project': _names('projects', 'identifier'),
+    '--status': _names('statuses', 'name'),
+    '--type': _names('trackers', 'name'),
+    '--priority': _names('priorities', 'name'),
+    '--assigned_to': _users,
+}
+
+
+class RoreShell(cmd.Cmd):
+    """Run rore commands against one warm connection.
+
+    Each line is parsed like the arguments to rore, minus the global
+    options, and run with the same client.  The lookup tables and the
+    issues fetched so far carry over from one command to the next.
+    """
+
+    prompt = 'rore> '
+    intro = 'rore shell, "help" lists commands, ctrl-d leaves.'
+
+    def __init__(self, rmine):
+        cmd.Cmd.__init__(self)
+        self.rmine = rmine
+        self.parser = shell.create_parser()
+        subparsers = [action for action in self.parser._actions
+                      if isinstance(action, argparse._SubParsersAction)][0]
+        # A shell in a shell is no use, and the daemon would take over our
+        # output and never come back
+        self.subparsers = dict((name, parser) for name, parser in
+                               subparsers.choices.items()
+                               if name not in ('shell', 'daemon'))
+
+    def preloop(self):
+        try:
+            import readline
+        except ImportError:
+            return
+        # Complete --options and names with dashes whole
+        readline.set_completer_delims(' \t\n')
+        try:
+            readline.read_history_file(os.path.expanduser(HISTORY))
+        except IOError:
+            pass
+
+    def postloop(self):
+        try:
+            import readline
+            readline.write_history_file(os.path.expanduser(HISTORY))
+        except (ImportError, IOError):
+            pass
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        try:
+            argv = shlex.split(line)
+        except ValueError as e:
+            LOG.error(str(e))
+            return
+        if argv[0] not in self.subparsers:
+            LOG.error('Unknown command %s' % argv[0])
+            return
+        try:
+            args = self.parser.parse_args(argv)
+        except SystemExit:
+            # argparse has already said what was wrong, or printed help
+            return
+        try:
+            shell.run_command(args, self.rmine)
+        except Exception as e:
+            LOG.error('%s: %s' % (e.__class__.__name__, e))
+
+    def do_refresh(self, line):
+        """Forget cached issues, statuses, users and the like."""
+
+        self.rmine.issue_cache.clear()
+        for table in list(self.rmine.cache.tables):
+            self.rmine.cache.invalidate(table)
+
+    def do_exit(self, line):
+        """Leave the shell."""
+
+        return True
+
+    do_quit = do_exit
+
+    def do_EOF(self, line):
+        print('')
+        return True
+
+    def do_help(self, line):
+        """List commands, or show the help of one."""
+
+        if line in self.subparsers:
+            self.subparsers[line].print_help()
+        elif line:
+            cmd.Cmd.do_help(self, line)
+        else:
+            print('Commands: %s' % ', '.join(sorted(self.subparsers) +
+                                             ['refresh', 'exit']))
+
+    def completenames(self, text, *ignored):
+        names = cmd.Cmd.completenames(self, text, *ignored)
+        return sorted(names + [name for name in self.subparsers
+                               if name.startswith(text)])
+
+    def completedefault(self, text, line, begidx, endidx):
+        words = line[:begidx].split()
+        if not words or words[0] not in self.subparsers:
+            return []
+        try:
+            if words[-1] in COMPLETERS:
+                candidates = COMPLETERS[words[-1]](self.rmine)
+            else:
+                parser = self.subparsers[words[0]]
+                candidates = parser._option_string_actions.keys()
+        except Exception as e:
+            LOG.debug('Completion failed: %s' % e)
+            return []
+        return sorted(c.replace(' ', '\\ ') for c in candidates
+                      if c.startswith(text))
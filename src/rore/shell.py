@@ -15,39 +15,264 @@
 
 import argparse
 import ConfigParser
+import itertools
 import logging
+import signal
 import sys
 import os
 
-import redmine
-import tempfile
-from redmine import exceptions as rm_exc
 from subprocess import call
 
+# Nothing here may import redmine (and so requests) at module level.  It
+# is by far the slowest thing to import, and --help, argument errors and
+# shell completion never need it.  The same goes for anything else only
+# some commands use.  See tests/test_startup.py.
+from .cache import cache_path, DEFAULT_CACHE_DIR, DEFAULT_CACHE_TTL
+from .cache import MetadataCache
+from .lookup import check_loose_match, NameIndex, user_names
+from .output import get_writer, resource_record, WRITERS
+
 
 # Setup the basic logging objects
 LOG = logging.getLogger('rore')
 
+# How requests can be made: one at a time, or --jobs at a time on
+# threads sharing an engine that backs off when the server is overloaded
+ENGINES = ('serial', 'threads')
+
+# A timeout for waits that shouldn't have one, so Ctrl-C still works
+WAIT_FOREVER = 60 * 60 * 24 * 365
+
+# The end of every --jobs help
+JOBS_DEFAULT = ('.  Defaults to the concurrency option with '
+                'engine=threads, otherwise 1.')
+
+# Lookup tables kept in the metadata cache, how to fetch them and which
+# fields to keep
+LOOKUPS = {
+    'trackers': (lambda rmine: rmine.tracker.all(), ('id', 'name')),
+    'statuses': (lambda rmine: rmine.issue_status.all(),
+                 ('id', 'name', 'is_closed')),
+    'priorities': (lambda rmine: rmine.enumeration.filter(
+        resource='issue_priorities'), ('id', 'name')),
+    'projects': (lambda rmine: rmine.project.all(),
+                 ('id', 'name', 'identifier', 'parent')),
+    # Only administrators may list users
+    'users': (lambda rmine: rmine.user.all(),
+              ('id', 'login', 'firstname', 'lastname', 'mail')),
+}
+
+
+def _match_name(entries, name):
+    for entry in entries:
+        if entry['name'].lower() == name.lower():
+            return entry['id']
+    return None
+
+
+def get_table(rmine, table, refresh=False):
+    """Get a lookup table from the metadata cache, fetching it if needed."""
+
+    entries = None if refresh else rmine.cache.get(table)
+    if entries is None:
+        fetch, fields = LOOKUPS[table]
+        records = (resource_record(r) for r in fetch(rmine))
+        entries = [dict((f, record.get(f)) for f in fields)
+                   for record in records]
+        rmine.cache.set(table, entries)
+    return entries
+
+
+def get_lookup(rmine, table, name):
+    """Get the id for a tracker, status or priority name.
+
+    Answers from the metadata cache when possible.  A name missing from
+    the cached table refetches it, in case it was added on the server.
+    """
+
+    entries = rmine.cache.get(table)
+    cached = entries is not None
+    if not cached:
+        entries = get_table(rmine, table, refresh=True)
+    found = _match_name(entries, name)
+    if found is None and cached:
+        LOG.debug('%s not in cached %s, refreshing' % (name, table))
+        found = _match_name(get_table(rmine, table, refresh=True), name)
+    return found
+
+
+def get_tracker(rmine, tracker):
+    """Gets the id for the tracker (issue type) passed in."""
+
+    tid = get_lookup(rmine, 'trackers', tracker)
+    if tid is None:
+        raise RuntimeError('Unknown issue type %s' % tracker)
+    return tid
+
+
+def get_status(rmine, status):
+    """Gets the id for the issue status passed in."""
+
+    sid = get_lookup(rmine, 'statuses', status)
+    if sid is None:
+        raise RuntimeError('Unknown issue status %s' % status)
+    return sid
+
+
+def find_entry(rmine, table, name, exact=False):
+    """Find the users or projects entry name means, see NameIndex.
+
+    The table is only fetched again when name means nothing in the
+    cached one, or with exact, nothing exactly.  Changes to issues pass
+    exact, so a typo never moves or assigns one to the wrong place.
+    """
 
-def get_user(rmine, userdata):
+    entries = rmine.cache.get(table)
+    if entries is not None:
+        try:
+            return NameIndex(table, entries).find(name, exact)
+        except RuntimeError as e:
+            LOG.debug('%s, refreshing cached %s' % (e, table))
+    entries = get_table(rmine, table, refresh=True)
+    return NameIndex(table, entries).find(name, exact)
+
+
+def get_project(rmine, project, exact=False):
+    """Get the ID of a project by ID, identifier or name."""
+
+    return find_entry(rmine, 'projects', project, exact)['id']
+
+
+def get_user(rmine, userdata, exact=False):
     """Get the user ID from the provided data"""
 
+    from redmine import exceptions as rm_exc
+
     # first see if we got an int
     try:
         userdata = int(userdata)
         return userdata
     except ValueError:
         pass
+    if not rmine.cache.get('users-forbidden'):
+        try:
+            return find_entry(rmine, 'users', userdata, exact)['id']
+        except (rm_exc.ForbiddenError, rm_exc.AuthError):
+            # Not an administrator, so we can't list users.  Ask the server
+            # about each name instead, and remember not to try again.
+            rmine.cache.set('users-forbidden', True)
+    table = 'user:%s' % userdata.lower()
+    uid = rmine.cache.get(table)
+    if uid is not None:
+        return uid
     users = rmine.user.filter(name=userdata)
     if not users:
         raise RuntimeError('Unknown user %s' % userdata)
     if len(users) > 1:
         raise RuntimeError('Multiple users for %s found' % userdata)
+    # The server matches the start of any of a user's names
+    data = dict(users[0])
+    names = user_names(data) + [data.get('firstname'), data.get('lastname')]
+    if userdata.strip().lower() not in [n.lower() for n in names if n]:
+        check_loose_match(userdata, 'user', next(
+            (n for n in user_names(data) if n), users[0].id), exact)
+        return users[0].id
+    rmine.cache.set(table, users[0].id)
     return users[0].id
 
 
-def print_issue(rmine, issue, verbose=False, oneline=False):
-    """Print out a redmine issue object."""
+def get_issues(rmine, ids, **params):
+    """Fetch issues by ID in batched list calls.
+
+    Issues come back in the order of ids.  IDs the list calls don't return
+    (missing, or not visible to us) get an empty issue with an id of 0,
+    the same as Redmine hands back for unauthorized issues.  Everything
+    fetched is remembered on the client for the rest of the command.
+    """
+
+    ids = [int(ID) for ID in ids]
+    memo = rmine.issue_cache
+    wanted = []
+    for ID in ids:
+        if ID not in memo and ID not in wanted:
+            wanted.append(ID)
+    if rmine.tracer is not None:
+        rmine.tracer.count('issue memo hits', len(ids) - len(wanted))
+    size = rmine.batch_size
+    batches = [wanted[start:start + size]
+               for start in range(0, len(wanted), size)]
+
+    def fetch(index):
+        batch = batches[index]
+        # status_id=* or the list call leaves out closed issues
+        for issue in rmine.issue.filter(issue_id=','.join(map(str, batch)),
+                                        status_id='*', limit=len(batch),
+                                        **params):
+            memo[issue.id] = issue
+
+    if len(batches) > 1 and rmine.jobs > 1:
+        for index, error in bulk_apply(fetch, range(len(batches)),
+                                       rmine.jobs):
+            if error is not None:
+                raise error
+    else:
+        for index in range(len(batches)):
+            fetch(index)
+    for ID in wanted:
+        if ID not in memo:
+            memo[ID] = rmine.issue.new()
+    return [memo[ID] for ID in ids]
+
+
+def iter_issues(rmine, qdict, page_size, prefetch=False):
+    """Yield the issues matching qdict, fetching one page at a time.
+
+    Nothing past the current page is requested until the caller asks for
+    it, so consumers that stop early never pay for the rest.  With
+    prefetch the related issues of each page are fetched along with it.
+    """
+
+    offset = 0
+    while True:
+        page = rmine.issue.filter(offset=offset, limit=page_size, **qdict)
+        ishes = list(page)
+        if prefetch:
+            prefetch_related(rmine, ishes)
+        for issue in ishes:
+            yield issue
+        offset += len(ishes)
+        if not ishes or offset >= page.total_count:
+            return
+        # Let whatever reads our output see this page before we block
+        sys.stdout.flush()
+
+
+def related_id(issue, relation):
+    """Get the ID of the issue on the other end of a relation."""
+
+    if relation.issue_id != issue.id:
+        return relation.issue_id
+    return relation.issue_to_id
+
+
+def prefetch_related(rmine, issues):
+    """Fetch every issue related to issues in as few requests as we can."""
+
+    ids = []
+    for issue in issues:
+        if issue.id == 0:
+            continue
+        ids.extend(related_id(issue, rel) for rel in issue.relations)
+    get_issues(rmine, ids)
+
+
+def print_issue(rmine, issue, verbose=False, oneline=False, journals=None):
+    """Print out a redmine issue object.
+
+    Verbose output shows journals, or all of the issue's if None.
+    """
+
+    from redmine import exceptions as rm_exc
 
     # handle unauth issues -- github #20
     if issue.id == 0:
@@ -88,16 +313,7 @@ def print_issue(rmine, issue, verbose=False, oneline=False):
             print(issue.description)
         print('----')
         for relation in issue.relations:
-            # Get the verb right for blocking relationship
-            reltype = relation.relation_type
-            if relation.issue_id != issue.id:
-                if relation.relation_type == 'blocks':
-                    reltype = 'blocked by'
-                if relation.relation_type == 'blocked':
-                    reltype = 'blocks'
-                relish = rmine.issue.get(relation.issue_id)
-            else:
-                relish = rmine.issue.get(relation.issue_to_id)
+            relish = get_issues(rmine, [related_id(issue, relation)])[0]
             # Check for unauth -- wtf? See github #20
             if relish.id == 0:
                 continue
@@ -120,7 +336,9 @@ def print_issue(rmine, issue, verbose=False, oneline=False):
                                                 relish.id,
                                                 relish.subject,
                                                 relation.id)
-        for journ in issue.journals:
+        if journals is None:
+            journals = issue.journals
+        for journ in journals:
             print('\n####')
             print('Updated by %s on %s:' % (journ.user.name,
                                             journ.created_on))
@@ -129,9 +347,144 @@ def print_issue(rmine, issue, verbose=False, oneline=False):
     print('\n')
 
 
+def issue_record(issue, verbose=False, journals=None):
+    """Get an issue as a record for the --format writers.
+
+    Verbose records carry journals, or all of the issue's if None.
+    """
+
+    record = resource_record(issue)
+    record.pop('relations', None)
+    record.pop('journals', None)
+    if verbose:
+        if journals is None:
+            journals = issue.journals
+        record['relations'] = [resource_record(r) for r in issue.relations]
+        record['journals'] = [resource_record(j) for j in journals]
+    return record
+
+
+def issue_journals(rmine, issue, count=None, since=None):
+    """Get the last count journals of an issue created on or after since.
+
+    Redmine only hands out an issue's journals all at once, so unless
+    the issue came with them they are fetched, but only the ones kept
+    are made into resources, and none are kept on the issue.  A count of
+    0 fetches nothing.
+    """
+
+    if count == 0:
+        return []
+    data = dict(issue).get('journals')
+    if data is None:
+        data = dict(rmine.issue.get(issue.id, include='journals')).get(
+            'journals') or []
+    if since:
+        # Timestamps are ISO 8601, so they sort as strings
+        data = [journal for journal in data if journal['created_on'] >= since]
+    if count is not None:
+        data = data[-count:]
+    return rmine.issue.to_resource({'id': issue.id,
+                                    'journals': data}).journals
+
+
+def shown_journals(rmine, issue, args):
+    """Get the journals --journals and --since pick to show an issue with.
+    """
+
+    if not args.verbose or not issue.id:
+        return None
+    return issue_journals(rmine, issue, args.journals, args.since)
+
+
+def output_issue(rmine, issue, args):
+    """Print an issue, or hand it to the --format writer."""
+
+    journals = shown_journals(rmine, issue, args)
+    if args.output is None:
+        print_issue(rmine, issue, args.verbose, args.oneline, journals)
+    elif issue.id == 0:
+        LOG.warning('Unauthorized to view an issue')
+    else:
+        args.output.write('issue', issue_record(issue, args.verbose,
+                                                journals))
+
+
+def show_issues(rmine, ids, args):
+    """Fetch and print the issues with the given IDs."""
+
+    params = {}
+    if args.verbose:
+        params['include'] = 'relations'
+    ishs = get_issues(rmine, ids, **params)
+    if args.verbose:
+        prefetch_related(rmine, ishs)
+    for ish in ishs:
+        output_issue(rmine, ish, args)
+
+
+def bulk_apply(action, ids, jobs=1):
+    """Call action(ID) for every ID, jobs at a time.
+
+    One failing ID doesn't stop the rest.  Returns (ID, error) pairs in
+    the order of ids, where error is None if the action succeeded.
+    """
+
+    def run(ID):
+        try:
+            action(ID)
+        except Exception as e:
+            return ID, e
+        return ID, None
+
+    ids = [int(ID) for ID in ids]
+    if not jobs or jobs <= 1 or len(ids) <= 1:
+        return [run(ID) for ID in ids]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(jobs, len(ids)))
+    try:
+        # Waiting with no timeout can't be interrupted on Python 2
+        return pool.map_async(run, ids).get(WAIT_FOREVER)
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.close()
+
+
+def report_bulk(rmine, results, verb, args):
+    """Print the outcome of bulk_apply and return the exit status."""
+
+    done = [ID for ID, error in results if error is None]
+    # What we remember about these issues is out of date now
+    for ID in done:
+        rmine.issue_cache.pop(ID, None)
+    if args.refresh:
+        show_issues(rmine, done, args)
+    elif args.output is not None:
+        # A record per issue, so the output stays valid --format
+        for ID, error in results:
+            args.output.write('change', {
+                'id': ID, 'action': verb,
+                'error': None if error is None else unicode(error)})
+    else:
+        for ID in done:
+            print('%sd %s' % (verb.capitalize(), ID))
+    failed = [(ID, error) for ID, error in results if error is not None]
+    for ID, error in failed:
+        LOG.error('Unable to %s issue %s: %s' % (verb, ID, error))
+    if failed:
+        LOG.error('%s of %s issues failed to %s' % (len(failed),
+                                                    len(results), verb))
+        return 1
+    return 0
+
+
 def print_project(rmine, proj, verbose=False):
     """Print out a redmine project object."""
 
+    from redmine import exceptions as rm_exc
+
     print('%s ( %s )' % (proj.name, '%s/projects/%s' % (rmine.url,
                                                         proj.identifier)))
     if verbose:
@@ -146,6 +499,8 @@ def print_project(rmine, proj, verbose=False):
 
 
 def editor_text(initial_description=""):
+    import tempfile
+
     EDITOR = os.environ.get('EDITOR')
     text = initial_description
     if EDITOR:
@@ -163,19 +518,36 @@ def editor_text(initial_description=""):
 def create_relation(rmine, issue, relissue, reltype):
     """Creates a new issue relationship between two issues."""
 
-    rmine.issue_relation.create(issue_id=issue,
-                                issue_to_id=relissue,
-                                relation_type=reltype)
+    return rmine.issue_relation.create(issue_id=issue,
+                                       issue_to_id=relissue,
+                                       relation_type=reltype)
 
 
 def get_priority(rmine, priority):
     """Gets the id for the priority passed in."""
 
-    priorities = rmine.enumeration.filter(resource='issue_priorities')
-    p = [p for p in priorities if p.name.lower() == priority.lower()]
-    if len(p) == 0:
-        raise RuntimeError("Priority '%s' is not a priority.")
-    return p[0]
+    pid = get_lookup(rmine, 'priorities', priority)
+    if pid is None:
+        raise RuntimeError("Priority '%s' is not a priority." % priority)
+    return pid
+
+
+def split_names(names):
+    """Split a comma separated command line value into a list."""
+
+    if not names:
+        return []
+    return [name.strip() for name in names.split(',')]
+
+
+def get_filter(rmine, lookup, names):
+    """Turn a comma separated list of names into a Redmine filter value.
+
+    lookup is one of get_tracker, get_status or get_priority.  Redmine
+    ORs together filter values separated by |.
+    """
+
+    return '|'.join(str(lookup(rmine, name)) for name in split_names(names))
 
 
 def print_user(user):
@@ -195,24 +567,80 @@ def users(args, rmine):
         print("Going to assume you want to see your information")
 
     my_user = rmine.user.get('current')
-    print_user(my_user)
+    if args.output is None:
+        print_user(my_user)
+    else:
+        args.output.write('user', resource_record(my_user))
+
+
+def local_issues(args, rmine):
+    """Answer issues --query or issues ID from the local mirror."""
+
+    mirror = rmine.mirror
+    if args.stats:
+        raise RuntimeError('--stats is not available with --local')
+    if args.graph:
+        raise RuntimeError('--graph is not available with --local')
+    if args.ID:
+        found = mirror.get(int(ID) for ID in args.ID)
+        datas = [found.get(int(ID), {}) for ID in args.ID]
+    elif args.query:
+        if args.query_id:
+            raise RuntimeError('query_id argument is not available with '
+                               '--local')
+        assigned_to = args.assigned_to
+        if args.mine:
+            assigned_to = mirror.get_meta('me')
+        datas = mirror.query(project=args.project,
+                             subprojects=not args.nosubs,
+                             status=args.status,
+                             trackers=split_names(args.type),
+                             priorities=split_names(args.priority),
+                             assigned_to=assigned_to, search=args.search)
+        if args.limit:
+            datas = itertools.islice(datas, args.limit)
+    else:
+        raise RuntimeError('--local only works with --query or issue IDs')
+
+    for data in datas:
+        issue = rmine.issue.to_resource(data)
+        if args.verbose and issue.id:
+            # Related issues come from the mirror too, never the server
+            ids = [related_id(issue, rel) for rel in issue.relations]
+            related = mirror.get(ids)
+            for ID in ids:
+                rmine.issue_cache[ID] = rmine.issue.to_resource(
+                    related.get(ID, {}))
+        output_issue(rmine, issue, args)
+        if args.query and not args.oneline and args.output is None:
+            print('##############')
 
 
 def issues(args, rmine):
     """Handle issues"""
 
+    if (args.journals is not None or args.since) and not args.verbose:
+        raise RuntimeError('--journals and --since require --verbose')
+    if args.local:
+        return local_issues(args, rmine)
+    if args.search:
+        raise RuntimeError('--search requires --local')
+
+    # Map the issues related to one
+    if args.graph:
+        from .graph import show_graph
+        return show_graph(rmine, args)
+
     # Just print issue details
     if args.ID and not (args.update or args.close):
-        ishs = [rmine.issue.get(ID) for ID in args.ID]
-        for ish in ishs:
-            print_issue(rmine, ish, args.verbose, args.oneline)
+        show_issues(rmine, args.ID, args)
         return
 
     # query
-    if args.query:
+    if args.query or args.stats:
         qdict = {}
         if args.project:
-            qdict['project_id'] = args.project
+            qdict['project_id'] = get_project(rmine, args.project)
         if args.nosubs:
             qdict['subproject_id'] = '!*'
         if args.assigned_to:
@@ -222,42 +650,53 @@ def issues(args, rmine):
             qdict['assigned_to_id'] = my_id
         if args.status:
             qdict['status_id'] = args.status
+        if args.type:
+            qdict['tracker_id'] = get_filter(rmine, get_tracker, args.type)
+        if args.priority:
+            qdict['priority_id'] = get_filter(rmine, get_priority,
+                                              args.priority)
         if args.query_id:
             if not args.project:
                 raise RuntimeError("query_id argument requires '--project "
                                    "[projectid]' argument also")
             qdict['query_id'] = args.query_id
-        # Get the issues
-        ishes = rmine.issue.filter(**qdict)
-        if args.priority:
-            priority = get_priority(rmine, args.priority)
-            ishes = [i for i in ishes
-                     if i.priority.name.lower() == priority.name.lower()]
+        if args.stats:
+            from .stats import issue_stats
+            return issue_stats(rmine, qdict, args)
+        if args.verbose:
+            qdict['include'] = 'relations'
+        if args.watch:
+            from .watch import watch
+            return watch(rmine, qdict, args)
+        page_size = args.page_size or rmine.batch_size
+        if args.limit:
+            page_size = min(page_size, args.limit)
+        # Get the issues, a page at a time
+        ishes = iter_issues(rmine, qdict, page_size, prefetch=args.verbose)
+        if args.limit:
+            ishes = itertools.islice(ishes, args.limit)
         # This output is kinda lame, but functional for now
         for issue in ishes:
-            print_issue(rmine, issue, args.verbose, args.oneline)
-            if not args.oneline:
+            output_issue(rmine, issue, args)
+            if not args.oneline and args.output is None:
                 print('##############')
         return
 
     # create
+    if args.create and args.from_file:
+        return create_from_file(args, rmine)
     if args.create:
         idict = {}
         # We have to have these items to continue
         if not args.project or not args.subject:
             raise RuntimeError('project and subject must be defined')
-        idict['project_id'] = args.project
+        idict['project_id'] = get_project(rmine, args.project, exact=True)
         idict['subject'] = args.subject
         # Get tracker by type
-        itype = [
-            tracker.id for tracker in rmine.tracker.all() if
-            tracker.name == args.type]
-        try:
-            idict['tracker_id'] = itype[0]
-        except IndexError:
-            raise RuntimeError('Unknown issue type %s' % args.type)
+        idict['tracker_id'] = get_tracker(rmine, args.type)
         if args.assigned_to and args.assigned_to != 'UNASSIGNED':
-            idict['assigned_to_id'] = get_user(rmine, args.assigned_to)
+            idict['assigned_to_id'] = get_user(rmine, args.assigned_to,
+                                               exact=True)
         # Would be rad to do a git commit like editor pop up here
         if args.description:
             idict['description'] = args.description
@@ -265,16 +704,10 @@ def issues(args, rmine):
             idict['description'] = editor_text()
         # figure out the status
         if args.status:
-            stat = [status for status in rmine.issue_status.all() if
-                    status.name == args.status]
-            try:
-                idict['status_id'] = stat[0].id
-            except IndexError:
-                raise RuntimeError('Unknown issue type %s' % args.type)
+            idict['status_id'] = get_status(rmine, args.status)
         # set priority
         if args.priority:
-            p = get_priority(rmine, args.priority)
-            idict['priority_id'] = p.id
+            idict['priority_id'] = get_priority(rmine, args.priority)
         # Create the issue
         issue = rmine.issue.create(**idict)
         # Create a relationship if one was asked for
@@ -283,73 +716,64 @@ def issues(args, rmine):
                             args.relation_type)
             issue = issue.refresh()
         # Print it out
-        print_issue(rmine, issue, args.verbose, args.oneline)
+        output_issue(rmine, issue, args)
         return
 
     # update the ticket(s)
     if args.update:
-        ishs = [rmine.issue.get(ID) for ID in args.ID]
         udict = {}
         # Discover status ID
         if args.status:
-            stat = [status for status in rmine.issue_status.all() if
-                    status.name == args.status]
-            try:
-                udict['status_id'] = stat[0].id
-            except IndexError:
-                raise RuntimeError('Unknown issue status %s' % args.status)
+            udict['status_id'] = get_status(rmine, args.status)
 
         if args.type:
-            itype = [
-                tracker for tracker in rmine.tracker.all()
-                if tracker.name == args.type]
-            try:
-                udict['tracker_id'] = itype[0].id
-            except IndexError:
-                raise RuntimeError('Unknown issue type %s' % args.type)
+            udict['tracker_id'] = get_tracker(rmine, args.type)
 
         if args.assigned_to:
-            udict['assigned_to_id'] = get_user(rmine, args.assigned_to)
+            udict['assigned_to_id'] = get_user(rmine, args.assigned_to,
+                                               exact=True)
         if args.project:
-            udict['project_id'] = args.project
+            udict['project_id'] = get_project(rmine, args.project,
+                                              exact=True)
         if args.subject:
             udict['subject'] = args.subject
         if args.description:
             udict['description'] = args.description
         if args.priority:
-            udict['priority_id'] = get_priority(rmine, args.priority).id
+            udict['priority_id'] = get_priority(rmine, args.priority)
         if args.notes:
             udict['notes'] = args.notes
+        if not udict and not args.relate_to:
+            # Nothing would be sent, so nothing would say the IDs are bad
+            raise RuntimeError('Nothing to update, give a field to change, '
+                               '--notes or --relate_to')
 
-        for ish in ishs:
+        def update(ID):
             if udict:
-                rmine.issue.update(ish.id, **udict)
-            else:
-                rmine.issue.get(ish.id)
+                rmine.issue.update(ID, **udict)
             if args.relate_to:
-                create_relation(rmine, ish.id, args.relate_to,
+                create_relation(rmine, ID, args.relate_to,
                                 args.relation_type)
-            ish = ish.refresh()
-            print_issue(rmine, ish, args.verbose, args.oneline)
-        return
+
+        results = bulk_apply(update, args.ID, args.jobs)
+        return report_bulk(rmine, results, 'update', args)
 
     # close the ticket(s)
     if args.close:
-        ishs = [rmine.issue.get(ID) for ID in args.ID]
-        closestatus = [status for status in rmine.issue_status.all() if
-                       status.name == 'Closed']
-        for ish in ishs:
-            rmine.issue.update(ish.id, status_id=closestatus[0].id,
-                               notes=args.notes)
-            ish = ish.refresh()
-            print_issue(rmine, ish, args.verbose, args.oneline)
-        return
+        closestatus = get_status(rmine, 'Closed')
+
+        def close(ID):
+            rmine.issue.update(ID, status_id=closestatus, notes=args.notes)
+
+        results = bulk_apply(close, args.ID, args.jobs)
+        return report_bulk(rmine, results, 'close', args)
 
     # issue types
     if args.list_types:
         if args.project:
             # Get trackers via the project entry point
-            proj = rmine.project.get(args.project, include='trackers')
+            proj = rmine.project.get(get_project(rmine, args.project),
+                                     include='trackers')
             print('Available issue types for %s :' % proj.url)
             print('\n'.join(itype.name for itype in proj.trackers))
         else:
@@ -385,10 +809,315 @@ def projects(args, rmine):
 
     if args.list:
         for proj in rmine.project.all():
-            print_project(rmine, proj, args.verbose)
+            if args.output is None:
+                print_project(rmine, proj, args.verbose)
+            else:
+                args.output.write('project', resource_record(proj))
         return
 
 
+def issue_data(issue):
+    """Get the JSON Redmine sent for an issue, for the mirror."""
+
+    data = resource_record(issue)
+    # The mirror never fetches these lazily
+    data.setdefault('relations', [])
+    data.setdefault('journals', [])
+    return data
+
+
+def sync(args, rmine):
+    """Handle sync"""
+
+    mirror = rmine.mirror
+    projects = get_table(rmine, 'projects', refresh=True)
+    # Known by identifier, however they were asked for
+    index = NameIndex('projects', projects)
+    synced = [index.find(project)['identifier']
+              for project in args.project or []]
+    synced = synced or mirror.synced_projects()
+    if not synced:
+        raise RuntimeError('Nothing synced yet, use --project to pick '
+                           'projects to mirror')
+    mirror.set_projects([(p['id'], p['identifier'], p['name'],
+                          (p.get('parent') or {}).get('id'))
+                         for p in projects])
+    mirror.set_statuses([(s.id, s.name, dict(s).get('is_closed', False))
+                         for s in rmine.issue_status.all()])
+    mirror.set_meta('me', rmine.user.get('current').id)
+    mirror.commit()
+
+    status = 0
+    for project in synced:
+        since = None if args.full else mirror.synced(project)
+        qdict = {'project_id': project, 'status_id': '*',
+                 'sort': 'updated_on', 'include': 'relations'}
+        if since:
+            # >= rather than > so nothing updated in the same second is
+            # missed, at the cost of fetching a few issues again
+            qdict['updated_on'] = '>=%s' % since
+        changed = {}
+        for issue in iter_issues(rmine, qdict, rmine.batch_size):
+            changed[issue.id] = issue_data(issue)
+
+        def fetch_journals(ID):
+            issue = rmine.issue.get(ID, include='journals')
+            changed[ID]['journals'] = issue_data(issue)['journals']
+
+        failed = []
+        if args.journals:
+            results = bulk_apply(fetch_journals, changed.keys(), args.jobs)
+            failed = [(ID, e) for ID, e in results if e is not None]
+        for data in changed.values():
+            mirror.store(data)
+        if args.full:
+            mirror.prune(mirror.project_ids(project), changed.keys())
+        for ID, error in failed:
+            LOG.error('Unable to fetch journals of issue %s: %s' %
+                      (ID, error))
+        # Leave the sync point alone so failed issues are fetched again
+        if failed:
+            status = 1
+        elif changed:
+            mirror.set_synced(project, max(d['updated_on']
+                                           for d in changed.values()))
+        elif not since:
+            mirror.set_synced(project, '')
+        mirror.commit()
+        LOG.info('Synced %s issues of %s' % (len(changed), project))
+    return status
+
+
+def create_from_file(args, rmine):
+    """Create the issues listed in --from-file, printing their IDs."""
+
+    from .batch import create_issues, read_operations
+
+    fmt = 'csv' if args.from_file.endswith('.csv') else 'jsonl'
+    if args.from_file == '-':
+        rows = read_operations(sys.stdin, fmt)
+    else:
+        with open(args.from_file) as fh:
+            rows = read_operations(fh, fmt)
+    # Given on the command line, these apply to every row without them
+    defaults = dict((field, getattr(args, field))
+                    for field in ('project', 'type', 'status', 'priority',
+                                  'assigned_to', 'relation_type')
+                    if getattr(args, field))
+    if defaults.get('assigned_to') == 'UNASSIGNED':
+        del defaults['assigned_to']
+    rows = [(key, dict(defaults, **row)) for key, row in rows]
+    results = create_issues(rmine, rows, {'type': args.type}, args.jobs)
+    for key, ID, error in results:
+        if error is not None:
+            LOG.error('Row %s: %s' % (key, error))
+        if args.output is not None:
+            args.output.write('row', {'key': key, 'id': ID, 'error': error})
+        elif ID is not None:
+            print('%s %s' % (key, ID))
+    failed = len([error for key, ID, error in results if error])
+    if failed:
+        LOG.error('%s of %s rows failed' % (failed, len(results)))
+        return 1
+    return 0
+
+
+def export(args, rmine):
+    """Handle export"""
+
+    from .export import export
+    return export(args, rmine)
+
+
+def batch(args, rmine):
+    """Handle batch"""
+
+    from .batch import completed, read_operations, ResultLog, run_batch
+    from .client import RateLimiter
+
+    if args.resume and not args.log:
+        raise RuntimeError('--resume requires --log')
+    fmt = args.input_format
+    if fmt is None:
+        fmt = 'csv' if args.file.endswith('.csv') else 'jsonl'
+    if args.file == '-':
+        operations = read_operations(sys.stdin, fmt)
+    else:
+        with open(args.file) as fh:
+            operations = read_operations(fh, fmt)
+    if args.resume:
+        done = completed(args.log)
+        LOG.info('Skipping %s operations done before' %
+                 len([key for key, op in operations if key in done]))
+        operations = [(key, op) for key, op in operations
+                      if key not in done]
+    if args.rate:
+        rmine.throttle = RateLimiter(args.rate)
+    log = ResultLog(args.log)
+    try:
+        failed = run_batch(rmine, operations,
+                           {'type': args.type, 'project': args.project},
+                           args.jobs, log)
+    finally:
+        log.close()
+    if failed:
+        LOG.error('%s of %s operations failed' % (failed, len(operations)))
+        return 1
+    return 0
+
+
+def interactive(args, rmine):
+    """Handle shell"""
+
+    from .repl import RoreShell
+    RoreShell(rmine).cmdloop()
+
+
+def serve(args, rmine):
+    """Handle daemon"""
+
+    from .daemon import listen, redirect_output, socket_path
+
+    # A client going away mid command mustn't take us with it
+    if hasattr(signal, 'SIGPIPE'):
+        signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+    path = args.socket or socket_path()
+    server = listen(path)
+    redirect_output(server)
+    LOG.info('Listening on %s' % path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def several_sites(args):
+    """Whether --site names more than one site."""
+
+    return args.site == 'all' or len(split_names(args.site)) > 1
+
+
+def runs_on_several_sites(args):
+    """Whether the command only reads, so can run on several sites."""
+
+    if args.command == projects:
+        return args.list
+    if args.command != issues or args.graph:
+        return False
+    if args.query:
+        return not args.watch
+    return bool(args.ID) and not (args.update or args.close)
+
+
+def forwardable(args):
+    """Whether the daemon can run this command for us."""
+
+    if not args.daemon or args.command not in (issues, users, projects,
+                                               sync):
+        return False
+    # It would write --trace-json relative to its own directory
+    if several_sites(args) or args.trace_json:
+        return False
+    if args.command != issues:
+        return True
+    # The daemon has no terminal to run an editor in, would read files
+    # from its own directory, and would keep watching after we were
+    # interrupted
+    return not (args.create and not args.description or args.from_file or
+                args.watch)
+
+
+def add_format_args(parser, text_formats=('text',)):
+    """Add --format and --fields to a subcommand's parser."""
+
+    formats = list(text_formats) + sorted(WRITERS)
+    parser.add_argument('--format', choices=formats, default='text',
+                        help='Output format, json, jsonl and csv are '
+                        'written as records arrive.  Defaults to text.')
+    parser.add_argument('--fields', metavar='FIELD,...',
+                        help='Only output these fields with json, jsonl '
+                        'and csv')
+    parser.set_defaults(output=None)
+
+
+def setup_output(args):
+    """Pick the --format writer for args, None meaning plain prints."""
+
+    if getattr(args, 'format', None) == 'oneline':
+        args.oneline = True
+    args.output = get_writer(getattr(args, 'format', None), sys.stdout,
+                             split_names(getattr(args, 'fields', None)))
+
+
+def default_jobs(args, rmine):
+    """Make the site's engine pick --jobs for commands not given it."""
+
+    if getattr(args, 'jobs', 0) is None:
+        args.jobs = rmine.jobs
+
+
+def apply_defaults(args, rmine):
+    """Fill in the site's default tracker and project for new issues."""
+
+    # Defaults only apply to new issues, otherwise they would turn into
+    # filters on queries and changes on updates
+    if args.command == batch or (args.command == issues and args.create):
+        if not args.type:
+            args.type = rmine.defaults.get('type') or 'Bug'
+        if not args.project:
+            args.project = rmine.defaults.get('project')
+
+
+def run_command(args, rmine):
+    """Run the command args picked, returning its exit status."""
+
+    setup_output(args)
+    apply_defaults(args, rmine)
+    default_jobs(args, rmine)
+    if args.trace or args.trace_json:
+        from .trace import Tracer
+        rmine.tracer = Tracer(rmine.cache)
+    try:
+        return args.command(args, rmine)
+    finally:
+        if args.output is not None:
+            args.output.close()
+        if rmine.tracer is not None:
+            report_trace(args, rmine)
+            rmine.tracer = None
+
+
+def report_trace(args, rmine):
+    """Print the --trace summary, and save it with --trace-json."""
+
+    from .trace import format_report
+
+    report = rmine.tracer.report(rmine.cache)
+    if args.trace:
+        sys.stdout.flush()
+        sys.stderr.write(format_report(report))
+    if args.trace_json:
+        import json
+        with open(args.trace_json, 'w') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+
+
+def date_arg(value):
+    """Check an argument is a YYYY-MM-DD date, for argparse's type=."""
+
+    from datetime import datetime
+
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError('%r is not a YYYY-MM-DD date' %
+                                         value)
+    return value
+
+
 def create_parser():
     parser = argparse.ArgumentParser(prog='rore')
     # config
@@ -397,12 +1126,25 @@ def create_parser():
                         '(defaults to ~/.rore)')
     parser.add_argument('--site', '-S', default='default',
                         help='Specify which site to use '
-                        '(defaults to default)')
+                        '(defaults to default).  Separate several sites '
+                        'with commas, or give all, to query them all at '
+                        'once.')
     # verbosity
     parser.add_argument('-v', action='store_true',
                         help='Run with verbose debug output')
     parser.add_argument('-q', action='store_true',
                         help='Run quietly only displaying errors')
+    parser.add_argument('--trace', action='store_true',
+                        help='Time every request and print a summary to '
+                        'stderr at the end')
+    parser.add_argument('--trace-json', metavar='FILE',
+                        help='Save the --trace summary to FILE as JSON')
+    # caching
+    parser.add_argument('--no-daemon', dest='daemon', action='store_false',
+                        help="Run here even if a rore daemon is listening")
+    parser.add_argument('--refresh-cache', action='store_true',
+                        help='Ignore cached trackers, statuses, priorities '
+                        'and users and fetch them again')
 
     # subparsers
     subparsers = parser.add_subparsers(
@@ -437,7 +1179,9 @@ def create_parser():
     issues_parser.add_argument('--project', help='Filter by or assign to '
                                'project')
     issues_parser.add_argument('--type', help='Filter by or create issue '
-                               'type.  Defaults to Bug.')
+                               'type.  Defaults to Bug when creating.  '
+                               'Separate several types with commas to '
+                               'filter by any of them.')
     # I don't like the asterisk here, change it to something else soon
     issues_parser.add_argument('--nosubs', help='Filter out issues from sub '
                                'projects', action='store_true')
@@ -447,7 +1191,9 @@ def create_parser():
                        'user. Defaults to UNASSIGNED when creating.')
     group.add_argument('--mine', action='store_true', help='Only your issues')
     issues_parser.add_argument('--priority', help='Filter by or create '
-                               'priority. Defaults to Normal')
+                               'priority. Defaults to Normal.  Separate '
+                               'several priorities with commas to filter '
+                               'by any of them.')
     issues_parser.add_argument('--status',
                                help='Only deal with issues with this status '
                                'or set an issue to this status.')
@@ -460,6 +1206,14 @@ def create_parser():
     issues_parser.add_argument('--query_id', help='Filter by query ID. '
                                ' Requires --project [project] and '
                                '--query arguments.')
+    issues_parser.add_argument('--from-file', metavar='FILE',
+                               help='With --create, create a ticket for '
+                               'each row of a CSV or JSONL file (- for '
+                               'stdin), and print the row and ticket ID of '
+                               'each.  Columns are named after these '
+                               'options, which fill in what a row leaves '
+                               'out.  A relate_to of @ROW relates to the '
+                               'ticket made for another row.')
     issues_parser.add_argument('--relate_to', help='Create a relationship',
                                type=int)
     issues_parser.add_argument('--relation_type', help='Type of relationship '
@@ -474,6 +1228,66 @@ def create_parser():
     issues_parser.add_argument('--oneline', action='store_true',
                                help='Show each ticket on one line',
                                default=False)
+    issues_parser.add_argument('--journals', type=int, metavar='N',
+                               help='With --verbose, show only the last N '
+                               'journal entries of each ticket.  0 skips '
+                               'fetching them.')
+    issues_parser.add_argument('--since', metavar='DATE', type=date_arg,
+                               help='With --verbose, show only journal '
+                               'entries made on or after DATE (YYYY-MM-DD)')
+    issues_parser.add_argument('--jobs', '-j', type=int,
+                               metavar='N',
+                               help='Create, update or close N tickets, '
+                               'or fetch N --stats groups or --graph '
+                               'batches, at a time' + JOBS_DEFAULT)
+    issues_parser.add_argument('--no-refresh', dest='refresh',
+                               action='store_false',
+                               help="Don't fetch and show tickets again "
+                               'after updating or closing them')
+    issues_parser.add_argument('--local', action='store_true',
+                               help='Answer --query or issue IDs from the '
+                               'local mirror kept by "rore sync"')
+    issues_parser.add_argument('--search', metavar='TEXT',
+                               help='Full text search of subjects, '
+                               'descriptions and notes.  Requires --local.')
+    issues_parser.add_argument('--limit', type=int, metavar='N',
+                               help='Stop after N tickets when querying')
+    issues_parser.add_argument('--page-size', type=int, metavar='N',
+                               help='Fetch N tickets per request when '
+                               'querying.  Defaults to the batch size.')
+
+    issues_parser.add_argument('--watch', action='store_true',
+                               help='Keep querying, printing tickets as '
+                               'they change, until interrupted')
+    issues_parser.add_argument('--interval', type=float, default=60,
+                               metavar='SECONDS',
+                               help='Longest wait between --watch polls, '
+                               'used while nothing changes.  Defaults to '
+                               '60.')
+    issues_parser.add_argument('--min-interval', type=float, default=10,
+                               metavar='SECONDS',
+                               help='Shortest wait between --watch polls, '
+                               'used while tickets keep changing.  Defaults '
+                               'to 10.')
+
+    issues_parser.add_argument('--graph', type=int, metavar='ID',
+                               help='Print the tickets related to ID, '
+                               'their relations, parents and subtasks, and '
+                               'so on, as Graphviz DOT or --format '
+                               'records')
+    issues_parser.add_argument('--depth', type=int, metavar='N',
+                               help='Only follow --graph N relations from '
+                               'ID.  Defaults to following them all.')
+    issues_parser.add_argument('--stats', action='store_true',
+                               help='Count the tickets a query matches by '
+                               '--group-by instead of listing them')
+    issues_parser.add_argument('--group-by', default='status',
+                               choices=['status', 'assigned_to',
+                                        'priority', 'tracker'],
+                               help='What --stats counts tickets by.  '
+                               'Defaults to status.')
+
+    add_format_args(issues_parser, ('text', 'oneline'))
 
     # Lastly just feed specific issue numbers in
     issues_parser.add_argument('ID', help='Issue IDs to find', nargs='*')
@@ -486,6 +1300,7 @@ def create_parser():
                                         help='Interact with users')
     user_parser.add_argument('--me', action='store_true',
                              help='Get your user information')
+    add_format_args(user_parser)
     # assign the function
     user_parser.set_defaults(command=users)
 
@@ -500,9 +1315,100 @@ def create_parser():
     project_parser.add_argument('--verbose', action='store_true',
                                 help='Show more of the project details',
                                 default=False)
+    add_format_args(project_parser)
     # assign the function
     project_parser.set_defaults(command=projects)
 
+    # Sync
+    sync_parser = subparsers.add_parser('sync',
+                                        help='Mirror issues locally for '
+                                        'issues --local')
+    sync_parser.add_argument('--project', action='append',
+                             help='Project to mirror, may be repeated.  '
+                             'Defaults to every project mirrored so far.')
+    sync_parser.add_argument('--full', action='store_true',
+                             help='Fetch everything again and drop issues '
+                             'that no longer exist')
+    sync_parser.add_argument('--no-journals', dest='journals',
+                             action='store_false',
+                             help="Don't fetch journals of changed issues")
+    sync_parser.add_argument('--jobs', '-j', type=int,
+                             metavar='N',
+                             help='Fetch journals of N issues at a time' +
+                             JOBS_DEFAULT)
+    # assign the function
+    sync_parser.set_defaults(command=sync)
+
+    # Export
+    export_parser = subparsers.add_parser('export',
+                                          help="Save a project's issues, "
+                                          'relations and journals to '
+                                          'gzipped JSONL files')
+    export_parser.add_argument('--project', required=True,
+                               help='Project to export')
+    export_parser.add_argument('--dir', metavar='DIR',
+                               help='Where to write the export.  Running '
+                               'an export into the same DIR again resumes '
+                               'it.  Defaults to PROJECT-export.')
+    export_parser.add_argument('--since', metavar='DATE',
+                               help='Only export issues updated on or '
+                               'after DATE, such as the "newest" of an '
+                               'earlier export')
+    export_parser.add_argument('--no-journals', dest='journals',
+                               action='store_false',
+                               help="Don't fetch the issues' journals")
+    export_parser.add_argument('--jobs', '-j', type=int,
+                               metavar='N',
+                               help='Fetch N pages at a time' + JOBS_DEFAULT)
+    export_parser.add_argument('--page-size', type=int, metavar='N',
+                               help='Put N issues in each file.  Defaults '
+                               'to the batch size.')
+    export_parser.set_defaults(command=export)
+
+    # Batch
+    batch_parser = subparsers.add_parser('batch',
+                                         help='Create, update, close and '
+                                         'relate issues listed in a file')
+    batch_parser.add_argument('file', nargs='?', default='-',
+                              help='JSONL or CSV operations, one per line. '
+                              'Defaults to stdin.')
+    batch_parser.add_argument('--input-format', choices=['jsonl', 'csv'],
+                              help='Format of the operations.  Defaults to '
+                              'csv for .csv files and jsonl otherwise.')
+    batch_parser.add_argument('--jobs', '-j', type=int,
+                              metavar='N',
+                              help='Run N operations at a time' +
+                              JOBS_DEFAULT)
+    batch_parser.add_argument('--rate', type=float, metavar='N',
+                              help='Make at most N requests a second')
+    batch_parser.add_argument('--log', metavar='FILE',
+                              help='Append the result of each operation to '
+                              'FILE as JSON lines')
+    batch_parser.add_argument('--resume', action='store_true',
+                              help='Skip operations --log says succeeded')
+    # Filled in from the config, like issues --create
+    batch_parser.set_defaults(type=None, project=None)
+    # assign the function
+    batch_parser.set_defaults(command=batch)
+
+    # Shell
+    shell_parser = subparsers.add_parser('shell',
+                                         help='Run commands interactively '
+                                         'over one connection')
+    # assign the function
+    shell_parser.set_defaults(command=interactive)
+
+    # Daemon
+    daemon_parser = subparsers.add_parser('daemon',
+                                          help='Serve rore commands over a '
+                                          'Unix socket, keeping connections '
+                                          'warm')
+    daemon_parser.add_argument('--socket', metavar='PATH',
+                               help='Listen on PATH instead of $RORE_SOCKET '
+                               'or ~/.cache/rore/daemon.sock')
+    # assign the function
+    daemon_parser.set_defaults(command=serve)
+
     return parser
 
 
@@ -522,17 +1428,32 @@ def setup_logging(args):
     stderrhandler.setFormatter(formatter)
     LOG.addHandler(stdouthandler)
     LOG.addHandler(stderrhandler)
+    LOG.setLevel(log_level(args))
+
 
+def log_level(args):
     if args.v:
-        LOG.setLevel(logging.DEBUG)
+        return logging.DEBUG
     elif args.q:
-        LOG.setLevel(logging.WARNING)
-    else:
-        LOG.setLevel(logging.INFO)
+        return logging.WARNING
+    return logging.INFO
 
 
-def load_config(args):
-    # load the credentials
+def get_option(cparser, site, option, default, kind=''):
+    """Get an option for a site, or default if it isn't set.
+
+    kind picks the ConfigParser getter: '', 'int', 'float' or 'boolean'.
+    """
+
+    try:
+        return getattr(cparser, 'get' + kind)(site, option)
+    except ConfigParser.NoOptionError:
+        return default
+
+
+def read_config(args):
+    """Get the path and a parser of the config file."""
+
     if not args.config:
         args.config = '~/.rore'
     configfile = os.path.expanduser(args.config)
@@ -542,32 +1463,102 @@ def load_config(args):
     except IOError:
         LOG.error("Couldn't find config file: %s" % configfile)
         exit(1)
+    return configfile, cparser
 
-    siteurl = cparser.get(args.site, 'url')
-    key = cparser.get(args.site, 'key')
-    try:
-        verify = cparser.getboolean(args.site, 'verify')
-    except ConfigParser.NoOptionError:
-        verify = False
-
-    if args.command == issues:
-        if not args.type:
-            try:
-                args.type = cparser.get(args.site, 'default issue tracker')
-            except ConfigParser.NoOptionError:
-                args.type = 'Bug'
-
-        if not args.project:
-            try:
-                args.type = cparser.get(args.site, 'default issue project')
-            except ConfigParser.NoOptionError:
-                pass
-    return siteurl, key, verify
 
+def load_config(args):
+    # Only needed once we connect, see the note on imports at the top
+    from .client import DEFAULT_BACKOFF, DEFAULT_BATCH_SIZE
+    from .client import DEFAULT_CONCURRENCY
+    from .client import DEFAULT_CONNECT_TIMEOUT, DEFAULT_POOL_SIZE
+    from .client import DEFAULT_READ_TIMEOUT, DEFAULT_RETRIES
+    from .httpcache import DEFAULT_HTTP_CACHE_SIZE, response_cache_path
+    from .mirror import mirror_path
+
+    configfile, cparser = read_config(args)
+    site = args.site
+    siteurl = cparser.get(site, 'url')
+    key = cparser.get(site, 'key')
+    verify = get_option(cparser, site, 'verify', False, 'boolean')
+    cachedir = get_option(cparser, site, 'cache dir', DEFAULT_CACHE_DIR)
+    engine = get_option(cparser, site, 'engine', 'serial')
+    if engine not in ENGINES:
+        LOG.error('Unknown engine %s in %s, use one of %s' %
+                  (engine, configfile, ', '.join(ENGINES)))
+        exit(1)
 
-def connect_to_redmine(siteurl, key, verify):
-    # Figure out a way to make this a config option in .rore
-    rmine = redmine.Redmine(siteurl, key=key, requests={'verify': verify})
+    return {'configfile': configfile,
+            'site': site,
+            'url': siteurl,
+            'key': key,
+            'verify': verify,
+            'cache': cache_path(cachedir, site),
+            'mirror': get_option(cparser, site, 'mirror',
+                                 mirror_path(cachedir, site)),
+            'http_cache': response_cache_path(cachedir, site),
+            'http_cache_size': get_option(cparser, site, 'http cache size',
+                                          DEFAULT_HTTP_CACHE_SIZE, 'int'),
+            'cache_ttl': get_option(cparser, site, 'cache ttl',
+                                    DEFAULT_CACHE_TTL, 'int'),
+            'refresh_cache': args.refresh_cache,
+            'batch_size': get_option(cparser, site, 'batch size',
+                                     DEFAULT_BATCH_SIZE, 'int'),
+            'pool_size': get_option(cparser, site, 'pool size',
+                                    DEFAULT_POOL_SIZE, 'int'),
+            'connect_timeout': get_option(cparser, site, 'connect timeout',
+                                          DEFAULT_CONNECT_TIMEOUT, 'float'),
+            'read_timeout': get_option(cparser, site, 'read timeout',
+                                       DEFAULT_READ_TIMEOUT, 'float'),
+            'retries': get_option(cparser, site, 'retries',
+                                  DEFAULT_RETRIES, 'int'),
+            'backoff': get_option(cparser, site, 'retry backoff',
+                                  DEFAULT_BACKOFF, 'float'),
+            'gzip': get_option(cparser, site, 'gzip', True, 'boolean'),
+            'engine': engine,
+            'default_type': get_option(cparser, site,
+                                       'default issue tracker', 'Bug'),
+            'default_project': get_option(cparser, site,
+                                          'default issue project', None),
+            'concurrency': get_option(cparser, site, 'concurrency',
+                                      DEFAULT_CONCURRENCY, 'int')}
+
+
+def connect_to_redmine(config):
+    from .client import Engine, make_session, OVERLOAD_STATUSES
+    from .client import Redmine, RETRY_STATUSES
+    from .httpcache import ResponseCache
+    from .mirror import Mirror
+
+    cache = MetadataCache(config['cache'], url=config['url'],
+                          ttl=config['cache_ttl'],
+                          refresh=config['refresh_cache'])
+    threads = config.get('engine') == 'threads'
+    pool_size = config['pool_size']
+    statuses = RETRY_STATUSES
+    if threads:
+        pool_size = max(pool_size, config['concurrency'])
+        # The engine backs off from these itself, for every thread at once
+        statuses = [s for s in statuses if s not in OVERLOAD_STATUSES]
+    session = make_session(pool_size=pool_size,
+                           retries=config['retries'],
+                           backoff=config['backoff'],
+                           gzip=config['gzip'], statuses=statuses)
+    timeout = (config['connect_timeout'], config['read_timeout'])
+    rmine = Redmine(config['url'], key=config['key'],
+                    requests={'verify': config['verify'],
+                              'timeout': timeout},
+                    cache=cache, session=session,
+                    mirror=Mirror(os.path.expanduser(config['mirror'])),
+                    batch_size=config['batch_size'])
+    if config['http_cache_size'] > 0:
+        rmine.response_cache = ResponseCache(
+            config['http_cache'], config['http_cache_size'] * 1024 * 1024)
+    rmine.defaults = {'type': config['default_type'],
+                      'project': config['default_project']}
+    if threads:
+        rmine.engine = Engine(config['concurrency'], config['retries'],
+                              config['backoff'])
+        rmine.jobs = config['concurrency']
     return rmine
 
 
@@ -575,9 +1566,26 @@ def cmd():
     """This is the entry point for the shell command"""
     parser = create_parser()
     args = parser.parse_args()
+    if several_sites(args) and not runs_on_several_sites(args):
+        parser.error('several sites only work with issues --query, issues '
+                     'ID and projects --list')
+    # Die quietly when piped into head and friends
+    if hasattr(signal, 'SIGPIPE'):
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
     setup_logging(args)
-    config_keys = load_config(args)
-    rmine = connect_to_redmine(*config_keys)
-
-    # Run the required command -- pass args into it for reference
-    args.command(args, rmine)
+    if forwardable(args):
+        from .daemon import forward
+        configfile = os.path.abspath(os.path.expanduser(args.config or
+                                                        '~/.rore'))
+        status = forward(sys.argv[1:], configfile)
+        if status is not None:
+            return status
+    if several_sites(args):
+        from .multisite import run_sites
+        return run_sites(args)
+    config = load_config(args)
+    rmine = connect_to_redmine(config)
+
+    # Run the required command -- pass args into it for reference.  What
+    # it returns is our exit status.
+    return run_command(args, rmine)
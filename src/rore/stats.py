@@ -0,0 +1,161 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Count the issues of a query by status, tracker, priority or assignee.
+
+Rather than download the issues, each group is counted by asking for
+one issue with the group's filter added and reading the total_count of
+the answer.  Only when the groups can't be listed, or there are more of
+them than pages of issues, are the issues streamed and counted here.
+"""
+
+import collections
+
+from . import shell
+from .lookup import user_names
+
+
+# --group-by: the issue field, its filter, and the lookup table of its
+# values
+GROUPS = {
+    'status': ('status', 'status_id', 'statuses'),
+    'tracker': ('tracker', 'tracker_id', 'trackers'),
+    'priority': ('priority', 'priority_id', 'priorities'),
+    'assigned_to': ('assigned_to', 'assigned_to_id', 'users'),
+}
+
+# What issues matching none of the groups are counted as
+OTHER = '(other)'
+
+
+def count_issues(rmine, qdict):
+    """Get how many issues match qdict, fetching only one of them."""
+
+    page = rmine.issue.filter(limit=1, **qdict)
+    list(page)
+    return page.total_count
+
+
+def filter_ids(value):
+    """Get the IDs a filter value names, or None if it isn't a list."""
+
+    try:
+        return set(int(v) for v in unicode(value).split('|'))
+    except ValueError:
+        return None
+
+
+def group_values(rmine, group_by, qdict):
+    """Get the (filter value, name) of every group worth counting.
+
+    Only values the query's own filter allows are counted.  Returns None
+    when the groups can't be listed.
+    """
+
+    field, param, table = GROUPS[group_by]
+    if 'query_id' in qdict:
+        # A saved query's filters would override ours
+        return None
+    if table == 'users' and rmine.cache.get('users-forbidden'):
+        return None
+    from redmine import exceptions as rm_exc
+    try:
+        entries = shell.get_table(rmine, table)
+    except (rm_exc.ForbiddenError, rm_exc.AuthError):
+        rmine.cache.set('users-forbidden', True)
+        return None
+    if table == 'statuses':
+        if any('is_closed' not in entry for entry in entries):
+            # Cached before we kept is_closed
+            entries = shell.get_table(rmine, table, refresh=True)
+        wanted = qdict.get(param, 'open')
+        if wanted in ('open', 'closed'):
+            entries = [e for e in entries
+                       if bool(e['is_closed']) == (wanted == 'closed')]
+            wanted = '*'
+    else:
+        wanted = qdict.get(param, '*')
+    if table == 'users':
+        names = [(e['id'], user_names(e)[2] or e['login']) for e in entries]
+        if wanted == '*':
+            names.append(('!*', 'none'))
+    else:
+        names = [(e['id'], e['name']) for e in entries]
+    if wanted == '*':
+        return names
+    ids = filter_ids(wanted)
+    if ids is None:
+        return None
+    return [(ID, name) for ID, name in names if ID in ids]
+
+
+def server_counts(rmine, qdict, param, values, jobs=1):
+    """Count the issues of each group, jobs requests at a time."""
+
+    counts = [None] * len(values)
+
+    def count(index):
+        value = values[index][0]
+        counts[index] = count_issues(rmine, dict(qdict, **{param: value}))
+
+    for index, error in shell.bulk_apply(count, range(len(values)), jobs):
+        if error is not None:
+            raise error
+    return [(ID, name, n) for (ID, name), n in zip(values, counts)]
+
+
+def streamed_counts(rmine, qdict, field, page_size):
+    """Count the issues of each group by fetching every issue."""
+
+    counts = collections.defaultdict(int)
+    for issue in shell.iter_issues(rmine, qdict, page_size):
+        value = dict(issue).get(field)
+        if value is None:
+            counts[(None, 'none')] += 1
+        else:
+            counts[(value['id'], value.get('name'))] += 1
+    return [(ID, name, n) for (ID, name), n in counts.items()]
+
+
+def issue_stats(rmine, qdict, args):
+    """Print how many issues matching qdict are in each --group-by group."""
+
+    field, param, table = GROUPS[args.group_by]
+    page_size = args.page_size or rmine.batch_size
+    total = count_issues(rmine, qdict)
+    values = group_values(rmine, args.group_by, qdict)
+    pages = -(-total // page_size)
+    if not total:
+        counts = []
+    elif values is None or len(values) >= pages:
+        shell.LOG.debug('Counting %s issues in %s pages' % (total, pages))
+        counts = streamed_counts(rmine, qdict, field, page_size)
+    else:
+        counts = server_counts(rmine, qdict, param, values, args.jobs)
+        other = total - sum(n for ID, name, n in counts)
+        if other > 0:
+            counts.append((None, OTHER, other))
+    counts = sorted((c for c in counts if c[2]),
+                    key=lambda c: (-c[2], c[1]))
+    if args.output is not None:
+        for ID, name, n in counts:
+            args.output.write('group', {'group_by': args.group_by,
+                                        'id': ID if ID != '!*' else None,
+                                        'name': name, 'count': n})
+        return
+    width = max([len(name) for ID, name, n in counts] + [len('Total')])
+    for ID, name, n in counts:
+        print(u'%-*s %s' % (width, name, n))
+    print('%-*s %s' % (width, 'Total', total))
@@ -0,0 +1,141 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import math
+import re
+import threading
+import time
+import urlparse
+
+
+# IDs in request paths, so /issues/1.json and /issues/2.json add up
+ID_RE = re.compile(r'/\d+(?=/|\.json)')
+
+
+def endpoint(method, url):
+    """Name the endpoint a request went to, e.g. GET /issues/{id}.json."""
+
+    return '%s %s' % (method.upper(),
+                      ID_RE.sub('/{id}', urlparse.urlparse(url).path))
+
+
+def percentile(values, pct):
+    """The pct percentile of values, by nearest rank."""
+
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def busy_time(spans):
+    """How long at least one of the (start, end) spans was running."""
+
+    total = 0.0
+    end = None
+    for start, stop in sorted(spans):
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+
+class Tracer(object):
+    """Time every request a client makes, for --trace.
+
+    Requests may come from several threads.  Network time counts the time
+    any request was in flight, so overlapping requests aren't counted
+    twice, and the rest of the command's time went to everything else:
+    parsing, lookups and formatting output.
+    """
+
+    def __init__(self, cache=None):
+        self.start = time.time()
+        self.lock = threading.Lock()
+        # endpoint: [(start, end, bytes received)]
+        self.requests = {}
+        self.counters = {}
+        # The metadata cache's counts before the command, as the daemon
+        # and rore shell keep one cache for many commands
+        self.cache_counts = (0, 0)
+        if cache is not None:
+            self.cache_counts = (cache.hits, cache.misses)
+
+    def record(self, method, url, start, end, size):
+        with self.lock:
+            self.requests.setdefault(endpoint(method, url), []).append(
+                (start, end, size))
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self, cache=None):
+        """Sum up what was recorded as a dict, ready for JSON."""
+
+        wall = time.time() - self.start
+        endpoints = {}
+        spans = []
+        for name, requests in self.requests.items():
+            times = [end - start for start, end, size in requests]
+            endpoints[name] = {'count': len(requests),
+                               'seconds': sum(times),
+                               'p50': percentile(times, 50),
+                               'p95': percentile(times, 95),
+                               'bytes': sum(r[2] for r in requests)}
+            spans.extend((start, end) for start, end, size in requests)
+        times = [end - start for start, end in spans]
+        network = busy_time(spans)
+        counters = dict(self.counters)
+        if cache is not None:
+            counters['metadata cache hits'] = (cache.hits -
+                                               self.cache_counts[0])
+            counters['metadata cache misses'] = (cache.misses -
+                                                 self.cache_counts[1])
+        return {'seconds': wall,
+                'network': network,
+                'elsewhere': max(wall - network, 0.0),
+                'requests': len(spans),
+                'bytes': sum(e['bytes'] for e in endpoints.values()),
+                'p50': percentile(times, 50),
+                'p95': percentile(times, 95),
+                'counters': counters,
+                'endpoints': endpoints}
+
+
+def format_report(report):
+    """The --trace summary printed when a command finishes."""
+
+    lines = ['trace: %d requests, %d bytes received, p50 %.3fs, p95 %.3fs' %
+             (report['requests'], report['bytes'], report['p50'],
+              report['p95']),
+             'trace: %.3fs total, %.3fs waiting on the network, %.3fs '
+             'elsewhere' % (report['seconds'], report['network'],
+                            report['elsewhere'])]
+    for name in sorted(report['counters']):
+        lines.append('trace: %s %s' % (name, report['counters'][name]))
+    if report['endpoints']:
+        lines.append('trace: %-40s %5s %8s %8s %8s %10s' %
+                     ('endpoint', 'count', 'total', 'p50', 'p95', 'bytes'))
+    for name, e in sorted(report['endpoints'].items(),
+                          key=lambda item: -item[1]['seconds']):
+        lines.append('trace: %-40s %5d %7.3fs %7.3fs %7.3fs %10d' %
+                     (name, e['count'], e['seconds'], e['p50'], e['p95'],
+                      e['bytes']))
+    return '\n'.join(lines) + '\n'
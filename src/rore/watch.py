@@ -0,0 +1,162 @@
+# Copyright (c) 2013 Jesse Keating <jesse.keating@rackspace.com>
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Follow an issue query as issues change, for issues --query --watch."""
+
+import itertools
+import sys
+import time
+
+from . import shell
+
+
+class Watcher(object):
+    """Print the issues of a query, then only those that change.
+
+    Each poll asks for the issues updated since the newest one seen, so a
+    quiet query costs one small request.  Timestamps are the server's, so
+    our clock doesn't matter.  Asking for >= rather than > the last
+    timestamp means nothing updated in the same second is missed, and
+    issues seen at that timestamp already are skipped.
+    """
+
+    def __init__(self, rmine, qdict, args):
+        self.rmine = rmine
+        self.qdict = qdict
+        self.args = args
+        self.page_size = args.page_size or rmine.batch_size
+        # ID: updated_on of every issue printed so far
+        self.seen = {}
+        self.since = None
+
+    def start(self):
+        """Print the issues matching now, most recently updated first."""
+
+        ishes = shell.iter_issues(self.rmine,
+                                  dict(self.qdict, sort='updated_on:desc'),
+                                  self.page_size, prefetch=self.args.verbose)
+        if self.args.limit:
+            ishes = itertools.islice(ishes, self.args.limit)
+        for issue in ishes:
+            self.note(issue)
+            self.output(issue)
+
+    def poll(self):
+        """Print the issues changed since the last poll, and how many."""
+
+        qdict = dict(self.qdict, sort='updated_on')
+        if self.since:
+            qdict['updated_on'] = '>=%s' % self.since
+        changed = []
+        for issue in shell.iter_issues(self.rmine, qdict, self.page_size):
+            before = self.seen.get(issue.id)
+            if before != dict(issue)['updated_on']:
+                changed.append((issue, before))
+            self.note(issue)
+        if self.args.verbose:
+            shell.prefetch_related(self.rmine,
+                                   [issue for issue, _ in changed])
+        journals = self.new_journals(changed)
+        for issue, before in changed:
+            self.output(issue, 'new' if before is None else 'updated',
+                        journals.get(issue.id, []))
+        return len(changed)
+
+    def note(self, issue):
+        updated_on = dict(issue)['updated_on']
+        self.seen[issue.id] = updated_on
+        self.since = max(self.since, updated_on)
+
+    def new_journals(self, changed):
+        """Fetch the journals added to updated issues since we saw them."""
+
+        # Verbose text output shows every journal anyway
+        if self.args.verbose and self.args.output is None:
+            return {}
+        found = {}
+        before = dict((issue.id, stamp) for issue, stamp in changed if stamp)
+
+        def fetch(ID):
+            issue = self.rmine.issue.get(ID, include='journals')
+            found[ID] = [j for j in dict(issue).get('journals') or []
+                         if j['created_on'] > before[ID]]
+
+        for ID, error in shell.bulk_apply(fetch, before, self.args.jobs):
+            if error is not None:
+                shell.LOG.error('Unable to fetch journals of issue %s: %s' %
+                                (ID, error))
+        return found
+
+    def output(self, issue, change=None, journals=()):
+        args = self.args
+        if args.output is not None:
+            record = shell.issue_record(
+                issue, args.verbose,
+                shell.shown_journals(self.rmine, issue, args))
+            if change:
+                record['change'] = change
+                record['journals'] = record.get('journals', journals)
+            args.output.write('issue', record)
+            return
+        shell.print_issue(self.rmine, issue, args.verbose, args.oneline,
+                          shell.shown_journals(self.rmine, issue, args))
+        for journal in journals:
+            if args.oneline:
+                notes = (journal.get('notes') or '').strip().splitlines()
+                print('    %s: %s' % (journal['user']['name'],
+                                      notes[0] if notes else '(changes)'))
+                continue
+            print('Updated by %s on %s:' % (journal['user']['name'],
+                                            journal['created_on']))
+            if journal.get('notes'):
+                print(journal['notes'])
+            print('')
+        if not args.oneline:
+            print('##############')
+
+
+def watch(rmine, qdict, args, polls=None):
+    """Run a Watcher until interrupted, or for polls polls.
+
+    The wait between polls halves after one that found changes, down to
+    --min-interval, and grows by half after a quiet one, up to
+    --interval.
+    """
+
+    watcher = Watcher(rmine, qdict, args)
+    watcher.start()
+    sys.stdout.flush()
+    interval = args.interval
+    count = 0
+    try:
+        while polls is None or count < polls:
+            count += 1
+            time.sleep(interval)
+            try:
+                changed = watcher.poll()
+            except Exception as e:
+                shell.LOG.error('Polling failed: %s' % e)
+                interval = args.interval
+                continue
+            if changed:
+                interval = max(args.min_interval, interval / 2.0)
+            else:
+                interval = min(args.interval, interval * 1.5)
+            shell.LOG.debug('%s changed, polling again in %.1fs' %
+                            (changed, interval))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -0,0 +1,427 @@
+"""A fake Redmine, serving the parts of the REST API rore uses.
+
+The data is synthetic and seeded, so the same arguments always give the
+same projects, issues, relations and journals.  Every request is counted
+by endpoint, along with the bytes going each way and the connections
+opened, so tests and benchmarks can see what a command cost:
+
+    server = FakeRedmine(issues=500).start()
+    ... point rore at server.url ...
+    server.stats['requests']
+    server.stop()
+"""
+
+import BaseHTTPServer
+import collections
+import hashlib
+import json
+import random
+import re
+import SocketServer
+import threading
+import urlparse
+
+
+TRACKERS = ['Bug', 'Feature', 'Support']
+# name, is_closed
+STATUSES = [('New', False), ('In Progress', False), ('Resolved', False),
+            ('Feedback', False), ('Closed', True), ('Rejected', True)]
+PRIORITIES = ['Low', 'Normal', 'High', 'Urgent', 'Immediate']
+# What list calls can include, the rest only come with a single issue
+LIST_INCLUDES = ('relations', 'attachments')
+
+
+def named(entries, ID):
+    return {'id': ID, 'name': entries[ID - 1]}
+
+
+def stamp(n):
+    """The nth timestamp, a minute apart."""
+
+    return '2014-%02d-%02dT%02d:%02d:00Z' % (1 + n // 40320 % 12,
+                                             1 + n // 1440 % 28,
+                                             n // 60 % 24, n % 60)
+
+
+class FakeRedmine(object):
+    """Synthetic Redmine data and an HTTP server for it."""
+
+    def __init__(self, projects=3, issues=200, relations=50, journals=2,
+                 users=10, seed=0):
+        rnd = random.Random(seed)
+        self.users = [{'id': i, 'login': 'user%s' % i, 'firstname': 'User',
+                       'lastname': str(i), 'mail': 'user%s@example.com' % i,
+                       'created_on': stamp(i)}
+                      for i in range(1, users + 1)]
+        self.projects = []
+        for i in range(1, projects + 1):
+            project = {'id': i, 'identifier': 'project%s' % i,
+                       'name': 'Project %s' % i,
+                       'description': 'Synthetic project %s' % i,
+                       'created_on': stamp(i), 'updated_on': stamp(i)}
+            if i > 1:
+                # Everything else is a subproject of the first
+                project['parent'] = {'id': 1, 'name': 'Project 1'}
+            self.projects.append(project)
+        self.issues = {}
+        for i in range(1, issues + 1):
+            self.issues[i] = self.make_issue(rnd, i, journals)
+        self.relations = {}
+        for i in range(1, min(relations, issues * (issues - 1) // 2) + 1):
+            while True:
+                pair = rnd.sample(range(1, issues + 1), 2)
+                if not any(set(pair) == set([r['issue_id'], r['issue_to_id']])
+                           for r in self.relations.values()):
+                    break
+            self.relations[i] = {'id': i, 'issue_id': pair[0],
+                                 'issue_to_id': pair[1],
+                                 'relation_type': 'relates', 'delay': None}
+        self.lock = threading.Lock()
+        # How many of the next requests to turn away with a 429
+        self.overload = 0
+        self.reset()
+        self.server = None
+
+    def make_issue(self, rnd, ID, journals):
+        user = rnd.choice(self.users)
+        project = rnd.choice(self.projects)
+        issue = {
+            'id': ID,
+            'project': {'id': project['id'], 'name': project['name']},
+            'tracker': named(TRACKERS, rnd.randint(1, len(TRACKERS))),
+            'status': named([s[0] for s in STATUSES],
+                            rnd.randint(1, len(STATUSES))),
+            'priority': named(PRIORITIES, rnd.randint(1, len(PRIORITIES))),
+            'author': {'id': user['id'], 'name': 'User %s' % user['id']},
+            'subject': 'Synthetic issue %s' % ID,
+            'description': 'Something is wrong with %s.\n' % ID * 5,
+            'start_date': '2014-01-01',
+            'done_ratio': 0,
+            'created_on': stamp(ID),
+            'updated_on': stamp(ID + 1000),
+            'journals': [{'id': ID * 100 + j,
+                          'user': {'id': user['id'],
+                                   'name': 'User %s' % user['id']},
+                          'notes': 'Note %s on issue %s' % (j, ID),
+                          # The last one is the issue's last update
+                          'created_on': stamp(ID + 1001 - journals + j),
+                          'details': []}
+                         for j in range(journals)],
+        }
+        if rnd.random() < 0.7:
+            assignee = rnd.choice(self.users)
+            issue['assigned_to'] = {'id': assignee['id'],
+                                    'name': 'User %s' % assignee['id']}
+        return issue
+
+    def reset(self):
+        """Forget the requests counted so far."""
+
+        with self.lock:
+            self.stats = {'requests': collections.Counter(),
+                          'bytes_in': 0, 'bytes_out': 0, 'connections': 0}
+
+    def count(self, endpoint, bytes_in, bytes_out):
+        with self.lock:
+            self.stats['requests'][endpoint] += 1
+            self.stats['bytes_in'] += bytes_in
+            self.stats['bytes_out'] += bytes_out
+
+    def start(self):
+        """Serve on a free local port in the background."""
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.redmine = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server.server_address
+
+    # The API
+
+    def issue_json(self, issue, include=()):
+        data = dict((k, v) for k, v in issue.items() if k != 'journals')
+        if 'relations' in include:
+            data['relations'] = self.relations_of(issue['id'])
+        if 'journals' in include:
+            data['journals'] = issue['journals']
+        if 'children' in include:
+            data['children'] = [
+                {'id': i['id'], 'tracker': i['tracker'],
+                 'subject': i['subject']}
+                for i in sorted(self.issues.values(), key=lambda i: i['id'])
+                if i.get('parent', {}).get('id') == issue['id']]
+        return data
+
+    def relations_of(self, ID):
+        return [r for r in sorted(self.relations.values(),
+                                  key=lambda r: r['id'])
+                if ID in (r['issue_id'], r['issue_to_id'])]
+
+    def project(self, ref):
+        for project in self.projects:
+            if str(project['id']) == ref or project['identifier'] == ref:
+                return project
+        return None
+
+    def match_issues(self, params):
+        issues = sorted(self.issues.values(), key=lambda i: -i['id'])
+        if 'project_id' in params:
+            project = self.project(params['project_id'])
+            if project is None:
+                return None
+            ids = set([project['id']])
+            if params.get('subproject_id') != '!*':
+                ids.update(p['id'] for p in self.projects
+                           if p.get('parent', {}).get('id') == project['id'])
+            issues = [i for i in issues if i['project']['id'] in ids]
+        status = params.get('status_id', 'open')
+        if status in ('open', 'closed'):
+            closed = set(n + 1 for n, s in enumerate(STATUSES) if s[1])
+            issues = [i for i in issues
+                      if (i['status']['id'] in closed) == (status == 'closed')]
+        elif status != '*':
+            wanted = set(int(s) for s in status.split('|'))
+            issues = [i for i in issues if i['status']['id'] in wanted]
+        for field in ('tracker', 'priority', 'assigned_to'):
+            value = params.get(field + '_id')
+            if value is None:
+                continue
+            if value == 'me':
+                value = '1'
+            elif value in ('*', '!*'):
+                issues = [i for i in issues
+                          if (field in i) == (value == '*')]
+                continue
+            wanted = set(int(v) for v in value.split('|'))
+            issues = [i for i in issues
+                      if i.get(field, {}).get('id') in wanted]
+        if params.get('issue_id', '').startswith('>='):
+            first = int(params['issue_id'][2:])
+            issues = [i for i in issues if i['id'] >= first]
+        elif 'issue_id' in params:
+            wanted = set(int(i) for i in params['issue_id'].split(','))
+            issues = [i for i in issues if i['id'] in wanted]
+        if 'parent_id' in params:
+            wanted = set(int(i) for i in params['parent_id'].split(','))
+            issues = [i for i in issues
+                      if i.get('parent', {}).get('id') in wanted]
+        if params.get('updated_on', '').startswith('>='):
+            since = params['updated_on'][2:]
+            issues = [i for i in issues if i['updated_on'] >= since]
+        if params.get('sort'):
+            field, _, order = params['sort'].partition(':')
+            issues.sort(key=lambda i: (i.get(field), i['id']),
+                        reverse=order == 'desc')
+        return issues
+
+    def get(self, path, params):
+        """Answer a GET, returning (status, endpoint, JSON)."""
+
+        include = params.get('include', '').split(',')
+        match = re.match(r'^/issues/(\d+)\.json$', path)
+        if match:
+            issue = self.issues.get(int(match.group(1)))
+            if issue is None:
+                return 404, '/issues/{id}.json', None
+            return 200, '/issues/{id}.json', {
+                'issue': self.issue_json(issue, include)}
+        match = re.match(r'^/issues/(\d+)/relations\.json$', path)
+        if match:
+            return 200, '/issues/{id}/relations.json', {
+                'relations': self.relations_of(int(match.group(1)))}
+        match = re.match(r'^/relations/(\d+)\.json$', path)
+        if match:
+            relation = self.relations.get(int(match.group(1)))
+            if relation is None:
+                return 404, '/relations/{id}.json', None
+            return 200, '/relations/{id}.json', {'relation': relation}
+        match = re.match(r'^/projects/([^/]+)\.json$', path)
+        if match:
+            project = self.project(match.group(1))
+            if project is None:
+                return 404, '/projects/{id}.json', None
+            data = dict(project)
+            if 'trackers' in include:
+                data['trackers'] = [named(TRACKERS, n + 1)
+                                    for n in range(len(TRACKERS))]
+            return 200, '/projects/{id}.json', {'project': data}
+        match = re.match(r'^/users/(\w+)\.json$', path)
+        if match:
+            ID = 1 if match.group(1) == 'current' else int(match.group(1))
+            if not 0 < ID <= len(self.users):
+                return 404, '/users/{id}.json', None
+            return 200, '/users/{id}.json', {'user': self.users[ID - 1]}
+        if path == '/issues.json':
+            issues = self.match_issues(params)
+            if issues is None:
+                return 404, path, None
+            # Like Redmine, lists only include relations and attachments
+            include = [i for i in include if i in LIST_INCLUDES]
+            return 200, path, self.page('issues', [
+                self.issue_json(i, include) for i in issues], params)
+        if path == '/projects.json':
+            return 200, path, self.page('projects', self.projects, params)
+        if path == '/users.json':
+            name = params.get('name', '').lower()
+            users = [u for u in self.users
+                     if name in u['login'] or
+                     name in ('%s %s' % (u['firstname'],
+                                         u['lastname'])).lower()]
+            return 200, path, self.page('users', users, params)
+        if path == '/trackers.json':
+            return 200, path, {'trackers': [named(TRACKERS, n + 1) for n
+                                            in range(len(TRACKERS))]}
+        if path == '/issue_statuses.json':
+            return 200, path, {'issue_statuses': [
+                {'id': n + 1, 'name': s[0], 'is_closed': s[1]}
+                for n, s in enumerate(STATUSES)]}
+        if path == '/enumerations/issue_priorities.json':
+            return 200, path, {'issue_priorities': [
+                named(PRIORITIES, n + 1) for n in range(len(PRIORITIES))]}
+        if path == '/queries.json':
+            return 200, path, self.page('queries', [], params)
+        return 404, path, None
+
+    def page(self, name, entries, params):
+        offset = int(params.get('offset', 0))
+        limit = min(int(params.get('limit', 25)), 100)
+        return {name: entries[offset:offset + limit],
+                'total_count': len(entries), 'offset': offset,
+                'limit': limit}
+
+    def change(self, method, path, data):
+        """Answer a POST, PUT or DELETE, returning (status, endpoint,
+        JSON).
+        """
+
+        match = re.match(r'^/projects/([^/]+)/issues\.json$', path)
+        if method == 'POST' and match:
+            project = self.project(match.group(1))
+            if project is None:
+                return 404, '/projects/{id}/issues.json', None
+            with self.lock:
+                ID = max(self.issues) + 1 if self.issues else 1
+                issue = self.issues[ID] = {
+                    'id': ID, 'project': {'id': project['id'],
+                                          'name': project['name']},
+                    'status': named([s[0] for s in STATUSES], 1),
+                    'priority': named(PRIORITIES, 2),
+                    'author': {'id': 1, 'name': 'User 1'},
+                    'created_on': stamp(ID), 'updated_on': stamp(ID),
+                    'journals': []}
+            self.update_issue(issue, data['issue'])
+            return 201, '/projects/{id}/issues.json', {
+                'issue': self.issue_json(issue)}
+        match = re.match(r'^/issues/(\d+)\.json$', path)
+        if method == 'PUT' and match:
+            issue = self.issues.get(int(match.group(1)))
+            if issue is None:
+                return 404, '/issues/{id}.json', None
+            self.update_issue(issue, data['issue'])
+            return 200, '/issues/{id}.json', None
+        match = re.match(r'^/issues/(\d+)/relations\.json$', path)
+        if method == 'POST' and match:
+            with self.lock:
+                ID = max(self.relations) + 1 if self.relations else 1
+                relation = self.relations[ID] = dict(
+                    data['relation'], id=ID, issue_id=int(match.group(1)),
+                    delay=None)
+            return 201, '/issues/{id}/relations.json', {
+                'relation': relation}
+        match = re.match(r'^/relations/(\d+)\.json$', path)
+        if method == 'DELETE' and match:
+            if self.relations.pop(int(match.group(1)), None) is None:
+                return 404, '/relations/{id}.json', None
+            return 200, '/relations/{id}.json', None
+        return 404, path, None
+
+    def update_issue(self, issue, fields):
+        for field, entries in (('tracker', TRACKERS),
+                               ('status', [s[0] for s in STATUSES]),
+                               ('priority', PRIORITIES)):
+            if fields.get(field + '_id'):
+                issue[field] = named(entries, int(fields[field + '_id']))
+        if fields.get('assigned_to_id'):
+            ID = int(fields['assigned_to_id'])
+            issue['assigned_to'] = {'id': ID, 'name': 'User %s' % ID}
+        for field in ('subject', 'description'):
+            if field in fields:
+                issue[field] = fields[field]
+        if fields.get('notes'):
+            issue['journals'].append({'id': issue['id'] * 100 +
+                                      len(issue['journals']),
+                                      'user': {'id': 1, 'name': 'User 1'},
+                                      'notes': fields['notes'],
+                                      'created_on': issue['updated_on'],
+                                      'details': []})
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive, like a real server
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one go, not a packet per header
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        redmine = self.server.redmine
+        with redmine.lock:
+            redmine.stats['connections'] += 1
+
+    def answer(self):
+        redmine = self.server.redmine
+        url = urlparse.urlparse(self.path)
+        params = dict((k, v[-1]) for k, v in
+                      urlparse.parse_qs(url.query).items())
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        with redmine.lock:
+            overloaded = redmine.overload > 0
+            redmine.overload -= overloaded
+        if overloaded:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            redmine.count('overloaded', len(body), 0)
+            return
+        if self.command == 'GET':
+            status, endpoint, data = redmine.get(url.path, params)
+        else:
+            status, endpoint, data = redmine.change(
+                self.command, url.path, json.loads(body) if body else {})
+        out = json.dumps(data) if data is not None else ''
+        etag = None
+        if self.command == 'GET' and status == 200:
+            # Like Rails: an ETag from the body, and 304 if it matches
+            etag = '"%s"' % hashlib.md5(out).hexdigest()
+            if self.headers.get('If-None-Match') == etag:
+                status, out = 304, ''
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+        redmine.count('%s %s' % (self.command, endpoint), len(body),
+                      len(out))
+
+    do_GET = do_POST = do_PUT = do_DELETE = answer
+
+    def log_message(self, *args):
+        pass
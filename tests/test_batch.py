@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import mock
+
+from src.rore.batch import completed, read_operations, ResultLog, run_batch
+from src.rore.cache import MetadataCache
+from src.rore.client import Redmine
+from src.rore.output import JsonLinesWriter
+from src.rore.shell import create_parser
+from tests.fake_redmine import FakeRedmine
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rmine = mock.MagicMock(cache=MetadataCache(), issue_cache={},
+                                    tracer=None)
+        self.rmine.cache.set('trackers', [{'id': 1, 'name': 'Bug'}])
+        self.rmine.cache.set('statuses', [{'id': 5, 'name': 'Closed'}])
+        self.rmine.cache.set('projects', [{'id': 3, 'identifier': 'deploy',
+                                           'name': 'Deploy'}])
+        self.rmine.issue.create.return_value = mock.Mock(id=100)
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = os.path.join(self.tmpdir, 'results.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_jsonl_and_csv(self):
+        ops = read_operations(StringIO('{"op": "close", "id": 1}\n\n'
+                                       '{"op": "close", "id": 2, '
+                                       '"key": "b"}\n'))
+        self.assertEqual(ops, [(u'1', {'op': 'close', 'id': 1}),
+                               (u'b', {'op': 'close', 'id': 2})])
+        ops = read_operations(StringIO('op,id,notes\nclose,3,\n'), 'csv')
+        self.assertEqual(ops, [(u'1', {'op': u'close', 'id': u'3'})])
+        self.assertRaises(RuntimeError, read_operations, StringIO('{'))
+
+    def test_run_and_resume(self):
+        ops = [(u'1', {'op': 'create', 'subject': 'Disk full'}),
+               (u'2', {'op': 'close', 'id': 7, 'notes': 'Done'}),
+               (u'3', {'op': 'update', 'id': 8, 'type': 'Nope'}),
+               (u'4', {'op': 'update', 'id': 9, 'type': 'Nope'})]
+        log = ResultLog(self.log)
+        failed = run_batch(self.rmine, ops, {'type': 'Bug',
+                                             'project': 'deploy'}, 2, log)
+        log.close()
+        self.assertEqual(failed, 2)
+        self.rmine.issue.create.assert_called_once_with(
+            project_id=3, subject='Disk full', tracker_id=1)
+        self.rmine.issue.update.assert_called_once_with(7, status_id=5,
+                                                        notes='Done')
+        # The unknown type was only looked for once, then refetched once
+        self.assertEqual(self.rmine.tracker.all.call_count, 1)
+        self.assertEqual(completed(self.log), set([u'1', u'2']))
+        with open(self.log) as fh:
+            results = sorted((json.loads(line) for line in fh),
+                             key=lambda r: r['key'])
+        self.assertEqual(results[0]['id'], 100)
+        self.assertEqual(results[2]['error'], 'Unknown issue type Nope')
+
+
+class CreateFromFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redmine = FakeRedmine(issues=10, relations=0).start()
+        self.rmine = Redmine(self.redmine.url, key='abc',
+                             cache=MetadataCache())
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'tickets.csv')
+
+    def tearDown(self):
+        self.rmine.session.close()
+        self.redmine.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def create(self, rows, *argv):
+        with open(self.path, 'w') as fh:
+            fh.write(rows)
+        args = create_parser().parse_args(
+            ['issues', '--create', '--from-file', self.path, '--type',
+             'Bug', '--jobs', '4'] + list(argv))
+        out = StringIO()
+        args.output = JsonLinesWriter(out)
+        self.redmine.reset()
+        with mock.patch('src.rore.shell.LOG') as self.log:
+            status = args.command(args, self.rmine)
+        return status, [json.loads(line) for line in
+                        out.getvalue().splitlines()]
+
+    def test_create_and_relate(self):
+        status, rows = self.create(
+            'key,subject,type,priority,relate_to,relation_type\n'
+            'epic,The epic,Feature,,,\n'
+            'a,Part A,,High,@epic,blocks\n'
+            'b,Part B,,,3,\n', '--project', 'project1')
+        self.assertEqual(status, 0, self.log.error.call_args_list)
+        self.assertEqual([r['key'] for r in rows], ['epic', 'a', 'b'])
+        ids = dict((r['key'], r['id']) for r in rows)
+        self.assertEqual(sorted(ids.values()), [11, 12, 13])
+        issue = self.redmine.issues[ids['a']]
+        self.assertEqual((issue['subject'], issue['tracker']['name'],
+                          issue['priority']['name']),
+                         ('Part A', 'Bug', 'High'))
+        self.assertEqual(self.redmine.issues[ids['epic']]['tracker']['name'],
+                         'Feature')
+        relations = sorted((r['issue_id'], r['issue_to_id'],
+                            r['relation_type'])
+                           for r in self.redmine.relations.values())
+        self.assertEqual(relations, sorted([(ids['a'], ids['epic'], 'blocks'),
+                                            (ids['b'], 3, 'relates')]))
+        # Each table is fetched once, whatever the rows ask for
+        requests = self.redmine.stats['requests']
+        self.assertEqual(requests['GET /trackers.json'], 1)
+        self.assertEqual(requests['GET /enumerations/issue_priorities.json'],
+                         1)
+
+    def test_nothing_created_if_a_row_is_wrong(self):
+        status = None
+        with self.assertRaises(RuntimeError):
+            status, rows = self.create(
+                'subject,priority,relate_to\n'
+                'Fine,,\n'
+                'Bad priority,Whenever,\n'
+                'Bad relation,,@7\n', '--project', 'project1')
+        self.assertEqual(self.log.error.call_count, 2)
+        self.assertEqual(len(self.redmine.issues), 10)
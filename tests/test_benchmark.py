@@ -0,0 +1,151 @@
+"""End to end benchmark against a fake Redmine.
+
+Each case runs rore in a fresh interpreter against tests/fake_redmine.py,
+with an empty cache, and records the requests it made by endpoint, the
+bytes each way, the connections opened and the wall clock time.  The
+tests hold each case to a request budget, so a change that makes rore
+chattier fails here.  Run this file directly to see the numbers, or with
+--json for something to compare runs with.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from tests.fake_redmine import FakeRedmine
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUNNER = ('import sys\n'
+          'sys.path.insert(0, %r)\n'
+          'from src.rore.shell import cmd\n'
+          'sys.exit(cmd())' % ROOT)
+
+IDS = [str(ID) for ID in range(1, 51)]
+
+# --jobs for the cases that take it, and so the most connections any case
+# should need
+JOBS = '4'
+
+# name: (arguments, most requests it may make).  Verbose issues, unless
+# given --journals 0, and sync also fetch the journals of every issue, one
+# request each.
+CASES = {
+    'projects': (['projects', '--list'], 1),
+    'users': (['users', '--me'], 1),
+    'issue': (['issues', '1'], 1),
+    'issues': (['issues'] + IDS, 1),
+    'issues-verbose': (['issues', '--verbose'] + IDS[:10], 12),
+    'issues-journals': (['issues', '--verbose', '--journals',
+                         '0'] + IDS[:10], 2),
+    'query': (['issues', '--query', '--limit', '50', '--oneline'], 1),
+    'query-all': (['issues', '--query', '--status', '*', '--format',
+                   'jsonl'], 2),
+    'query-filtered': (['issues', '--query', '--project', 'project2',
+                        '--type', 'Bug,Feature', '--priority', 'High',
+                        '--oneline'], 4),
+    'query-verbose': (['issues', '--query', '--verbose', '--limit', '20'],
+                      22),
+    'update': (['issues', '--update', '--status', 'In Progress', '--jobs',
+                JOBS, '--no-refresh'] + IDS[:10], 11),
+    'close': (['issues', '--close', '--notes', 'Done', '--jobs', JOBS] +
+              IDS[10:20], 12),
+    # A request per level of the walk, and one for the subtasks of each level
+    # but the last
+    'graph': (['issues', '--graph', '67', '--depth', '4', '--jobs', JOBS],
+              9),
+    'stats': (['issues', '--stats', '--jobs', JOBS], 6),
+    # More assignees than pages of issues, so they're counted from pages
+    'stats-assignee': (['issues', '--stats', '--group-by', 'assigned_to',
+                        '--status', '*'], 4),
+    'sync': (['sync', '--project', 'project1', '--jobs', JOBS], 205),
+}
+
+
+class Bench(object):
+    """A fake Redmine and a config pointing rore at it."""
+
+    def __init__(self, **data):
+        self.redmine = FakeRedmine(**data).start()
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = os.path.join(self.tmpdir, 'rore.cfg')
+
+    def close(self):
+        self.redmine.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def run(self, name):
+        """Run a case with a cold cache, get what it cost."""
+
+        cachedir = tempfile.mkdtemp(dir=self.tmpdir)
+        with open(self.config, 'w') as fh:
+            fh.write('[default]\nurl = %s\nkey = abc\ncache dir = %s\n' %
+                     (self.redmine.url, cachedir))
+        env = dict(os.environ, RORE_SOCKET=os.path.join(self.tmpdir, 'none'))
+        self.redmine.reset()
+        start = time.time()
+        with open(os.devnull, 'w') as devnull:
+            status = subprocess.call([sys.executable, '-c', RUNNER,
+                                      '--no-daemon', '-q', '-C',
+                                      self.config] + CASES[name][0],
+                                     stdout=devnull, env=env)
+        seconds = time.time() - start
+        stats = self.redmine.stats
+        return {'status': status, 'seconds': seconds,
+                'requests': sum(stats['requests'].values()),
+                'endpoints': dict(stats['requests']),
+                'bytes_in': stats['bytes_in'],
+                'bytes_out': stats['bytes_out'],
+                'connections': stats['connections']}
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.bench = Bench(projects=3, issues=200, relations=50)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.bench.close()
+
+    def test_cases(self):
+        for name in sorted(CASES):
+            result = self.bench.run(name)
+            self.assertEqual(result['status'], 0, '%s failed' % name)
+            budget = CASES[name][1]
+            self.assertTrue(result['requests'] <= budget,
+                            '%s made %s requests, budget is %s: %s' %
+                            (name, result['requests'], budget,
+                             result['endpoints']))
+            # One keep-alive connection per job
+            self.assertTrue(result['connections'] <= int(JOBS),
+                            '%s opened %s connections' %
+                            (name, result['connections']))
+
+
+if __name__ == '__main__':
+    bench = Bench(projects=5, issues=2000, relations=500)
+    try:
+        results = dict((name, bench.run(name)) for name in sorted(CASES))
+    finally:
+        bench.close()
+    if '--json' in sys.argv:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print('')
+    else:
+        print('%-16s %8s %8s %10s %10s %6s' % ('case', 'seconds',
+                                               'requests', 'bytes in',
+                                               'bytes out', 'conns'))
+        for name in sorted(results):
+            result = results[name]
+            print('%-16s %8.3f %8d %10d %10d %6d%s' % (
+                name, result['seconds'], result['requests'],
+                result['bytes_in'], result['bytes_out'],
+                result['connections'],
+                '' if result['status'] == 0 else '  (failed)'))
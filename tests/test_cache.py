@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.rore.cache import MetadataCache
+
+
+class MetadataCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'sub', 'default.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        cache = MetadataCache(self.path, url='https://rm')
+        cache.set('trackers', [{'id': 1, 'name': 'Bug'}])
+        cache = MetadataCache(self.path, url='https://rm')
+        self.assertEqual(cache.get('trackers'), [{'id': 1, 'name': 'Bug'}])
+
+    def test_expired(self):
+        cache = MetadataCache(self.path, url='https://rm', ttl=-1)
+        cache.set('trackers', [])
+        self.assertEqual(cache.get('trackers'), None)
+
+    def test_refresh_and_url_change(self):
+        MetadataCache(self.path, url='https://rm').set('statuses', [])
+        cache = MetadataCache(self.path, url='https://rm', refresh=True)
+        self.assertEqual(cache.get('statuses'), None)
+        cache = MetadataCache(self.path, url='https://other')
+        self.assertEqual(cache.get('statuses'), None)
@@ -0,0 +1,223 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from redmine import exceptions as rm_exc
+
+from src.rore import shell
+from src.rore.client import Engine, make_session, RateLimiter, Redmine
+from tests.fake_redmine import FakeRedmine
+
+
+class ClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.rmine = Redmine('https://rm/', key='abc', session=self.session,
+                             requests={'timeout': (1, 2)})
+
+    def _respond(self, status, body='{}'):
+        self.session.request.return_value = self._response(status, body)
+
+    def _response(self, status, body='{}', headers=None):
+        response = mock.Mock(status_code=status, content=body,
+                             headers=headers or {})
+        response.json.return_value = {'issue': {'id': 1}}
+        return response
+
+    def test_requests_go_through_session(self):
+        self._respond(200)
+        self.assertEqual(self.rmine.issue.get(1).id, 1)
+        args, kwargs = self.session.request.call_args
+        self.assertEqual(args, ('get', 'https://rm/issues/1.json'))
+        self.assertEqual(kwargs['params']['key'], 'abc')
+        self.assertEqual(kwargs['timeout'], (1, 2))
+
+    def test_errors_mapped(self):
+        self._respond(404)
+        self.assertRaises(rm_exc.ResourceNotFoundError,
+                          self.rmine.issue.get, 1)
+        self._respond(503)
+        self.assertRaises(rm_exc.UnknownError, self.rmine.issue.get, 1)
+
+    def test_session_retries(self):
+        session = make_session(pool_size=4, retries=5, gzip=False)
+        adapter = session.get_adapter('https://rm/')
+        self.assertEqual(adapter.max_retries.total, 5)
+        self.assertTrue(503 in adapter.max_retries.status_forcelist)
+        self.assertFalse(adapter.max_retries.is_retry('PUT', 503))
+        self.assertFalse(adapter.max_retries.is_retry('DELETE', 503))
+        self.assertTrue(adapter.max_retries.is_retry('GET', 503))
+        self.assertEqual(session.headers['Accept-Encoding'], 'identity')
+        session = make_session(statuses=(500,))
+        retry = session.get_adapter('https://rm/').max_retries
+        self.assertFalse(503 in retry.status_forcelist)
+
+    def test_throttle(self):
+        self._respond(200)
+        self.rmine.throttle = mock.Mock()
+        self.rmine.issue.get(1)
+        self.rmine.throttle.wait.assert_called_once_with()
+
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', return_value=100.0)
+    def test_rate_limiter(self, time, sleep):
+        limiter = RateLimiter(4)
+        limiter.wait()
+        limiter.wait()
+        limiter.wait()
+        self.assertEqual([c[0][0] for c in sleep.call_args_list],
+                         [0.25, 0.5])
+
+    @mock.patch('time.sleep')
+    def test_engine_retries_overloaded(self, sleep):
+        self.rmine.engine = Engine(4, retries=2, backoff=0)
+        self.session.request.side_effect = [
+            self._response(429, headers={'Retry-After': '0'}),
+            self._response(503), self._response(200)]
+        self.assertEqual(self.rmine.issue.get(1).id, 1)
+        self.assertEqual(self.session.request.call_count, 3)
+        self.assertEqual(self.rmine.engine.running, 0)
+        # Halved twice, then one more allowed after the success
+        self.assertEqual(self.rmine.engine.allowed, 2)
+
+        self.session.request.reset_mock()
+        self.session.request.side_effect = [self._response(503)] * 3
+        self.assertRaises(rm_exc.UnknownError, self.rmine.issue.get, 1)
+        self.assertEqual(self.session.request.call_count, 3)
+
+    def test_engine_changes_retried_only_on_429(self):
+        self.rmine.engine = Engine(4, backoff=0)
+        self.session.request.side_effect = [self._response(503)]
+        self.assertRaises(rm_exc.UnknownError, self.rmine.issue.create,
+                          subject='x', project_id=1)
+        self.assertEqual(self.session.request.call_count, 1)
+
+        for change in (lambda: self.rmine.issue.update(1, notes='hi'),
+                       lambda: self.rmine.issue.delete(1)):
+            self.session.request.reset_mock()
+            self.session.request.side_effect = [self._response(503),
+                                                self._response(200)]
+            self.assertRaises(rm_exc.UnknownError, change)
+            self.assertEqual(self.session.request.call_count, 1)
+
+        self.session.request.reset_mock()
+        self.session.request.side_effect = [self._response(429),
+                                            self._response(200)]
+        self.rmine.issue.update(1, notes='hi')
+        self.assertEqual(self.session.request.call_count, 2)
+
+        self.session.request.reset_mock()
+        self.session.request.side_effect = [self._response(429),
+                                            self._response(201)]
+        self.rmine.issue.create(subject='x', project_id=1)
+        self.assertEqual(self.session.request.call_count, 2)
+
+    def test_engine_releases_on_error(self):
+        self.rmine.engine = Engine(2)
+        self.session.request.side_effect = IOError('down')
+        self.assertRaises(IOError, self.rmine.issue.get, 1)
+        self.assertEqual(self.rmine.engine.running, 0)
+
+
+class EngineTestCase(unittest.TestCase):
+    @mock.patch('time.time', return_value=100.0)
+    def test_backs_off_and_recovers(self, time):
+        engine = Engine(8, backoff=0.5)
+        for pause in (0.5, 1.0):
+            engine.acquire()
+            self.assertTrue(engine.release(mock.Mock(status_code=503,
+                                                     headers={})))
+            self.assertEqual(engine.resume, time.return_value + pause)
+            time.return_value = engine.resume
+        self.assertEqual(engine.allowed, 2)
+        engine.acquire()
+        self.assertTrue(engine.release(mock.Mock(
+            status_code=429, headers={'Retry-After': '7'})))
+        self.assertEqual((engine.allowed, engine.resume), (1, 108.5))
+        time.return_value = 108.5
+        # One more allowed per run of as many successes as are allowed
+        for allowed in (2, 2, 3, 3, 3, 4):
+            engine.acquire()
+            self.assertFalse(engine.release(mock.Mock(status_code=200)))
+            self.assertEqual(engine.allowed, allowed)
+        self.assertEqual(engine.strikes, 0)
+
+    def test_limit(self):
+        engine = Engine(8)
+        engine.allowed = 2
+        engine.acquire()
+        engine.acquire()
+        self.assertEqual(engine.running, 2)
+        # A third turn waits until one is handed back
+        engine.cond.wait = mock.Mock(side_effect=lambda *a: engine.release())
+        engine.acquire()
+        self.assertEqual(engine.running, 2)
+        # Just handing a turn back doesn't count as a success
+        self.assertEqual(engine.successes, 0)
+
+
+class EngineConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.redmine = FakeRedmine(issues=20, relations=0).start()
+        self.config = os.path.join(self.tmpdir, 'rore.cfg')
+        with open(self.config, 'w') as fh:
+            fh.write('[default]\nurl = %s\nkey = abc\ncache dir = %s\n'
+                     'pool size = 2\nretry backoff = 0\nengine = threads\n'
+                     'concurrency = 4\n' % (self.redmine.url, self.tmpdir))
+
+    def tearDown(self):
+        self.redmine.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def parse(self, *argv):
+        return shell.create_parser().parse_args(['-C', self.config] +
+                                                list(argv))
+
+    def test_threads_engine(self):
+        args = self.parse('issues', '--close', '1', '2', '3', '4', '5')
+        rmine = shell.connect_to_redmine(shell.load_config(args))
+        self.assertEqual((rmine.engine.limit, rmine.jobs), (4, 4))
+        adapter = rmine.session.get_adapter(self.redmine.url)
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertFalse(429 in adapter.max_retries.status_forcelist)
+        self.redmine.overload = 3
+        with mock.patch.object(shell.LOG, 'info'):
+            self.assertEqual(shell.run_command(args, rmine), 0)
+        self.assertEqual(args.jobs, 4)
+        requests = self.redmine.stats['requests']
+        # The fake answers 429, after which even a PUT can go again
+        self.assertEqual(requests['overloaded'], 3)
+        self.assertEqual(requests['PUT /issues/{id}.json'], 5)
+        self.assertTrue(all(issue['status']['name'] == 'Closed'
+                            for ID, issue in self.redmine.issues.items()
+                            if ID <= 5))
+
+    def test_out_of_retries(self):
+        args = self.parse('issues', '1')
+        rmine = shell.connect_to_redmine(shell.load_config(args))
+        rmine.engine = None
+        rmine.session = make_session(retries=1, backoff=0)
+        self.redmine.overload = 5
+        self.assertRaises(rm_exc.UnknownError, rmine.issue.get, 1)
+        self.assertEqual(self.redmine.stats['requests']['overloaded'], 2)
+        # Changes aren't sent again
+        self.redmine.reset()
+        self.assertRaises(rm_exc.UnknownError, rmine.issue.update, 1,
+                          notes='x')
+        self.assertEqual(self.redmine.stats['requests']['overloaded'], 1)
+
+    def test_jobs_given(self):
+        args = self.parse('issues', '--close', '1', '--jobs', '2')
+        shell.default_jobs(args, mock.Mock(jobs=4))
+        self.assertEqual(args.jobs, 2)
+
+    def test_unknown_engine(self):
+        with open(self.config, 'a') as fh:
+            fh.write('engine = asyncio\n')
+        with mock.patch.object(shell.LOG, 'error') as error:
+            self.assertRaises(SystemExit, shell.load_config,
+                              self.parse('issues', '1'))
+        self.assertIn('Unknown engine asyncio', error.call_args[0][0])
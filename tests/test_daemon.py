@@ -0,0 +1,102 @@
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from StringIO import StringIO
+
+import mock
+
+from src.rore import daemon, shell
+from src.rore.cache import MetadataCache
+
+
+class DaemonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'daemon.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def serve(self):
+        server = daemon.listen(self.path)
+        server.local.out = server.local.err = None
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def forward(self, argv):
+        out, err = StringIO(), StringIO()
+        with mock.patch('sys.stdout', out), mock.patch('sys.stderr', err):
+            status = daemon.forward(argv, '/nonexistent', self.path)
+        return status, out.getvalue(), err.getvalue()
+
+    def test_no_daemon(self):
+        self.assertEqual(daemon.forward(['users'], '/nonexistent',
+                                        self.path), None)
+        # A socket nobody listens on any more
+        daemon.listen(self.path).server_close()
+        self.assertEqual(daemon.forward(['users'], '/nonexistent',
+                                        self.path), None)
+
+    def test_socket_is_private(self):
+        self.serve()
+        self.assertEqual(os.stat(self.path).st_mode & 0o077, 0)
+        self.assertRaises(RuntimeError, daemon.listen, self.path)
+
+    def test_forward_output_and_status(self):
+        server = self.serve()
+        rmine = mock.MagicMock(cache=MetadataCache(), issue_cache={},
+                               tracer=None)
+        rmine.copy.return_value = rmine
+        rmine.project.all.return_value = [[('id', 1), ('name', 'deploy')]]
+        config = {'configfile': '/nonexistent', 'site': 'default',
+                  'url': 'http://redmine', 'refresh_cache': False}
+        server.clients[('/nonexistent', 'default')] = (config, rmine)
+        with mock.patch('src.rore.shell.load_config', return_value=config):
+            self.assertEqual(self.forward(['projects', '--list',
+                                           '--format', 'jsonl']),
+                             (0, '{"id": 1, "name": "deploy"}\n', ''))
+            status, out, err = self.forward(['projects', '--bogus'])
+        self.assertEqual(status, 2)
+        self.assertIn('unrecognized arguments: --bogus', err)
+
+    def test_forward_reader_gone(self):
+        server = self.serve()
+        rmine = mock.MagicMock(cache=MetadataCache(), issue_cache={},
+                               tracer=None)
+        rmine.copy.return_value = rmine
+        rmine.project.all.return_value = [[('id', 1), ('name', 'deploy')]]
+        config = {'configfile': '/nonexistent', 'site': 'default',
+                  'url': 'http://redmine', 'refresh_cache': False}
+        server.clients[('/nonexistent', 'default')] = (config, rmine)
+        out = mock.Mock()
+        out.write.side_effect = IOError(errno.EPIPE, 'Broken pipe')
+        with mock.patch('src.rore.shell.load_config', return_value=config):
+            with mock.patch('sys.stdout', out):
+                status = daemon.forward(['projects', '--list'],
+                                        '/nonexistent', self.path)
+        self.assertEqual(status, 1)
+
+    def test_forwardable(self):
+        parse = shell.create_parser().parse_args
+        self.assertTrue(shell.forwardable(parse(['issues', '1'])))
+        self.assertFalse(shell.forwardable(parse(['--trace-json', 'out.json',
+                                                  'issues', '1'])))
+
+    def test_channel_keeps_order(self):
+        sent = []
+        conn = mock.Mock(sendall=sent.append)
+        out = daemon.Channel(conn, 'out')
+        err = daemon.Channel(conn, 'err', buffered=False, before=out)
+        out.write('one\n')
+        err.write(u'two\n')
+        out.write('three\n')
+        out.flush()
+        self.assertEqual(sent, ['{"out": "one\\n"}\n', '{"err": "two\\n"}\n',
+                                '{"out": "three\\n"}\n'])
@@ -0,0 +1,102 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from src.rore.cache import MetadataCache
+from src.rore.client import Redmine
+from src.rore.export import Exporter, MANIFEST, shard_name
+from src.rore.shell import create_parser
+from tests.fake_redmine import FakeRedmine
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dir = os.path.join(self.tmpdir, 'out')
+        self.redmine = FakeRedmine(projects=1, issues=45).start()
+        self.rmine = Redmine(self.redmine.url, key='abc',
+                             cache=MetadataCache())
+
+    def tearDown(self):
+        self.rmine.session.close()
+        self.redmine.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def export(self, *argv):
+        args = create_parser().parse_args(
+            ['export', '--project', 'project1', '--dir', self.dir,
+             '--page-size', '10', '--jobs', '3'] + list(argv))
+        self.redmine.reset()
+        return args.command(args, self.rmine)
+
+    def exported(self):
+        issues = []
+        for page in range(5):
+            path = os.path.join(self.dir, shard_name(page))
+            if os.path.exists(path):
+                issues.extend(json.loads(line) for line in gzip.open(path))
+        return issues
+
+    def manifest(self):
+        with open(os.path.join(self.dir, MANIFEST)) as fh:
+            return json.load(fh)
+
+    def test_export(self):
+        self.assertEqual(self.export(), 0)
+        issues = self.exported()
+        self.assertEqual([i['id'] for i in issues], range(1, 46))
+        self.assertEqual(issues[0]['journals'],
+                         self.redmine.issues[1]['journals'])
+        self.assertEqual(issues[0]['relations'],
+                         self.redmine.relations_of(1))
+        manifest = self.manifest()
+        self.assertTrue(manifest['complete'])
+        self.assertEqual(manifest['newest'], self.redmine.issues[45][
+            'updated_on'])
+        requests = self.redmine.stats['requests']
+        self.assertEqual(requests['GET /issues.json'], 5)
+        self.assertEqual(requests['GET /issues/{id}.json'], 45)
+
+    def fail_page_3(self):
+        fetch_page = Exporter.fetch_page
+
+        def fail_page_3(exporter, page):
+            if page == 3:
+                raise RuntimeError('Lost connection')
+            return fetch_page(exporter, page)
+
+        with mock.patch.object(Exporter, 'fetch_page', fail_page_3):
+            self.assertEqual(self.export('--no-journals'), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.dir,
+                                                     shard_name(3))))
+
+    def test_resume(self):
+        self.fail_page_3()
+        self.assertEqual(self.export('--no-journals'), 0)
+        # Page 4 was done after the gap, so it is fetched again
+        self.assertEqual(dict(self.redmine.stats['requests']),
+                         {'GET /issues.json': 2})
+        self.assertEqual(sorted(i['id'] for i in self.exported()),
+                         range(1, 46))
+        # Not the same export
+        self.assertRaises(RuntimeError, self.export)
+
+    def test_resume_after_deletion(self):
+        self.fail_page_3()
+        # Would move issue 31 onto page 2, which is done
+        del self.redmine.issues[5]
+        self.assertEqual(self.export('--no-journals'), 0)
+        self.assertEqual(sorted(i['id'] for i in self.exported()),
+                         range(1, 46))
+        self.assertEqual(self.manifest()['pages']['4']['last'], 45)
+
+    def test_since(self):
+        since = self.redmine.issues[41]['updated_on']
+        self.assertEqual(self.export('--since', since), 0)
+        self.assertEqual([i['id'] for i in self.exported()],
+                         range(41, 46))
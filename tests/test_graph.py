@@ -0,0 +1,89 @@
+import json
+import unittest
+from StringIO import StringIO
+
+from src.rore.client import Redmine
+from src.rore.graph import walk, write_dot
+from src.rore.output import JsonLinesWriter
+from src.rore.shell import create_parser, issues
+from tests.fake_redmine import FakeRedmine
+
+
+class GraphTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redmine = FakeRedmine(issues=60, relations=80).start()
+        self.rmine = Redmine(self.redmine.url, key='abc')
+        self.rmine.batch_size = 10
+
+    def tearDown(self):
+        self.rmine.session.close()
+        self.redmine.stop()
+
+    def expected(self, root, depth):
+        """Breadth first over the fake's relations, one issue at a time."""
+
+        seen = {root: 0}
+        level = [root]
+        for distance in range(1, depth + 1):
+            found = set()
+            for ID in level:
+                for rel in self.redmine.relations_of(ID):
+                    for other in (rel['issue_id'], rel['issue_to_id']):
+                        if other not in seen:
+                            found.add(other)
+            for ID in found:
+                seen[ID] = distance
+            level = found
+        return seen
+
+    def test_walk_fetches_each_level_together(self):
+        graph = walk(self.rmine, 1, depth=3, jobs=4)
+        self.assertEqual(graph.depth, self.expected(1, 3))
+        levels = [len([ID for ID, d in graph.depth.items() if d == n])
+                  for n in range(4)]
+        # The levels' issues, and the subtasks of all but the last
+        batches = (sum(-(-n // 10) for n in levels) +
+                   sum(-(-n // 10) for n in levels[:-1]))
+        self.assertEqual(
+            self.redmine.stats['requests']['GET /issues.json'], batches)
+        for source, target, kind in graph.edges:
+            self.assertIn(source, graph.depth)
+            self.assertIn(target, graph.depth)
+
+    def test_whole_component_without_depth(self):
+        graph = walk(self.rmine, 1)
+        self.assertEqual(graph.depth, self.expected(1, 60))
+
+    def test_parents_and_subtasks(self):
+        self.redmine.relations.clear()
+        self.redmine.issues[2]['parent'] = {'id': 1}
+        self.redmine.issues[3]['parent'] = {'id': 2}
+        self.redmine.issues[4]['parent'] = {'id': 1}
+        self.redmine.issues[5]['parent'] = {'id': 3}
+        graph = walk(self.rmine, 2, depth=2)
+        self.assertEqual(graph.depth, {2: 0, 1: 1, 3: 1, 4: 2, 5: 2})
+        self.assertEqual(graph.edges, set([(2, 1, 'parent'),
+                                           (3, 2, 'parent'),
+                                           (4, 1, 'parent'),
+                                           (5, 3, 'parent')]))
+        out = StringIO()
+        write_dot(graph, out)
+        self.assertIn('  2 [label="#2 ', out.getvalue())
+        self.assertIn('  3 -> 2 [label="parent", style=dashed];\n',
+                      out.getvalue())
+
+    def test_records(self):
+        args = create_parser().parse_args(['issues', '--graph', '1',
+                                           '--depth', '1'])
+        out = StringIO()
+        args.output = JsonLinesWriter(out)
+        issues(args, self.rmine)
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(records[0]['depth'], 0)
+        self.assertEqual(set(r['id'] for r in records),
+                         set(self.expected(1, 1)))
+        edges = [(r['id'], e['issue_to_id']) for r in records
+                 for e in r['edges'] if 1 in (r['id'], e['issue_to_id'])]
+        self.assertEqual(sorted(edges), sorted(
+            (rel['issue_id'], rel['issue_to_id'])
+            for rel in self.redmine.relations_of(1)))
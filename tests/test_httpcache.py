@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from src.rore.client import Redmine
+from src.rore.httpcache import request_key, ResponseCache
+from src.rore.shell import bulk_apply
+from src.rore.trace import Tracer
+from tests.fake_redmine import FakeRedmine
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'default.http.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _response(self, body, etag='"x"'):
+        return mock.Mock(content=body, headers={'ETag': etag})
+
+    def test_key_ignores_api_key(self):
+        self.assertEqual(request_key('https://rm/issues.json',
+                                     {'key': 'abc', 'offset': 0}),
+                         request_key('https://rm/issues.json',
+                                     {'offset': 0, 'key': 'def'}))
+
+    def test_store_and_revalidate(self):
+        cache = ResponseCache(self.path)
+        self.assertEqual(cache.validators('a'), {})
+        cache.store('a', self._response('{"a": 1}'))
+        # Nothing to revalidate with, so nothing to keep
+        cache.store('b', mock.Mock(content='{}', headers={}))
+        self.assertEqual(cache.validators('a'), {'If-None-Match': '"x"'})
+        self.assertEqual(cache.get('a'), '{"a": 1}')
+        self.assertEqual(cache.get('b'), None)
+
+    def test_least_recently_used_evicted(self):
+        cache = ResponseCache(self.path, max_size=25)
+        for key in 'abc':
+            cache.store(key, self._response('x' * 10))
+            # Keep a in use
+            cache.get('a')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 'x' * 10)
+        self.assertEqual(cache.get('c'), 'x' * 10)
+
+    def test_new_cache_shared_by_threads(self):
+        for attempt in range(5):
+            cache = ResponseCache('%s.%s' % (self.path, attempt))
+
+            def use(n):
+                cache.store(str(n), self._response('{}'))
+                cache.validators(str(n))
+
+            results = bulk_apply(use, range(16), 16)
+            self.assertEqual([error for n, error in results], [None] * 16)
+
+
+class RevalidateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.redmine = FakeRedmine().start()
+
+    def tearDown(self):
+        self.redmine.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_unchanged_issue_served_locally(self):
+        cache = ResponseCache(os.path.join(self.tmpdir, 'default.http.db'))
+        rmine = Redmine(self.redmine.url, key='abc', response_cache=cache)
+        self.addCleanup(rmine.session.close)
+        rmine.tracer = Tracer()
+        first = rmine.issue.get(1, include='journals')
+        sent = self.redmine.stats['bytes_out']
+        again = rmine.issue.get(1, include='journals')
+        self.assertEqual(self.redmine.stats['bytes_out'], sent)
+        self.assertEqual(again.subject, first.subject)
+        self.assertEqual(len(again.journals), len(first.journals))
+        self.assertEqual(rmine.tracer.counters['http cache hits'], 1)
+        # Changed on the server, so fetched again
+        self.redmine.issues[1]['subject'] = 'Changed'
+        self.assertEqual(rmine.issue.get(1, include='journals').subject,
+                         'Changed')
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from src.rore.mirror import Mirror
+
+
+def issue(ID, project, status, subject, tracker='Bug', notes=None):
+    return {'id': ID, 'project': {'id': project, 'name': 'p%s' % project},
+            'tracker': {'id': 1, 'name': tracker},
+            'status': {'id': status, 'name': 's%s' % status},
+            'priority': {'id': 2, 'name': 'Normal'},
+            'subject': subject, 'description': '',
+            'updated_on': '2014-12-0%sT00:00:00Z' % ID,
+            'journals': [{'id': 1, 'notes': notes}] if notes else []}
+
+
+class MirrorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.mirror = Mirror(os.path.join(self.tmpdir, 'default.db'))
+        self.mirror.set_projects([(1, 'ops', 'Ops', None),
+                                  (2, 'deploy', 'Deploy', 1),
+                                  (3, 'other', 'Other', None)])
+        self.mirror.set_statuses([(1, 'New', False), (5, 'Closed', True)])
+        self.mirror.store(issue(1, 1, 1, 'Disk full'))
+        self.mirror.store(issue(2, 2, 5, 'Deploy broken', notes='rolled back'))
+        self.mirror.store(issue(3, 3, 1, 'Other thing', tracker='Feature'))
+        self.mirror.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def ids(self, **kwargs):
+        return [data['id'] for data in self.mirror.query(**kwargs)]
+
+    def test_status(self):
+        self.assertEqual(self.ids(), [3, 1])
+        self.assertEqual(self.ids(status='closed'), [2])
+        self.assertEqual(self.ids(status='*'), [3, 2, 1])
+
+    def test_project_tree(self):
+        self.assertEqual(self.ids(project='ops', status='*'), [2, 1])
+        self.assertEqual(self.ids(project='ops', status='*',
+                                  subprojects=False), [1])
+
+    def test_search_and_trackers(self):
+        self.assertEqual(self.ids(status='*', search='rolled'), [2])
+        self.assertEqual(self.ids(trackers=['feature']), [3])
+
+    def test_search_fresh_mirror(self):
+        self.mirror.store(issue(4, 1, 1, u'Caf\xe9 menu broken'))
+        self.mirror.commit()
+        self.mirror = Mirror(os.path.join(self.tmpdir, 'default.db'))
+        self.assertEqual(self.ids(status='*', search=u'caf\xe9'), [4])
+        # Only the text is searched, not the JSON around it
+        self.assertEqual(self.ids(status='*', search='subject'), [])
+
+    def test_prune(self):
+        self.mirror.prune(self.mirror.project_ids('ops'), [2])
+        self.assertEqual(sorted(self.mirror.get([1, 2, 3])), [2, 3])
@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+import mock
+
+from src.rore import shell
+from src.rore.multisite import LabelStream, run_sites
+from tests.fake_redmine import FakeRedmine
+
+
+class MultiSiteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.redmines = [FakeRedmine(issues=5, relations=0, seed=n).start()
+                         for n in range(2)]
+        self.config = os.path.join(self.tmpdir, 'rore.cfg')
+        with open(self.config, 'w') as fh:
+            for name, url in [('one', self.redmines[0].url),
+                              ('two', self.redmines[1].url),
+                              # Nothing listens on port 1
+                              ('down', 'http://127.0.0.1:1')]:
+                fh.write('[%s]\nurl = %s\nkey = abc\ncache dir = %s\n'
+                         'retries = 0\n' % (name, url, self.tmpdir))
+
+    def tearDown(self):
+        for redmine in self.redmines:
+            redmine.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def run_sites(self, *argv):
+        args = shell.create_parser().parse_args(['-C', self.config] +
+                                                list(argv))
+        out = StringIO()
+        with mock.patch('sys.stdout', out):
+            with mock.patch.object(shell.LOG, 'error') as error:
+                status = run_sites(args)
+        return status, out.getvalue(), error
+
+    def test_labelled_text(self):
+        status, out, error = self.run_sites('--site', 'one,two', 'issues',
+                                            '--query', '--oneline',
+                                            '--status', '*')
+        self.assertEqual(status, 0)
+        lines = out.splitlines()
+        self.assertEqual(len(lines), 10)
+        for site in ('one', 'two'):
+            self.assertEqual(len([l for l in lines
+                                  if l.startswith('[%s] ' % site)]), 5)
+        self.assertFalse(error.called)
+
+    def test_failed_site_reported(self):
+        status, out, error = self.run_sites('--site', 'all', 'projects',
+                                            '--list', '--format', 'jsonl')
+        self.assertEqual(status, 1)
+        records = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual(sorted(set(r['site'] for r in records)),
+                         ['one', 'two'])
+        self.assertEqual(len(records), 6)
+        message, = error.call_args[0]
+        self.assertTrue(message.startswith('down failed: '))
+
+    def test_only_reads_run_on_several_sites(self):
+        parse = shell.create_parser().parse_args
+        for argv, ok in [(['issues', '--query'], True),
+                         (['issues', '1', '2'], True),
+                         (['projects', '--list'], True),
+                         (['issues', '--close', '1'], False),
+                         (['issues', '--query', '--watch'], False),
+                         (['issues', '--create', '--subject', 'x'], False),
+                         (['sync'], False)]:
+            args = parse(['--site', 'a,b'] + argv)
+            self.assertTrue(shell.several_sites(args))
+            self.assertFalse(shell.forwardable(args))
+            self.assertEqual(shell.runs_on_several_sites(args), ok, argv)
+        self.assertFalse(shell.several_sites(parse(['issues', '1'])))
+
+    def test_label_stream_writes_whole_lines(self):
+        out = StringIO()
+        stream = LabelStream(out, '[a] ', mock.MagicMock())
+        stream.write('one\ntw')
+        self.assertEqual(out.getvalue(), '[a] one\n')
+        stream.write(u'o\n')
+        stream.write('three')
+        stream.close()
+        self.assertEqual(out.getvalue(), '[a] one\n[a] two\n[a] three\n')
@@ -0,0 +1,40 @@
+import json
+import unittest
+from StringIO import StringIO
+
+from src.rore.output import get_writer
+
+
+RECORDS = [{'id': 1, 'subject': u'Disk full \u2603',
+            'status': {'id': 1, 'name': 'New'}},
+           {'id': 2, 'subject': 'Deploy',
+            'status': {'id': 5, 'name': 'Closed'}, 'relations': [{'id': 3}]}]
+
+
+class WriterTestCase(unittest.TestCase):
+    def write(self, fmt, fields=None):
+        stream = StringIO()
+        writer = get_writer(fmt, stream, fields)
+        for record in RECORDS:
+            writer.write('issue', record)
+        writer.close()
+        return stream.getvalue()
+
+    def test_text_has_no_writer(self):
+        self.assertEqual(get_writer('text', StringIO()), None)
+
+    def test_json(self):
+        self.assertEqual(json.loads(self.write('json')), RECORDS)
+        stream = StringIO()
+        get_writer('json', stream).close()
+        self.assertEqual(json.loads(stream.getvalue()), [])
+
+    def test_jsonl_fields(self):
+        lines = self.write('jsonl', ['id', 'status']).splitlines()
+        self.assertEqual(json.loads(lines[1]),
+                         {'id': 2, 'status': {'id': 5, 'name': 'Closed'}})
+
+    def test_csv(self):
+        lines = self.write('csv', ['id', 'status', 'subject']).splitlines()
+        self.assertEqual(lines[0], 'id,status,subject')
+        self.assertEqual(lines[1], '1,New,Disk full \xe2\x98\x83')
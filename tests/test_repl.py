@@ -0,0 +1,55 @@
+import unittest
+from StringIO import StringIO
+
+import mock
+
+from src.rore.cache import MetadataCache
+from src.rore.repl import RoreShell
+
+
+class RoreShellTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rmine = mock.MagicMock(cache=MetadataCache(), issue_cache={},
+                                    tracer=None)
+        self.rmine.cache.set('statuses', [{'id': 1, 'name': 'New'},
+                                          {'id': 2, 'name': 'In Progress'}])
+        self.shell = RoreShell(self.rmine)
+
+    def test_complete_values_from_cache(self):
+        line = 'issues --query --status '
+        self.assertEqual(self.shell.completedefault('', line, len(line),
+                                                    len(line)),
+                         ['In\\ Progress', 'New'])
+        line = 'issues --statu'
+        self.assertEqual(self.shell.completedefault('--statu', line, 7,
+                                                    len(line)),
+                         ['--status'])
+
+    def test_complete_commands(self):
+        self.assertEqual(self.shell.completenames('is'), ['issues'])
+        self.assertEqual(self.shell.completenames('d'), [])
+        self.assertEqual(self.shell.completenames('s'), ['sync'])
+
+    def test_commands_share_client(self):
+        # Bad arguments are reported, not fatal
+        self.shell.onecmd('issues --bogus')
+        self.shell.onecmd('issues --delete_relation 4')
+        self.rmine.issue_relation.delete.assert_called_once_with(4)
+
+    def test_create_uses_site_defaults(self):
+        self.rmine.defaults = {'type': 'Feature', 'project': 'deploy'}
+        self.rmine.cache.set('trackers', [{'id': 1, 'name': 'Bug'},
+                                          {'id': 2, 'name': 'Feature'}])
+        self.rmine.cache.set('projects', [{'id': 5, 'name': 'Deploy',
+                                           'identifier': 'deploy',
+                                           'parent': None}])
+        with mock.patch('sys.stdout', StringIO()):
+            self.shell.onecmd('issues --create --subject x --description y')
+        kwargs = self.rmine.issue.create.call_args[1]
+        self.assertEqual((kwargs['tracker_id'], kwargs['project_id']), (2, 5))
+
+    def test_refresh(self):
+        self.rmine.issue_cache[1] = object()
+        self.shell.onecmd('refresh')
+        self.assertEqual(self.rmine.issue_cache, {})
+        self.assertEqual(self.rmine.cache.get('statuses'), None)
@@ -1,4 +1,15 @@
-from src.rore.shell import create_parser
+from src.rore import shell
+from src.rore.cache import MetadataCache
+from src.rore.client import Redmine
+from src.rore.shell import bulk_apply, create_parser, get_filter, get_issues
+from src.rore.shell import get_priority, get_project, get_tracker, get_user
+from src.rore.shell import issue_journals, issues, iter_issues
+from src.rore.output import JsonLinesWriter
+from src.rore.shell import prefetch_related, report_bulk
+from redmine import exceptions as rm_exc
+from StringIO import StringIO
+import json
+import mock
 import unittest
 
 
@@ -16,3 +27,240 @@ class IssueTestCase(RoreTestCase):
 
     def test_issue_argument(self):
         pass
+
+    def test_update_needs_changes(self):
+        rmine = mock.MagicMock()
+        args = self.parser.parse_args(['issues', '--update', '--no-refresh',
+                                       '999'])
+        self.assertRaises(RuntimeError, issues, args, rmine)
+        self.assertFalse(rmine.issue.update.called)
+
+    def test_since_must_be_a_date(self):
+        args = self.parser.parse_args(['-v', 'issues', '--since',
+                                       '2014-06-02', '7'])
+        self.assertEqual(args.since, '2014-06-02')
+        for bad in ('yesterday', '2014-13-01', '06/02/2014'):
+            with mock.patch('sys.stderr'):
+                self.assertRaises(SystemExit, self.parser.parse_args,
+                                  ['issues', '--since', bad, '7'])
+
+    def test_no_refresh_records(self):
+        args = self.parser.parse_args(['issues', '--close', '--no-refresh',
+                                       '1', '2'])
+        out = StringIO()
+        args.output = JsonLinesWriter(out)
+        with mock.patch.object(shell.LOG, 'error'):
+            status = report_bulk(mock.MagicMock(issue_cache={}),
+                                 [(1, None), (2, RuntimeError('gone'))],
+                                 'close', args)
+        self.assertEqual(status, 1)
+        self.assertEqual([json.loads(line) for line in out.getvalue().split(
+            '\n') if line], [{'id': 1, 'action': 'close', 'error': None},
+                             {'id': 2, 'action': 'close', 'error': 'gone'}])
+
+    def test_journals_need_verbose(self):
+        args = self.parser.parse_args(['issues', '--journals', '3', '1'])
+        self.assertRaises(RuntimeError, issues, args, mock.MagicMock())
+
+
+class Resource(dict):
+    """Stands in for a python-redmine resource."""
+
+    def __iter__(self):
+        return iter(self.items())
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+class LookupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rmine = mock.MagicMock()
+        self.rmine.cache = MetadataCache()
+
+    def _tracker(self, tid, name):
+        return Resource(id=tid, name=name)
+
+    def test_tracker_cached(self):
+        self.rmine.tracker.all.return_value = [self._tracker(1, 'Bug')]
+        self.assertEqual(get_tracker(self.rmine, 'bug'), 1)
+        self.assertEqual(get_tracker(self.rmine, 'Bug'), 1)
+        self.assertEqual(self.rmine.tracker.all.call_count, 1)
+
+    def test_tracker_miss_refetches(self):
+        self.rmine.tracker.all.return_value = [self._tracker(1, 'Bug')]
+        get_tracker(self.rmine, 'Bug')
+        self.rmine.tracker.all.return_value.append(self._tracker(2, 'Epic'))
+        self.assertEqual(get_tracker(self.rmine, 'Epic'), 2)
+        self.assertRaises(RuntimeError, get_tracker, self.rmine, 'Nope')
+
+    def test_filter_values(self):
+        self.rmine.enumeration.filter.return_value = [
+            self._tracker(3, 'High'), self._tracker(4, 'Urgent')]
+        self.assertEqual(get_filter(self.rmine, get_priority, 'urgent, High'),
+                         '4|3')
+
+    def test_user_cached(self):
+        # Not an administrator, so each name is asked about once
+        self.rmine.user.all.side_effect = rm_exc.ForbiddenError
+        self.rmine.user.filter.return_value = [
+            Resource(id=5, login='jkeating', firstname='Jesse',
+                     lastname='Keating')]
+        self.assertEqual(get_user(self.rmine, 'Jesse'), 5)
+        self.assertEqual(get_user(self.rmine, 'jesse'), 5)
+        self.assertEqual(self.rmine.user.filter.call_count, 1)
+        self.assertEqual(self.rmine.user.all.call_count, 1)
+        # The server found it by the start of a name, which is only good
+        # enough for queries, and never remembered
+        with mock.patch.object(shell.LOG, 'warning') as warning:
+            self.assertEqual(get_user(self.rmine, 'Jes'), 5)
+        self.assertIn('Taking Jes to mean user jkeating',
+                      warning.call_args[0][0])
+        self.assertRaises(RuntimeError, get_user, self.rmine, 'Jes', True)
+        self.assertEqual(self.rmine.user.filter.call_count, 3)
+
+    def test_user_index(self):
+        self.rmine.user.all.return_value = [
+            Resource(id=5, login='jkeating', firstname='Jesse',
+                     lastname='Keating', mail='jesse@example.com'),
+            Resource(id=6, login='jmeridth', firstname='Jason',
+                     lastname='Meridth', mail='jason@example.com')]
+        self.assertEqual(get_user(self.rmine, 'JKeating'), 5)
+        self.assertEqual(get_user(self.rmine, 'jason meridth'), 6)
+        self.assertEqual(get_user(self.rmine, 'jesse@example.com'), 5)
+        with mock.patch.object(shell.LOG, 'warning') as warning:
+            self.assertEqual(get_user(self.rmine, 'jes'), 5)
+            self.assertEqual(get_user(self.rmine, 'jmeridht'), 6)
+        self.assertEqual(warning.call_count, 2)
+        self.assertRaises(RuntimeError, get_user, self.rmine, 'j')
+        self.assertRaises(RuntimeError, get_user, self.rmine, 'nobody')
+        # Changes need the exact name
+        self.assertEqual(get_user(self.rmine, 'jkeating', exact=True), 5)
+        self.assertRaises(RuntimeError, get_user, self.rmine, 'jes', True)
+        self.assertFalse(self.rmine.user.filter.called)
+
+    def test_project_refetched_when_nothing_matches(self):
+        self.rmine.project.all.return_value = [
+            Resource(id=1, identifier='deploy', name='Deploy')]
+        self.assertEqual(get_project(self.rmine, 'Deploy'), 1)
+        self.assertEqual(get_project(self.rmine, '1'), 1)
+        self.rmine.project.all.return_value.append(
+            Resource(id=2, identifier='deploys', name='More deploys'))
+        # Close enough to deploy for a query, from the cached table
+        with mock.patch.object(shell.LOG, 'warning') as warning:
+            self.assertEqual(get_project(self.rmine, 'deploys'), 1)
+        self.assertTrue(warning.called)
+        self.assertEqual(self.rmine.project.all.call_count, 1)
+        # A change needs the exact name, which the refetched table has
+        self.assertEqual(get_project(self.rmine, 'deploys', exact=True), 2)
+        self.assertEqual(self.rmine.project.all.call_count, 2)
+        self.rmine.project.all.return_value.append(
+            Resource(id=3, identifier='web', name='Web'))
+        self.assertEqual(get_project(self.rmine, 'web'), 3)
+        self.assertEqual(self.rmine.project.all.call_count, 3)
+
+
+class GetIssuesTestCase(unittest.TestCase):
+    def test_batches_keep_order(self):
+        rmine = mock.MagicMock(batch_size=2, issue_cache={})
+        rmine.issue.filter.side_effect = [
+            [mock.Mock(id=2), mock.Mock(id=1)], [mock.Mock(id=3)]]
+        missing = rmine.issue.new.return_value
+        ishs = get_issues(rmine, ['1', '2', '9', '3', '1'])
+        self.assertEqual([i.id for i in ishs[:2]], [1, 2])
+        self.assertTrue(ishs[2] is missing)
+        self.assertEqual([i.id for i in ishs[3:]], [3, 1])
+        self.assertEqual(rmine.issue.filter.call_args_list[0][1]['issue_id'],
+                         '1,2')
+        self.assertEqual(rmine.issue.filter.call_args_list[1][1]['issue_id'],
+                         '9,3')
+
+    def test_prefetch_related_dedupes(self):
+        rmine = mock.MagicMock(batch_size=100, issue_cache={})
+        one = mock.Mock(id=1, relations=[mock.Mock(issue_id=1, issue_to_id=3),
+                                         mock.Mock(issue_id=4, issue_to_id=1)])
+        two = mock.Mock(id=2, relations=[mock.Mock(issue_id=2, issue_to_id=3)])
+        rmine.issue.filter.return_value = [mock.Mock(id=3), mock.Mock(id=4)]
+        prefetch_related(rmine, [one, two])
+        self.assertEqual(rmine.issue.filter.call_count, 1)
+        self.assertEqual(rmine.issue.filter.call_args[1]['issue_id'], '3,4')
+        get_issues(rmine, [4, 3])
+        self.assertEqual(rmine.issue.filter.call_count, 1)
+
+
+class Page(list):
+    def __init__(self, items, total_count):
+        super(Page, self).__init__(items)
+        self.total_count = total_count
+
+
+class IterIssuesTestCase(unittest.TestCase):
+    def test_pages_fetched_lazily(self):
+        rmine = mock.MagicMock()
+        rmine.issue.filter.side_effect = [Page([1, 2], 5), Page([3, 4], 5),
+                                          Page([5], 5)]
+        ishes = iter_issues(rmine, {'project_id': 'foo'}, 2)
+        self.assertEqual(next(ishes), 1)
+        self.assertEqual(rmine.issue.filter.call_count, 1)
+        self.assertEqual(list(ishes), [2, 3, 4, 5])
+        self.assertEqual(rmine.issue.filter.call_args[1],
+                         {'project_id': 'foo', 'offset': 4, 'limit': 2})
+
+
+class BulkApplyTestCase(unittest.TestCase):
+    def _action(self, ID):
+        if ID == 2:
+            raise RuntimeError('nope')
+
+    def test_failures_collected_in_order(self):
+        for jobs in (1, 3):
+            results = bulk_apply(self._action, ['1', '2', '3'], jobs)
+            self.assertEqual([ID for ID, error in results], [1, 2, 3])
+            self.assertEqual([error is None for ID, error in results],
+                             [True, False, True])
+
+    @mock.patch('multiprocessing.pool.ThreadPool')
+    def test_interrupted(self, pool):
+        pool.return_value.map_async.return_value.get.side_effect = (
+            KeyboardInterrupt)
+        self.assertRaises(KeyboardInterrupt, bulk_apply, self._action,
+                          ['1', '2', '3'], 3)
+        self.assertTrue(pool.return_value.terminate.called)
+
+
+class JournalsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.session = mock.Mock()
+        self.rmine = Redmine('https://rm/', key='abc', session=self.session)
+        self.journals = [{'id': n, 'user': {'id': 1, 'name': 'Ann'},
+                          'notes': 'note %s' % n,
+                          'created_on': '2014-06-0%sT10:00:00Z' % n}
+                         for n in range(1, 6)]
+        response = mock.Mock(status_code=200, content='{}')
+        response.json.return_value = {'issue': {'id': 7,
+                                                'journals': self.journals}}
+        self.session.request.return_value = response
+        self.issue = self.rmine.issue.to_resource({'id': 7})
+
+    def test_last_journals_since(self):
+        kept = issue_journals(self.rmine, self.issue, 2, '2014-06-02')
+        self.assertEqual([j.notes for j in kept], ['note 4', 'note 5'])
+        kept = issue_journals(self.rmine, self.issue, 9, '2014-06-04')
+        self.assertEqual([j.id for j in kept], [4, 5])
+        kept = issue_journals(self.rmine, self.issue)
+        self.assertEqual(len(kept), 5)
+        args, kwargs = self.session.request.call_args
+        self.assertEqual(kwargs['params']['include'], 'journals')
+        # Nothing fetched is kept on the issue
+        self.assertEqual(dict(self.issue)['journals'], None)
+
+    def test_no_journals_fetches_nothing(self):
+        self.assertEqual(issue_journals(self.rmine, self.issue, 0), [])
+        self.assertFalse(self.session.request.called)
+
+    def test_journals_already_there(self):
+        issue = self.rmine.issue.to_resource({'id': 7,
+                                              'journals': self.journals})
+        kept = issue_journals(self.rmine, issue, 1)
+        self.assertEqual([j.id for j in kept], [5])
+        self.assertFalse(self.session.request.called)
@@ -0,0 +1,93 @@
+"""Startup time benchmark.
+
+Every run of rore pays for its imports, so commands that never talk to
+Redmine (--help, argument errors, shell completion) must not import
+redmine and requests, or sqlite3 for the caches.  Each case runs in a
+fresh interpreter.  The tests check what was imported, as timings are
+too noisy to test on a busy machine.  Run this file directly to see the
+median time of several runs.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 5
+
+SETUP = """
+import os, sys, time
+sys.path.insert(0, %r)
+start = time.time()
+""" % ROOT
+
+CASES = {
+    'import': 'import src.rore.shell',
+    'parse': ('from src.rore.shell import create_parser\n'
+              "create_parser().parse_args(['issues', '--query'])"),
+    'help': ('from src.rore.shell import create_parser\n'
+             "sys.stdout = open(os.devnull, 'w')\n"
+             'try:\n'
+             "    create_parser().parse_args(['issues', '--help'])\n"
+             'except SystemExit:\n'
+             '    pass'),
+    # What the cases above must stay well clear of
+    'redmine': 'import redmine',
+}
+
+# Modules startup must not pull in
+HEAVY = ['redmine', 'requests', 'sqlite3']
+
+REPORT = """
+import json
+sys.stdout = sys.__stdout__
+print(json.dumps([time.time() - start,
+                  [name for name in %r if name in sys.modules]]))
+""" % HEAVY
+
+
+def run_case(name):
+    """Run a case in a new interpreter, get (seconds, heavy modules it
+    imported).
+    """
+
+    out = subprocess.check_output([sys.executable, '-c',
+                                   SETUP + CASES[name] + REPORT])
+    seconds, imported = json.loads(out)
+    return seconds, imported
+
+
+def bench(name, runs=RUNS):
+    """Get the median time of a case, and the heavy modules it imported."""
+
+    results = [run_case(name) for _ in range(runs)]
+    times = sorted(seconds for seconds, _ in results)
+    return times[len(times) // 2], sorted(set(
+        module for _, imported in results for module in imported))
+
+
+class StartupTestCase(unittest.TestCase):
+    def check(self, name):
+        seconds, imported = run_case(name)
+        self.assertEqual(imported, [], '%s imported %s' %
+                         (name, ', '.join(imported)))
+
+    def test_import(self):
+        self.check('import')
+
+    def test_parse(self):
+        self.check('parse')
+
+    def test_help(self):
+        self.check('help')
+
+
+if __name__ == '__main__':
+    for name in sorted(CASES):
+        seconds, imported = bench(name)
+        print('%-8s %.4fs%s' % (name, seconds,
+                                ' (imports %s)' % ', '.join(imported)
+                                if imported else ''))
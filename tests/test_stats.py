@@ -0,0 +1,80 @@
+import collections
+import unittest
+from StringIO import StringIO
+
+import mock
+
+from src.rore.cache import MetadataCache
+from src.rore.client import Redmine
+from src.rore.output import CsvWriter
+from src.rore.shell import create_parser
+from src.rore.stats import issue_stats
+from tests.fake_redmine import FakeRedmine
+
+
+class StatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redmine = FakeRedmine(issues=300, users=3).start()
+        self.rmine = Redmine(self.redmine.url, key='abc',
+                             cache=MetadataCache())
+        self.out = StringIO()
+
+    def tearDown(self):
+        self.rmine.session.close()
+        self.redmine.stop()
+
+    def stats(self, qdict, *argv):
+        args = create_parser().parse_args(['issues', '--stats'] +
+                                          list(argv))
+        args.output = CsvWriter(self.out)
+        self.redmine.reset()
+        issue_stats(self.rmine, qdict, args)
+        rows = self.out.getvalue().splitlines()[1:]
+        self.out.truncate(0)
+        return dict((row.split(',')[2], int(row.split(',')[3]))
+                    for row in rows)
+
+    def expected(self, field, issues=None):
+        issues = issues or self.redmine.issues.values()
+        return collections.Counter(i.get(field, {}).get('name', 'none')
+                                   for i in issues)
+
+    def test_counted_by_server(self):
+        counts = self.stats({'status_id': '*'}, '--group-by', 'tracker',
+                            '--jobs', '3')
+        self.assertEqual(counts, self.expected('tracker'))
+        # The total, the trackers and one per tracker, never the issues
+        self.assertEqual(dict(self.redmine.stats['requests']),
+                         {'GET /issues.json': 4, 'GET /trackers.json': 1})
+
+    def test_only_statuses_the_query_allows(self):
+        counts = self.stats({}, '--group-by', 'status')
+        self.assertEqual(set(counts), set(['New', 'In Progress', 'Resolved',
+                                           'Feedback']))
+        counts = self.stats({'status_id': '5|6'}, '--group-by', 'status')
+        self.assertEqual(set(counts), set(['Closed', 'Rejected']))
+
+    def test_unassigned_counted(self):
+        counts = self.stats({'status_id': '*'}, '--group-by', 'assigned_to',
+                            '--page-size', '25')
+        expected = collections.Counter(
+            'User %s' % i['assigned_to']['id'] if 'assigned_to' in i
+            else 'none' for i in self.redmine.issues.values())
+        self.assertEqual(counts, expected)
+        self.assertEqual(self.redmine.stats['requests']['GET /issues.json'],
+                         5)
+
+    def test_streamed_when_cheaper(self):
+        counts = self.stats({'status_id': '*'}, '--group-by', 'assigned_to')
+        self.assertEqual(sum(counts.values()), 300)
+        # The total, then three pages
+        self.assertEqual(self.redmine.stats['requests']['GET /issues.json'],
+                         4)
+
+    def test_streamed_without_user_list(self):
+        self.rmine.cache.set('users-forbidden', True)
+        with mock.patch.object(self.rmine.user, 'all') as all_users:
+            counts = self.stats({'status_id': '*'}, '--group-by',
+                                'assigned_to', '--page-size', '25')
+        self.assertFalse(all_users.called)
+        self.assertEqual(sum(counts.values()), 300)
@@ -0,0 +1,58 @@
+import unittest
+
+import mock
+
+from src.rore.cache import MetadataCache
+from src.rore.client import Redmine
+from src.rore.trace import busy_time, endpoint, format_report, percentile
+from src.rore.trace import Tracer
+
+
+class TraceTestCase(unittest.TestCase):
+    def test_endpoint(self):
+        self.assertEqual(endpoint('get', 'https://rm/issues/12.json?a=1'),
+                         'GET /issues/{id}.json')
+        self.assertEqual(endpoint('post', 'https://rm/issues/3/relations.'
+                                  'json'), 'POST /issues/{id}/relations.json')
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([2.0], 95), 2.0)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_overlapping_requests_counted_once(self):
+        self.assertEqual(busy_time([(0, 2), (1, 3), (5, 6), (5.5, 5.7)]), 4)
+
+    def test_client_records_requests(self):
+        session = mock.Mock()
+        session.request.return_value = mock.Mock(status_code=200,
+                                                 content='{"x": 1}')
+        session.request.return_value.json.return_value = {
+            'issue': {'id': 1}}
+        rmine = Redmine('https://rm', key='abc', session=session,
+                        cache=MetadataCache())
+        rmine.tracer = Tracer()
+        rmine.issue.get(1)
+        rmine.issue.get(2)
+        rmine.cache.get('trackers')
+        report = rmine.tracer.report(rmine.cache)
+        self.assertEqual(report['requests'], 2)
+        self.assertEqual(report['bytes'], 16)
+        self.assertEqual(report['endpoints']['GET /issues/{id}.json']
+                         ['count'], 2)
+        self.assertEqual(report['counters']['metadata cache misses'], 1)
+        self.assertIn('GET /issues/{id}.json', format_report(report))
+
+    def test_cache_counts_are_per_command(self):
+        cache = MetadataCache()
+        cache.set('trackers', [])
+        cache.get('trackers')
+        cache.get('statuses')
+        # A later command on the same client
+        tracer = Tracer(cache)
+        cache.get('trackers')
+        counters = tracer.report(cache)['counters']
+        self.assertEqual((counters['metadata cache hits'],
+                          counters['metadata cache misses']), (1, 0))
@@ -0,0 +1,82 @@
+import json
+import unittest
+from StringIO import StringIO
+
+import mock
+
+from src.rore.client import Redmine
+from src.rore.output import JsonLinesWriter
+from src.rore.shell import create_parser
+from src.rore.watch import watch, Watcher
+from tests.fake_redmine import FakeRedmine
+
+
+class WatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.redmine = FakeRedmine(issues=30).start()
+        self.rmine = Redmine(self.redmine.url, key='abc')
+        self.args = create_parser().parse_args(
+            ['issues', '--query', '--watch', '--format', 'jsonl'])
+        self.out = StringIO()
+        self.args.output = JsonLinesWriter(self.out)
+
+    def tearDown(self):
+        self.rmine.session.close()
+        self.redmine.stop()
+
+    def records(self):
+        records = [json.loads(line) for line in
+                   self.out.getvalue().splitlines()]
+        self.out.truncate(0)
+        return records
+
+    def test_only_changes_fetched_and_printed(self):
+        watcher = Watcher(self.rmine, {'status_id': '*'}, self.args)
+        watcher.start()
+        self.assertEqual(len(self.records()), 30)
+        self.assertEqual(watcher.poll(), 0)
+        self.assertEqual(self.records(), [])
+
+        issue = self.redmine.issues[7]
+        issue['updated_on'] = '2015-01-01T00:00:00Z'
+        issue['journals'].append({'id': 999, 'notes': 'Still broken',
+                                  'user': {'id': 1, 'name': 'User 1'},
+                                  'created_on': '2015-01-01T00:00:00Z',
+                                  'details': []})
+        self.redmine.reset()
+        self.assertEqual(watcher.poll(), 1)
+        record, = self.records()
+        self.assertEqual((record['id'], record['change']), (7, 'updated'))
+        self.assertEqual([j['notes'] for j in record['journals']],
+                         ['Still broken'])
+        self.assertEqual(dict(self.redmine.stats['requests']),
+                         {'GET /issues.json': 1, 'GET /issues/{id}.json': 1})
+        # Seen at that timestamp already
+        self.assertEqual(watcher.poll(), 0)
+
+    def test_verbose_poll_prefetches_related(self):
+        self.args.verbose, self.args.output = True, None
+        watcher = Watcher(self.rmine,
+                          {'status_id': '*', 'include': 'relations'},
+                          self.args)
+        with mock.patch('sys.stdout', StringIO()):
+            watcher.start()
+            related = [ID for ID in sorted(self.redmine.issues)
+                       if self.redmine.relations_of(ID)][:5]
+            for ID in related:
+                self.redmine.issues[ID]['updated_on'] = '2015-01-01T00:00:00Z'
+            self.rmine.issue_cache.clear()
+            self.redmine.reset()
+            self.assertEqual(watcher.poll(), len(related))
+        # The changes and their related issues, then each one's journals
+        self.assertEqual(dict(self.redmine.stats['requests']),
+                         {'GET /issues.json': 2,
+                          'GET /issues/{id}.json': len(related)})
+
+    @mock.patch('time.sleep')
+    def test_interval_adapts(self, sleep):
+        self.args.interval, self.args.min_interval = 60, 10
+        with mock.patch.object(Watcher, 'poll', side_effect=[3, 2, 0, 0]):
+            watch(self.rmine, {}, self.args, polls=4)
+        self.assertEqual([c[0][0] for c in sleep.call_args_list],
+                         [60, 30, 15, 22.5])